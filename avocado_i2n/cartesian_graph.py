@@ -15,7 +15,11 @@ INTERFACE
 
 import os
 import re
+import heapq
+import bisect
 import logging
+import itertools
+import collections
 
 from avocado.core import test
 from avocado_vt.test import VirtTest
@@ -38,11 +42,28 @@ set_graph_logging_level(level=20)
 class TestObject(object):
     """A wrapper for a test object used in one or more test nodes."""
 
+    # statistics about the reuse of cached parameters among all test objects
+    params_hits = 0
+    params_misses = 0
+
     def params(self):
-        """Parameters property."""
-        return param.peek(self.parser)
+        """Parameters (cache) property."""
+        if self._params_cache is None:
+            TestObject.params_misses += 1
+            self._params_cache = param.peek(self.parser)
+        else:
+            TestObject.params_hits += 1
+        return self._params_cache
     params = property(fget=params)
 
+    def parser(self):
+        """Parser property invalidating the parameters cache on change."""
+        return self._parser
+    def set_parser(self, value):
+        self._parser = value
+        self._params_cache = None
+    parser = property(fget=parser, fset=set_parser)
+
     def id(self):
         return self.name
     id = property(fget=id)
@@ -60,6 +81,17 @@ class TestObject(object):
 
         self.current_state = "unknown"
 
+    @staticmethod
+    def params_hit_rate():
+        """
+        Get the hit rate of the parameters cache among all test objects.
+
+        :returns: ratio of parameter accesses without peeking into a parser
+        :rtype: float
+        """
+        accesses = TestObject.params_hits + TestObject.params_misses
+        return TestObject.params_hits / accesses if accesses > 0 else 0.0
+
     def is_permanent(self):
         """
         If the test object is permanent, it can only be created manually
@@ -72,6 +104,98 @@ class TestObject(object):
         return self.params.get("permanent_vm", "no") == "yes"
 
 
+class NodeQueue(object):
+    """
+    A collection of test nodes (e.g. parents or children of a test node)
+    iterated in order of addition but providing the next node to pick by
+    a priority derived from the precomputed ordering keys of the nodes.
+
+    Membership checks, additions, and removals take constant time.
+    """
+
+    def __init__(self, nodes=None):
+        """
+        Construct a queue of test nodes.
+
+        :param nodes: initial test nodes
+        :type nodes: [:py:class:`TestNode`] or None
+        """
+        self._heap = []
+        self._entries = collections.OrderedDict()
+        self._counter = itertools.count()
+        for node in nodes or []:
+            self.append(node)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.keys())
+
+    def __contains__(self, node):
+        return node in self._entries
+
+    def __repr__(self):
+        return repr(list(self._entries.keys()))
+
+    def append(self, node):
+        """
+        Add a new test node to the queue.
+
+        :param node: test node to add
+        :type node: :py:class:`TestNode`
+
+        Test nodes already in the queue are not repeated.
+        """
+        if node in self._entries:
+            return
+        entry = (node.order_key, next(self._counter), node)
+        self._entries[node] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, node):
+        """
+        Remove a test node from the queue.
+
+        :param node: test node to remove
+        :type node: :py:class:`TestNode`
+        :raises: :py:class:`ValueError` if the test node is not in the queue
+        """
+        if node not in self._entries:
+            raise ValueError("Test node %s is not in the queue" % node)
+        # the heap entry is only discarded once it reaches the top of the heap
+        del self._entries[node]
+
+    def first(self, exclude=None):
+        """
+        Get the test node with the highest priority, i.e. lowest ordering key,
+        with ties resolved by order of addition.
+
+        :param exclude: test nodes not to pick
+        :type exclude: {:py:class:`TestNode`} or None
+        :returns: the next test node to pick
+        :rtype: :py:class:`TestNode`
+        :raises: :py:class:`IndexError` if the queue is empty or all its test nodes are excluded
+
+        Excluded test nodes remain in the queue and only the entries of the
+        heap preceding the picked test node are visited to skip them.
+        """
+        while self._entries.get(self._heap[0][2]) is not self._heap[0]:
+            heapq.heappop(self._heap)
+        if not exclude or self._heap[0][2] not in exclude:
+            return self._heap[0][2]
+        # visit the heap entries in order through a heap of their positions
+        candidates = [(self._heap[0], 0)]
+        while len(candidates) > 0:
+            entry, index = heapq.heappop(candidates)
+            if self._entries.get(entry[2]) is entry and entry[2] not in exclude:
+                return entry[2]
+            for child_index in [2 * index + 1, 2 * index + 2]:
+                if child_index < len(self._heap):
+                    heapq.heappush(candidates, (self._heap[child_index], child_index))
+        raise IndexError("All test nodes of the queue are excluded")
+
+
 class TestNode(object):
     """
     A wrapper for all test relevant parts like parameters, parser, used
@@ -107,6 +231,7 @@ class TestNode(object):
         self.name = name
         self.parser = parser
         self._params_cache = None
+        self.order_key = TestNode.order_key_of(name)
 
         self.should_run = True
         self.should_clean = True
@@ -114,11 +239,11 @@ class TestNode(object):
         # list of objects involved in the test
         self.objects = objects
 
-        # lists of parent and children test nodes
-        self.setup_nodes = []
-        self.cleanup_nodes = []
-        self.visited_setup_nodes = []
-        self.visited_cleanup_nodes = []
+        # queues of parent and children test nodes
+        self.setup_nodes = NodeQueue()
+        self.cleanup_nodes = NodeQueue()
+        self.visited_setup_nodes = NodeQueue()
+        self.visited_cleanup_nodes = NodeQueue()
 
     def __repr__(self):
         return self.params["shortname"]
@@ -217,28 +342,24 @@ class TestNode(object):
         """
         return self.is_cleanup_ready() and not self.should_run
 
+    @staticmethod
+    def order_key_of(count):
+        """
+        Get a comparable ordering key for a node count (name).
+
+        :param str count: node count to get the key for
+        :returns: key with numeric parts of the count compared as numbers
+                  and the rest compared as strings
+        :rtype: ((int, int or str))
+
+        A count extending another count comes after it, e.g. "1a1" after "1".
+        """
+        return tuple((0, int(part)) if part.isdigit() else (1, part)
+                     for part in re.findall(r"\d+|\D+", count))
+
     @staticmethod
     def comes_before(node1, node2):
-        def compare_part(c1, c2):
-            match1, match2 = re.match(r"^(\d+)(\w+)(.+)", c1), re.match(r"^(\d+)(\w+)(.+)", c2)
-            if match1 is None and match2 is None:
-                pass
-            d1, b1, a1 = c1, None, None if match1 is None else match1.group(1, 2, 3)
-            d2, b2, a2 = c2, None, None if match2 is None else match2.group(1, 2, 3)
-            if not c1.isdigit() or not c2.isdigit():
-                return str(c1) < str(c2)
-            d1, d2 = int(d1), int(d2)
-            if d1 != d2:
-                return d1 < d2
-            elif a1 != a2:
-                if a1 is None:
-                    return False if a2 == "a" else True  # reverse order for "c" and cleanup
-                if a2 is None:
-                    return True if a1 == "a" else False  # reverse order for "c" and cleanup
-                return a1 < a2
-            else:
-                return compare_part(b1, b2)
-        return compare_part(node1.count, node2.count)
+        return node1.order_key < node2.order_key
 
     def pick_next_parent(self):
         """
@@ -249,20 +370,20 @@ class TestNode(object):
 
         The current basic priority is test name.
         """
-        next_node = self.setup_nodes[0]
-        for node in self.setup_nodes[1:]:
-            if TestNode.comes_before(node, next_node):
-                next_node = node
-        return next_node
+        return self.setup_nodes.first()
 
-    def pick_next_child(self):
+    def pick_next_child(self, key=None, exclude=None):
         """
         Pick the next available child based on some priority.
 
+        :param key: priority key of each child with lower keys picked first
+        :type key: function or None
+        :param exclude: children not to pick
+        :type exclude: {TestNode} or None
         :returns: the next child node
         :rtype: TestNode object
 
-        The current basic priority is test name.
+        The current basic priority is test name unless a different key is given.
 
         .. todo:: more advanced scheduling can be based on different types of priority:
 
@@ -271,11 +392,9 @@ class TestNode(object):
             2. priority to tests that are leaves -> then internal;
             3. priority to tests using fewer objects -> then more objects;
         """
-        next_node = self.cleanup_nodes[0]
-        for node in self.cleanup_nodes[1:]:
-            if TestNode.comes_before(node, next_node):
-                next_node = node
-        return next_node
+        if key is not None:
+            return min((node for node in self.cleanup_nodes if not exclude or node not in exclude), key=key)
+        return self.cleanup_nodes.first(exclude)
 
     def visit_node(self, test_node):
         """
@@ -296,6 +415,126 @@ class TestNode(object):
                              "in any way" % (test_node.params["shortname"], self.params["shortname"]))
 
 
+class ParamIndex(object):
+    """
+    Registry and secondary indexes over the parameters of test nodes or
+    objects used to answer the most common graph queries without scanning
+    all of them.
+
+    The indexes of a parameter are built on the first query of this
+    parameter and are maintained for all items added afterwards. Only
+    candidates are provided for a query so that any further matching
+    can be performed on them instead of all items.
+    """
+
+    literal = r"[\w\-]+"
+    exact_pattern = re.compile(r"^\^(%s)\$$" % literal)
+    prefix_pattern = re.compile(r"^\^(%s)$" % literal)
+    token_patterns = [(re.compile(r"^\(\^\|\\s\)(%s)\(\$\|\\s\)$" % literal), " "),
+                      (re.compile(r"^\(\\\.\|\^\)(%s)\(\\\.\|\$\)$" % literal), ".")]
+
+    def __init__(self, items=None):
+        """
+        Construct the indexes for some initial items.
+
+        :param items: initial test nodes or objects to index
+        :type items: [:py:class:`TestNode`] or [:py:class:`TestObject`] or None
+        """
+        self.items = []
+        self.ids = {}
+        self._positions = {}
+        self._values = {}
+        self._sorted_values = {}
+        self._tokens = {}
+        for item in items or []:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return id(item) in self._positions
+
+    def add(self, item):
+        """
+        Add a new item to all built indexes.
+
+        :param item: test node or object to index
+        :type item: :py:class:`TestNode` or :py:class:`TestObject`
+        """
+        self._positions[id(item)] = len(self.items)
+        self.items.append(item)
+        self.ids.setdefault(item.id, item)
+        for key in self._values.keys():
+            self._index_value(key, item)
+        for key, separator in self._tokens.keys():
+            self._index_tokens(key, separator, item)
+
+    def _index_value(self, key, item):
+        value = item.params.get(key, "")
+        values = self._values[key]
+        if value not in values:
+            values[value] = []
+            bisect.insort(self._sorted_values[key], value)
+        values[value].append(item)
+
+    def _index_tokens(self, key, separator, item):
+        tokens = self._tokens[(key, separator)]
+        value = item.params.get(key, "")
+        for token in set(value.split() if separator == " " else value.split(separator)):
+            tokens.setdefault(token, []).append(item)
+
+    def _ordered(self, groups):
+        """Merge groups of items retaining the order of their addition."""
+        if len(groups) == 1:
+            return list(groups[0])
+        return sorted((item for group in groups for item in group), key=lambda x: self._positions[id(x)])
+
+    def candidates(self, key, pattern):
+        """
+        Get all items whose parameter could match a search pattern.
+
+        :param str key: parameter to search in
+        :param str pattern: regular expression to search for
+        :returns: candidate items in order of addition or None if the pattern is not indexable
+        :rtype: [:py:class:`TestNode`] or [:py:class:`TestObject`] or None
+        """
+        match = self.exact_pattern.match(pattern)
+        if match is not None:
+            if key not in self._values:
+                self._build_values(key)
+            return list(self._values[key].get(match.group(1), []))
+
+        match = self.prefix_pattern.match(pattern)
+        if match is not None:
+            if key not in self._values:
+                self._build_values(key)
+            prefix, sorted_values = match.group(1), self._sorted_values[key]
+            groups = []
+            for i in range(bisect.bisect_left(sorted_values, prefix), len(sorted_values)):
+                if not sorted_values[i].startswith(prefix):
+                    break
+                groups.append(self._values[key][sorted_values[i]])
+            return self._ordered(groups) if len(groups) > 0 else []
+
+        for token_pattern, separator in self.token_patterns:
+            match = token_pattern.match(pattern)
+            if match is not None:
+                if (key, separator) not in self._tokens:
+                    self._tokens[(key, separator)] = {}
+                    for item in self.items:
+                        self._index_tokens(key, separator, item)
+                return list(self._tokens[(key, separator)].get(match.group(1), []))
+
+        return None
+
+    def _build_values(self, key):
+        self._values[key] = {}
+        self._sorted_values[key] = []
+        for item in self.items:
+            self._index_value(key, item)
+
+
 class TestGraph(object):
     """
     The main parsed and traversed test data structure.
@@ -330,6 +569,37 @@ class TestGraph(object):
         return nodes
     test_nodes = property(fget=test_nodes)
 
+    def nodes(self):
+        """Test nodes list property."""
+        return self._nodes
+    def set_nodes(self, value):
+        self._nodes = list(value)
+        self._nodes_index = ParamIndex(self._nodes)
+        self._finished_nodes = None
+    nodes = property(fget=nodes, fset=set_nodes)
+
+    def objects(self):
+        """Test objects list property."""
+        return self._objects
+    def set_objects(self, value):
+        self._objects = list(value)
+        self._objects_index = ParamIndex(self._objects)
+    objects = property(fget=objects, fset=set_objects)
+
+    def nodes_index(self):
+        """Test nodes index property (rebuilt if the nodes were modified directly)."""
+        if len(self._nodes_index) != len(self._nodes):
+            self._nodes_index = ParamIndex(self._nodes)
+        return self._nodes_index
+    nodes_index = property(fget=nodes_index)
+
+    def objects_index(self):
+        """Test objects index property (rebuilt if the objects were modified directly)."""
+        if len(self._objects_index) != len(self._objects):
+            self._objects_index = ParamIndex(self._objects)
+        return self._objects_index
+    objects_index = property(fget=objects_index)
+
     def __init__(self):
         """Construct the test graph."""
         self.nodes = []
@@ -344,11 +614,12 @@ class TestGraph(object):
         """
         if not isinstance(objects, list):
             objects = [objects]
-        test_objects_ids = self.test_objects.keys()
+        objects_index = self.objects_index
         for test_object in objects:
-            if test_object.id in test_objects_ids:
+            if test_object.id in objects_index.ids:
                 continue
-            self.objects.append(test_object)
+            self._objects.append(test_object)
+            objects_index.add(test_object)
 
     def new_nodes(self, nodes):
         """
@@ -359,11 +630,13 @@ class TestGraph(object):
         """
         if not isinstance(nodes, list):
             nodes = [nodes]
-        test_nodes_ids = self.test_nodes.keys()
+        nodes_index = self.nodes_index
         for test_node in nodes:
-            if test_node.id in test_nodes_ids:
+            if test_node.id in nodes_index.ids:
                 continue
-            self.nodes.append(test_node)
+            self._nodes.append(test_node)
+            nodes_index.add(test_node)
+            self.update_progress(test_node)
 
     """dumping functionality"""
     def load_setup_list(self, dump_dir, filename="setup_list"):
@@ -376,6 +649,7 @@ class TestGraph(object):
         with open(os.path.join(dump_dir, filename), "r") as f:
             str_list = f.read()
         setup_list = re.findall("(\w+-\w+) (\d) (\d)", str_list)
+        self._finished_nodes = None
         for i in range(len(setup_list)):
             assert self.nodes[i].id == setup_list[i][0], "Corrupted setup list file"
             self.nodes[i].should_run = bool(int(setup_list[i][1]))
@@ -406,12 +680,33 @@ class TestGraph(object):
         does not take into account the duration of each test which could vary
         significantly.
         """
-        total, finished = len(self.nodes), 0
-        for tnode in self.nodes:
-            if tnode.is_finished():
-                finished += 1
+        finished, total = self.progress
         logging.info("Finished %i\%i tests, %0.2f%% complete", finished, total, 100.0*finished/total)
 
+    def progress(self):
+        """Progress property as the number of finished and total test nodes."""
+        if self._finished_nodes is None:
+            self._finished_nodes = set(tnode for tnode in self.nodes if tnode.is_finished())
+        return len(self._finished_nodes), len(self.nodes)
+    progress = property(fget=progress)
+
+    def update_progress(self, test_node):
+        """
+        Account for a possible change in the finished status of a test node.
+
+        :param test_node: test node whose run flag or children have changed
+        :type test_node: :py:class:`TestNode`
+
+        Any bulk changes of the run flags (e.g. by flagging or scanning) are
+        accounted for by recounting all finished nodes on the next report.
+        """
+        if self._finished_nodes is None:
+            return
+        if test_node.is_finished():
+            self._finished_nodes.add(test_node)
+        else:
+            self._finished_nodes.discard(test_node)
+
     def visualize(self, dump_dir, n=0):
         """
         Dump a visual description of the Cartesian graph at
@@ -438,13 +733,19 @@ class TestGraph(object):
         graph.render("%s/cg_%s_%s" % (dump_dir, id(self), n))
 
     """run/clean switching functionality"""
-    def scan_object_states(self, env):
+    def scan_object_states(self, env, present_states=None):
         """
         Scan for present object states to reuse tests from previous runs
 
         :param env: environment related to the test
         :type env: Env object
+        :param present_states: synthetic inventory of present states as "vm/state"
+                               names to use instead of checking the actual states
+        :type present_states: {str} or None
         """
+        self._finished_nodes = None
+        # list the states of each volume group or image only once for all nodes
+        inventory = state_setup.StateInventory()
         for test_node in self.nodes:
             test_node.should_run = True
             if test_node.is_manual():
@@ -491,11 +792,15 @@ class TestGraph(object):
                     continue
 
                 # ultimate consideration of whether the state is actually present
-                object_params["vms"] = object_name
-                object_params["check_state"] = object_state
-                object_params["check_type"] = object_params.get("set_type", "online")
-                is_state_detected = state_setup.check_state(object_params, env,
-                                                            print_pos=True, print_neg=True)
+                if present_states is not None:
+                    is_state_detected = "%s/%s" % (object_name, object_state) in present_states
+                else:
+                    object_params["vms"] = object_name
+                    object_params["check_state"] = object_state
+                    object_params["check_type"] = object_params.get("set_type", "online")
+                    is_state_detected = state_setup.check_state(object_params, env,
+                                                                print_pos=True, print_neg=True,
+                                                                inventory=inventory)
                 # the object state has to be defined to reach this stage
                 if is_state_detected:
                     test_node.should_run = False
@@ -517,6 +822,7 @@ class TestGraph(object):
         """
         activity = ("" if flag else "not ") + ("running" if flag_type == "run" else "cleanup")
         logging.debug("Selecting test nodes for %s", activity)
+        self._finished_nodes = None
         if object_name is not None:
             state_name = "root" if state_name is None else state_name
             root_tests = self.get_nodes_by(param_key="set_state", param_val="^"+state_name+"$")
@@ -564,6 +870,7 @@ class TestGraph(object):
         """
         activity = ("" if flag else "not ") + ("running" if flag_type == "run" else "cleanup")
         logging.debug("Selecting test nodes for %s", activity)
+        self._finished_nodes = None
         for test_node in self.nodes:
             if test_node.is_shared_root() or len(graph.get_nodes_by(param_key="set_state",
                     param_val="^"+test_node.params["set_state"]+"$")) == 1:
@@ -587,12 +894,9 @@ class TestGraph(object):
         Warning: The matching is using 'param LIKE %value%' instead of 'param=value'
         which is necessary for matching a subvariant if the key is the test name.
         """
-        tests_selection = []
+        tests_selection = TestGraph._select(self.nodes_index, param_key, param_val, subset)
         if subset is None:
             subset = self.nodes
-        for test in subset:
-            if re.search(param_val, test.params.get(param_key, "")):
-                tests_selection.append(test)
         logging.debug("Retrieved %s/%s test nodes with %s = %s",
                       len(tests_selection), len(subset), param_key, param_val)
         return tests_selection
@@ -603,12 +907,28 @@ class TestGraph(object):
 
         Warning: The matching is using 'param LIKE %value%' instead of 'param=value'.
         """
-        vms_selection = []
+        vms_selection = TestGraph._select(self.objects_index, param_key, param_val, subset)
         if subset is None:
             subset = self.objects
-        for vm in subset:
-            if re.search(param_val, vm.params.get(param_key, "")):
-                vms_selection.append(vm)
         logging.debug("Retrieved %s/%s test objects with %s = %s",
                       len(vms_selection), len(subset), param_key, param_val)
         return vms_selection
+
+    @staticmethod
+    def _select(index, param_key, param_val, subset):
+        """
+        Select all items in a subset with a parameter matching a regular
+        expression, using the index of the graph when possible.
+        """
+        candidates = index.candidates(param_key, param_val)
+        if subset is None:
+            subset = index.items
+        if candidates is None:
+            return [item for item in subset if re.search(param_val, item.params.get(param_key, ""))]
+        if subset is index.items:
+            return candidates
+        candidate_ids = set(id(item) for item in candidates)
+        # items outside of the graph are not indexed and have to be matched directly
+        return [item for item in subset
+                if (id(item) in candidate_ids if item in index
+                    else re.search(param_val, item.params.get(param_key, "")))]
@@ -108,11 +108,12 @@ def params_from_cmd(args):
     log.debug("Parsed vm strings '%s'", vm_strs)
 
     # control against invoking internal tests
-    control_parser = param.prepare_parser(base_file="sets.cfg",
-                                          ovrwrt_file=param.tests_ovrwrt_file,
-                                          ovrwrt_str=tests_str)
+    control_dicts = param.prepare_dicts(base_file="sets.cfg",
+                                        ovrwrt_file=param.tests_ovrwrt_file,
+                                        ovrwrt_str=tests_str,
+                                        limit=None if with_nontrivial_restrictions else 1)
     if with_nontrivial_restrictions:
-        for d in control_parser.get_dicts():
+        for d in control_dicts:
             if ".internal." in d["name"] or ".original." in d["name"]:
                 # the user should have gotten empty Cartesian product by now but check just in case
                 raise ValueError("You cannot restrict to internal tests from the command line.\n"
@@ -0,0 +1,178 @@
+"""
+
+SUMMARY
+------------------------------------------------------
+Utility to keep a local history of the durations of test nodes and
+state operations in order to estimate their costs in later runs.
+
+Copyright: Intra2net AG
+
+
+INTERFACE
+------------------------------------------------------
+
+"""
+
+import os
+import json
+import fcntl
+import logging
+import tempfile
+import collections
+
+from avocado.core.settings import settings
+
+
+class DurationHistory(object):
+    """
+    Local history of the durations of test nodes and state operations.
+
+    Each duration is appended to the history file as a separate JSON line
+    so that tests running in different processes can extend the history at
+    the same time. The durations of each entry are aggregated into a single
+    estimate as an exponential moving average favoring recent durations.
+    Compacting the history file locks out all recording processes.
+    """
+
+    def __init__(self, history_file, smoothing=0.5):
+        """
+        Construct a history of durations stored in a file.
+
+        :param str history_file: path of the file to store the durations in,
+                                 an empty path disables the history
+        :param float smoothing: weight of each new duration in the estimate
+        """
+        self.history_file = history_file
+        self.smoothing = smoothing
+        self._estimates = None
+
+    def is_enabled(self):
+        """Check if the history is used at all."""
+        return self.history_file != ""
+
+    def estimates(self):
+        """Estimated durations (cache) property by kind and name of entry."""
+        if self._estimates is None:
+            self._estimates = collections.defaultdict(dict)
+            if self.is_enabled():
+                self._load()
+        return self._estimates
+    estimates = property(fget=estimates)
+
+    def record(self, kind, name, duration):
+        """
+        Record a new duration of an entry.
+
+        :param str kind: kind of the entry like "node" or "get"
+        :param str name: name of the entry unique among its kind
+        :param float duration: duration in seconds
+        """
+        if not self.is_enabled():
+            return
+        self._update(kind, name, duration)
+        line = json.dumps({"kind": kind, "name": name, "duration": duration}) + "\n"
+        try:
+            os.makedirs(os.path.dirname(self.history_file) or ".", exist_ok=True)
+            # small appends are atomic so that recording processes share the lock
+            with open(self.history_file + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+                with open(self.history_file, "a") as f:
+                    f.write(line)
+        except OSError as error:
+            logging.warning("Could not record duration of %s %s: %s", kind, name, error)
+
+    def estimate(self, kind, name, default=None):
+        """
+        Get the estimated duration of an entry.
+
+        :param str kind: kind of the entry like "node" or "get"
+        :param str name: name of the entry unique among its kind
+        :param default: value to return if the entry was never recorded
+        :type default: float or None
+        :returns: estimated duration in seconds
+        :rtype: float or None
+        """
+        return self.estimates[kind].get(name, default)
+
+    def mean(self, kind, default=0.0):
+        """
+        Get the mean estimated duration of all entries of a kind.
+
+        :param str kind: kind of the entries like "node" or "get"
+        :param float default: value to return if no such entry was recorded
+        :returns: mean estimated duration in seconds
+        :rtype: float
+        """
+        durations = self.estimates[kind].values()
+        return sum(durations) / len(durations) if len(durations) > 0 else default
+
+    def compact(self):
+        """
+        Replace all recorded durations with a single record per entry.
+
+        This keeps the history file small while any other processes wait
+        with recording their durations until it is replaced.
+        """
+        if not self.is_enabled() or not os.path.exists(self.history_file):
+            return
+        history_dir = os.path.dirname(self.history_file) or "."
+        temp_path = None
+        try:
+            with open(self.history_file + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # reload the estimates to include durations recorded by other processes
+                self._estimates = None
+                lines = ""
+                for kind, names in sorted(self.estimates.items()):
+                    for name, duration in sorted(names.items()):
+                        lines += json.dumps({"kind": kind, "name": name, "duration": duration}) + "\n"
+                fd, temp_path = tempfile.mkstemp(dir=history_dir, prefix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    f.write(lines)
+                os.replace(temp_path, self.history_file)
+        except OSError as error:
+            logging.warning("Could not compact the duration history: %s", error)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def _load(self):
+        """Aggregate all durations from the history file."""
+        try:
+            with open(self.history_file) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._update(record["kind"], record["name"], float(record["duration"]))
+                    except (ValueError, KeyError, TypeError):
+                        logging.debug("Ignoring corrupted duration record %s", line.strip())
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            logging.warning("Could not load the duration history: %s", error)
+
+    def _update(self, kind, name, duration):
+        """Update the estimate of an entry with a new duration."""
+        estimates = self.estimates[kind]
+        if name in estimates:
+            estimates[name] += self.smoothing * (duration - estimates[name])
+        else:
+            estimates[name] = duration
+
+
+def state_name(vm_name, state):
+    """
+    Get the history name of a state operation on a vm.
+
+    :param str vm_name: name of the vm
+    :param str state: name of the state
+    :returns: name unique among the state operations of its kind
+    :rtype: str
+
+    The name does not depend on the state type as this could be unknown
+    before the state is looked up.
+    """
+    return "%s/%s" % (vm_name, state)
+
+
+history_file = settings.get_value('i2n.runner', 'history_file', default="~/.local/share/avocado-i2n/history")
+duration_history = DurationHistory(os.path.expanduser(history_file) if history_file else "")
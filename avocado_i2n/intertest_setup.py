@@ -44,6 +44,7 @@ from avocado.core.settings import settings
 from avocado.utils import process
 
 from . import params_parser as param
+from . import state_setup
 from .cartesian_graph import TestGraph, TestNode
 from .loader import CartesianLoader
 from .runner import CartesianRunner
@@ -188,36 +189,29 @@ def update(args, run_params, tag=""):
     .. note:: The code for this step was taken from an external python script
         and could be replaced later on if the newer update step becomes faster.
     """
-    lvscan_bin = '/usr/sbin/lvscan'
     lvremove_bin = '/usr/sbin/lvremove'
 
     vms = {}
 
     vm_whitelist = ['vm1', 'vm2', 'vm3', 'vm4', 'vm5']
     whitelist = ['thin_pool', 'LogVol', 'install', 'current_state']
+    prefix = os.environ['PREFIX'] if 'PREFIX' in os.environ else 'at'
 
     def parse_active_vms():
-        lvscan_output = process.run(lvscan_bin).stdout_text
-        for line in lvscan_output.split('\n'):
-            prefix = os.environ['PREFIX'] if 'PREFIX' in os.environ else 'at'
-            match = re.match(" +ACTIVE +'(/dev/%s_(vm\d+)_ramdisk/(.*))' +" % prefix, line)
-            if match is None:
-                continue
-
-            fullpath = match.group(1)
-            vm = match.group(2)
-            volname = match.group(3)
-
-            if vm not in vm_whitelist:
-                logging.info("Ignoring volume %s from %s", volname, vm)
-                continue
+        state_setup.clear_lv_reports()
+        for vm in vm_whitelist:
+            report = state_setup.lv_report("%s_%s_ramdisk" % (prefix, vm))
+            for volname, volume in report.items():
+                # the fifth attribute is the activation state of the volume
+                if volume["lv_attr"][4:5] != "a":
+                    continue
 
-            logging.info('Found volume %s from %s', volname, vm)
+                logging.info('Found volume %s from %s', volname, vm)
 
-            if vm not in vms:
-                vms[vm] = [(volname, fullpath)]
-            else:
-                vms[vm].append((volname, fullpath))
+                if vm not in vms:
+                    vms[vm] = [(volname, volume["lv_path"])]
+                else:
+                    vms[vm].append((volname, volume["lv_path"]))
 
     def clean_volumes(dry_run):
         for vm in vms:
@@ -236,6 +230,7 @@ def update(args, run_params, tag=""):
                     output = str(e)
                 for line in output.split('\n'):
                     logging.info(line)
+            state_setup.clear_lv_reports("%s_%s_ramdisk" % (prefix, vm))
 
     new_whitelist = run_params.objects("vms")
     for vmname in new_whitelist:
@@ -15,14 +15,99 @@ INTERFACE
 import os
 import re
 import logging
+import functools
+from concurrent.futures import ProcessPoolExecutor
 
 from avocado_vt.loader import VirtTestLoader
+from avocado.core.settings import settings
 from virttest import utils_params
 
 from . import params_parser as param
 from .cartesian_graph import TestGraph, TestNode, TestObject
 
 
+def _parse_object_parser(vm_name, object_str, verbose=False):
+    """
+    Get the parser of a test object.
+
+    :param str vm_name: name of the test object
+    :param str object_str: block of object-specific parameters and variant restrictions
+    :param bool verbose: whether to print extra messages or not
+    :returns: parser of the test object
+    :rtype: Parser object
+    """
+    # all possible hardware-software combinations for a given vm
+    vm_parser = param.prepare_parser(base_file="objects.cfg",
+                                     base_str=param.vm_str(vm_name, ""),
+                                     base_dict={"main_vm": vm_name},
+                                     ovrwrt_str=object_str,
+                                     show_dictionaries=verbose)
+    assert vm_parser.count(limit=2) < 2, "There must be exactly one configuration for %s - please "\
+                                         "restrict better" % vm_name
+    d = dict(vm_parser.first_dict())
+
+    # parameter postprocessing - some expansion and simplification
+    vm_params = utils_params.multiply_params_per_object(d, [vm_name])
+    vm_params = utils_params.object_params(vm_params, vm_name, param.all_vms())
+    # NOTE: this is still not perfect - it also overwrites parameters under conditional blocks with
+    # their defaults outside of the conditional blocks (newly defined parameters are preserved though)
+    vm_params.pop("cdrom_cd1", None)
+    vm_params.pop("cdroms", None)
+    # that may later be invoked (i.e. replaced by irrelevant defaults outside of the blocks)
+    vm_parser = param.update_parser(vm_parser, ovrwrt_dict=vm_params.drop_dict_internals())
+
+    # parameter postprocessing - add custom overwrite files with custom paths, etc.
+    return param.update_parser(vm_parser, ovrwrt_file=param.vms_ovrwrt_file)
+
+
+#: object parsers of a worker process reused among all node parsing tasks
+_worker_object_parsers = {}
+
+
+def _parse_worker_node_parser(vm_name, object_str, setup_dict, setup_str, verbose=False):
+    """
+    Get the final parser of a test node in a worker process.
+
+    :param str vm_name: name of the base object of the test node
+    :param str object_str: block of object-specific parameters and variant restrictions
+                           the base object was parsed with
+    :returns: parser of the test node
+    :rtype: Parser object
+
+    The rest of the parameters are identical to :py:func:`_parse_node_parser`.
+
+    Only the object restrictions are sent to the worker which parses the base
+    object once and reuses its parser for all further tasks on the same object.
+    """
+    key = (vm_name, object_str)
+    if key not in _worker_object_parsers:
+        _worker_object_parsers[key] = _parse_object_parser(vm_name, object_str)
+    return _parse_node_parser(_worker_object_parsers[key], setup_dict, setup_str, verbose)
+
+
+def _parse_node_parser(base_parser, setup_dict, setup_str, verbose=False):
+    """
+    Get the final parser of a test node from the parser of its base object.
+
+    :param base_parser: parser of the base object of the test node
+    :type base_parser: Parser object
+    :param setup_dict: merged parameters of all objects participating in the node
+    :type setup_dict: {str, str}
+    :param str setup_str: block of node-specific parameters and variant restrictions
+    :param bool verbose: whether to print extra messages or not
+    :returns: parser of the test node
+    :rtype: Parser object
+    :raises: :py:class:`param.EmptyCartesianProduct` if the node is incompatible with the object
+    """
+    # combine object configurations
+    parser = param.update_parser(base_parser, ovrwrt_dict=setup_dict)
+    # now restrict to selected nodes
+    return param.update_parser(parser, ovrwrt_str=setup_str,
+                               ovrwrt_file=param.tests_ovrwrt_file,
+                               ovrwrt_base_file="sets.cfg",
+                               show_dictionaries=verbose)
+
+
 class CartesianLoader(VirtTestLoader):
     """Test loader for Cartesian graph parsing."""
 
@@ -38,8 +123,21 @@ class CartesianLoader(VirtTestLoader):
         :type extra_params: {str, str}
         """
         self.logdir = extra_params.pop('logdir', None)
+        # number of worker processes to parse test configurations with
+        default_workers = settings.get_value('i2n.parser', 'parse_workers', key_type=int, default=1)
+        self.parse_workers = extra_params.pop('parse_workers', default_workers)
+        # pool of worker processes reused among all parsing calls of the loader
+        self._parse_pool = None
+        # object restrictions of all parsed test objects to reparse them in the workers
+        self._object_strs = {}
         super().__init__(args, extra_params)
 
+    def close_parse_pool(self):
+        """Shut down the pool of worker processes if one was started."""
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+
     """parsing functionality"""
     def parse_objects(self, object_strs=None, object_names="", verbose=False):
         """
@@ -66,29 +164,12 @@ class CartesianLoader(VirtTestLoader):
         for vm_name in available_vms:
             if vm_name not in object_strs:
                 object_strs[vm_name] = ""
-            # all possible hardware-software combinations for a given vm
-            vm_parser = param.prepare_parser(base_file="objects.cfg",
-                                             base_str=param.vm_str(vm_name, ""),
-                                             base_dict={"main_vm": vm_name},
-                                             ovrwrt_str=object_strs[vm_name],
-                                             show_dictionaries=verbose)
-            for i, d in enumerate(vm_parser.get_dicts()):
-                assert i < 1, "There must be exactly one configuration for %s - please restrict better" % vm_name
-
-                # parameter postprocessing - some expansion and simplification
-                vm_params = utils_params.multiply_params_per_object(d, [vm_name])
-                vm_params = utils_params.object_params(vm_params, vm_name, param.all_vms())
-                # NOTE: this is still not perfect - it also overwrites parameters under conditional blocks with
-                # their defaults outside of the conditional blocks (newly defined parameters are preserved though)
-                vm_params.pop("cdrom_cd1", None)
-                vm_params.pop("cdroms", None)
-                # that may later be invoked (i.e. replaced by irrelevant defaults outside of the blocks)
-                vm_parser = param.update_parser(vm_parser, ovrwrt_dict=vm_params.drop_dict_internals())
-
-                # parameter postprocessing - add custom overwrite files with custom paths, etc.
-                vm_parser = param.update_parser(vm_parser, ovrwrt_file=param.vms_ovrwrt_file)
-
-            test_objects.append(TestObject(vm_name, vm_parser))
+        # the configurations of the different vms are independent and can be parsed in parallel
+        parse_args = [(vm_name, object_strs[vm_name], verbose) for vm_name in available_vms]
+        parse_results = self._ordered_calls(_parse_object_parser, parse_args)
+        for vm_name, get_parser in zip(available_vms, parse_results):
+            test_objects.append(TestObject(vm_name, get_parser()))
+            self._object_strs[vm_name] = object_strs[vm_name]
         return test_objects
 
     def parse_nodes(self, nodes_str, graph, prefix="", object_name="", verbose=False):
@@ -109,10 +190,10 @@ class CartesianLoader(VirtTestLoader):
         """
         base_object = None
         test_nodes = []
+        node_variants = []
 
-        # prepare initial parser as starting configuration and get through tests
-        parser = param.prepare_parser(base_file="sets.cfg", ovrwrt_str=nodes_str)
-        for i, d in enumerate(parser.get_dicts()):
+        # prepare initial dictionaries as starting configuration and get through tests
+        for i, d in enumerate(param.prepare_dicts(base_file="sets.cfg", ovrwrt_str=nodes_str)):
             name = prefix + str(i+1)
             objects, objnames, objdicts = [], [], []
 
@@ -152,15 +233,21 @@ class CartesianLoader(VirtTestLoader):
             if len(objects) > 1:
                 setup_dict = utils_params.merge_object_params(objnames, objdicts, "vms", base_object.name)
             setup_str = param.re_str(d["name"], nodes_str)
+            node_variants.append((name, d, objects, base_object, setup_dict, setup_str))
+
+        # the parser updates of the different variants are independent and can be performed in parallel
+        if self.parse_workers > 1 and all(v[3].name in self._object_strs for v in node_variants):
+            # pass only the restrictions to the workers instead of pickling the object parsers
+            parse_args = [(base_object.name, self._object_strs[base_object.name], setup_dict, setup_str, verbose)
+                          for _, _, _, base_object, setup_dict, setup_str in node_variants]
+            parse_results = self._ordered_calls(_parse_worker_node_parser, parse_args)
+        else:
+            parse_args = [(base_object.parser, setup_dict, setup_str, verbose)
+                          for _, _, _, base_object, setup_dict, setup_str in node_variants]
+            parse_results = self._ordered_calls(_parse_node_parser, parse_args, serial=True)
+        for (name, d, objects, base_object, _, _), get_parser in zip(node_variants, parse_results):
             try:
-                # combine object configurations
-                parser = param.update_parser(base_object.parser, ovrwrt_dict=setup_dict)
-                # now restrict to selected nodes
-                parser = param.update_parser(parser, ovrwrt_str=setup_str,
-                                             ovrwrt_file=param.tests_ovrwrt_file,
-                                             ovrwrt_base_file="sets.cfg",
-                                             show_dictionaries=verbose)
-                test_nodes.append(TestNode(name, parser, objects))
+                test_nodes.append(TestNode(name, get_parser(), objects))
                 logging.debug("Parsed a test '%s' with base configuration of %s",
                               d["shortname"], base_object.name)
             except param.EmptyCartesianProduct:
@@ -247,14 +334,16 @@ class CartesianLoader(VirtTestLoader):
 
         The parsed structure can also be viewed as a directed graph of all runnable
         tests each with connections to its dependencies (parents) and dependables (children).
+
+        Any worker processes used for the parsing are shut down once the graph is complete.
         """
         graph = TestGraph()
 
         # parse leaves and discover necessary setup (internal nodes)
         leaves, stubs = self.parse_object_nodes(nodes_str, object_strs, prefix=prefix, object_names=object_names,
                                                 objectless=objectless, verbose=verbose)
-        graph.nodes.extend(leaves)
-        graph.objects.extend(stubs)
+        graph.new_nodes(leaves)
+        graph.new_objects(stubs)
         # NOTE: reversing here turns the leaves into a simple stack
         unresolved = sorted(list(leaves), key=lambda x: int(re.match("^(\d+)", x.id).group(1)), reverse=True)
 
@@ -274,7 +363,7 @@ class CartesianLoader(VirtTestLoader):
 
                 # get and parse parents
                 get_parents, parse_parents = self._parse_and_get_parents(graph, test_node, test_object, param_str)
-                graph.nodes.extend(parse_parents)
+                graph.new_nodes(parse_parents)
                 unresolved.extend(parse_parents)
                 parents = get_parents + parse_parents
 
@@ -285,7 +374,7 @@ class CartesianLoader(VirtTestLoader):
                     test_node.setup_nodes.append(parents[0])
                     parents[0].cleanup_nodes.append(test_node)
                 if len(parents) > 1:
-                    graph.nodes += self._copy_branch(test_node, parents[0], parents[1:])
+                    graph.new_nodes(self._copy_branch(test_node, parents[0], parents[1:]))
 
                 if logging.getLogger('graph').level <= logging.DEBUG:
                     step += 1
@@ -299,15 +388,18 @@ class CartesianLoader(VirtTestLoader):
             if len(object_roots) > 0:
                 used_objects.append(test_object)
                 used_roots.append(object_roots[0])
-        graph.objects[:] = used_objects
+        graph.objects = used_objects
         root_for_all = self.parse_scan_node(graph, param_str)
         for root_for_object in used_roots:
             root_for_object.setup_nodes.append(root_for_all)
             root_for_all.cleanup_nodes.append(root_for_object)
         if verbose:
             logging.info("%s final vm variant(s)", len(graph.objects))
-        graph.nodes.append(root_for_all)
+        graph.new_nodes(root_for_all)
+        logging.debug("Test object parameters cache hit rate %.2f (%s hits, %s misses)",
+                      TestObject.params_hit_rate(), TestObject.params_hits, TestObject.params_misses)
 
+        self.close_parse_pool()
         return graph
 
     def discover(self, references, _which_tests=None):
@@ -386,6 +478,33 @@ class CartesianLoader(VirtTestLoader):
         return [TestNode("0r", parser, [test_object])]
 
     """internals - get/parse, duplicates"""
+    def _ordered_calls(self, function, args_list, serial=False):
+        """
+        Call a function for each of a list of arguments, possibly in the pool
+        of worker processes, retaining the original order of the results.
+
+        :param function: module level function to call
+        :type function: function
+        :param args_list: positional arguments for each call
+        :type args_list: [tuple]
+        :param bool serial: whether to perform the calls in the current process
+        :returns: getters of the results in the order of the arguments, raising any
+                  exception of their call when invoked
+        :rtype: generator
+
+        The calls in the current process are lazy, i.e. performed when invoking the getters.
+        The pool is started on first use and reused for all further calls.
+        """
+        if serial or self.parse_workers <= 1 or len(args_list) <= 1:
+            for args in args_list:
+                yield functools.partial(function, *args)
+            return
+        if self._parse_pool is None:
+            self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        futures = [self._parse_pool.submit(function, *args) for args in args_list]
+        for future in futures:
+            yield future.result
+
     def _get_and_parse_parent(self, graph, test_node, test_object, param_str, setup_restr):
         """
         Perform a fast and simple check for a single parent node and
@@ -0,0 +1,281 @@
+"""
+
+SUMMARY
+------------------------------------------------------
+Utility to run LVM commands through a single long-lived LVM shell
+instead of spawning a separate LVM process for each command.
+
+Copyright: Intra2net AG
+
+
+INTERFACE
+------------------------------------------------------
+
+"""
+
+import os
+import re
+import fcntl
+import logging
+import tempfile
+import threading
+import contextlib
+
+import aexpect
+from avocado.utils import lv_utils
+
+
+#: prompt of the interactive LVM shell
+LVM_PROMPT = r"lvm> $"
+#: configuration of each command to record its log report for the status check
+LOG_REPORT_CONFIG = "--config 'log/report_command_log=1'"
+#: file recording the shared LVM shell of the current job (and its processes)
+SHELL_ID_FILE = os.path.join(tempfile.gettempdir(), "avocado-i2n-lvm-shell-%i" % os.getpid())
+
+
+class LVMShellError(lv_utils.LVException):
+    """The LVM shell itself failed and the outcome of its command is unknown."""
+
+
+class LVMShell(object):
+    """
+    Interactive LVM shell which keeps its process (and loaded configuration)
+    alive among all commands issued through it.
+
+    The offline state operations of this shell have the same signatures and
+    raise the same exceptions as their counterparts in the LVM utilities.
+    """
+
+    def __init__(self, lvm_binary="lvm", timeout=60, id_file=None):
+        """
+        Construct an LVM shell which is started with its first command.
+
+        :param str lvm_binary: LVM binary to start the shell with
+        :param int timeout: timeout in seconds for each command
+        :param id_file: file to record the shell process in so that other processes
+                        can attach to it or None for a shell of this process only
+        :type id_file: str or None
+        """
+        self.lvm_binary = lvm_binary
+        self.timeout = timeout
+        self.id_file = id_file
+        self.session = None
+        # commands of concurrent state operations are issued one at a time
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Lock the shell among all threads and all processes sharing it."""
+        with self._lock:
+            if self.id_file is None:
+                yield
+                return
+            with open(self.id_file + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def _attach(self):
+        """Attach to the shell process recorded by another process if it is still running."""
+        if self.id_file is None or not os.path.exists(self.id_file):
+            return
+        with open(self.id_file) as f:
+            a_id = f.read().strip()
+        session = aexpect.Expect(a_id=a_id, auto_close=False, output_func=logging.debug,
+                                 output_prefix="[lvm] ")
+        if session.is_alive():
+            logging.debug("Attached to the LVM shell %s", a_id)
+            self.session = session
+
+    def start(self):
+        """Start the LVM shell process if it is not already running (in any process)."""
+        if self.session is not None and self.session.is_alive():
+            return
+        self._attach()
+        if self.session is not None:
+            return
+        logging.debug("Starting an LVM shell with %s", self.lvm_binary)
+        self.session = aexpect.Expect(self.lvm_binary, auto_close=False, output_func=logging.debug,
+                                      output_prefix="[lvm] ")
+        self.session.read_until_last_line_matches([LVM_PROMPT], timeout=self.timeout)
+        if self.id_file is not None:
+            with open(self.id_file, "w") as f:
+                f.write(self.session.a_id)
+
+    def _close(self):
+        """Stop the LVM shell process if it is running without locking the shell."""
+        if self.session is None:
+            self._attach()
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        if self.id_file is not None and os.path.exists(self.id_file):
+            os.unlink(self.id_file)
+
+    def close(self):
+        """Stop the LVM shell process if it is running (in any process)."""
+        with self._locked():
+            self._close()
+        if self.id_file is not None and os.path.exists(self.id_file + ".lock"):
+            os.unlink(self.id_file + ".lock")
+
+    def release(self):
+        """
+        Release the LVM shell process of this process.
+
+        A shell recorded for other processes keeps running for their
+        commands while any other shell is stopped.
+        """
+        with self._locked():
+            if self.id_file is None:
+                self._close()
+            else:
+                self.session = None
+
+    def _run(self, command):
+        """Run a command in the shell and return its output without echo and prompt."""
+        self.session.sendline(command)
+        try:
+            _, output = self.session.read_until_last_line_matches([LVM_PROMPT], timeout=self.timeout)
+        except aexpect.ExpectError as error:
+            # the shell state is unknown and cannot be reused
+            self._close()
+            raise LVMShellError("LVM shell failed to run '%s': %s" % (command, error))
+        lines = output.splitlines()
+        if len(lines) > 0 and lines[0].strip() == command:
+            lines = lines[1:]
+        if len(lines) > 0 and re.search(LVM_PROMPT, lines[-1]):
+            lines = lines[:-1]
+        return "\n".join(lines)
+
+    def cmd(self, command):
+        """
+        Run an LVM command in the shell.
+
+        :param str command: LVM command without the "lvm" prefix
+        :returns: output of the command
+        :rtype: str
+        :raises: :py:class:`lv_utils.LVException` if the command failed or
+                 :py:class:`LVMShellError` if the shell failed
+
+        The success of the command is determined from the status entries of
+        its log report which is explicitly enabled for each command.
+        """
+        with self._locked():
+            self.start()
+            output = self._run("%s %s" % (command, LOG_REPORT_CONFIG))
+            status = self._run("lastlog -S log_type=status -o log_message --noheadings")
+        if "failure" in status or "No such command" in output:
+            raise lv_utils.LVException("LVM command '%s' failed:\n%s" % (command, output))
+        return output
+
+    def vg_check(self, vg_name):
+        """
+        Check whether a volume group exists.
+
+        :param str vg_name: name of the volume group
+        :returns: whether the volume group exists
+        :rtype: bool
+        """
+        try:
+            self.cmd("vgs %s" % vg_name)
+        except LVMShellError:
+            raise
+        except lv_utils.LVException:
+            return False
+        return True
+
+    def lv_check(self, vg_name, lv_name):
+        """
+        Check whether a logical volume exists.
+
+        :param str vg_name: name of the volume group
+        :param str lv_name: name of the logical volume
+        :returns: whether the logical volume exists
+        :rtype: bool
+        """
+        try:
+            self.cmd("lvs %s/%s" % (vg_name, lv_name))
+        except LVMShellError:
+            raise
+        except lv_utils.LVException:
+            return False
+        return True
+
+    def lv_remove(self, vg_name, lv_name):
+        """
+        Remove a logical volume.
+
+        :param str vg_name: name of the volume group
+        :param str lv_name: name of the logical volume
+        :raises: :py:class:`lv_utils.LVException` if the volume cannot be removed
+        """
+        self.cmd("lvremove -f %s/%s" % (vg_name, lv_name))
+
+    def lv_take_snapshot(self, vg_name, lv_name, lv_snapshot_name):
+        """
+        Take a (thin) snapshot of a logical volume.
+
+        :param str vg_name: name of the volume group
+        :param str lv_name: name of the logical volume to take a snapshot of
+        :param str lv_snapshot_name: name of the snapshot
+        :raises: :py:class:`lv_utils.LVException` if the snapshot cannot be taken
+        """
+        self.cmd("lvcreate -s -ay -K -n %s %s/%s" % (lv_snapshot_name, vg_name, lv_name))
+
+    def lv_mount(self, vg_name, lv_name, mount_loc, create_filesystem=""):
+        """
+        Mount a logical volume.
+
+        :param str vg_name: name of the volume group
+        :param str lv_name: name of the logical volume
+        :param str mount_loc: location to mount the logical volume at
+        :param str create_filesystem: filesystem to create on the volume first if any
+        :raises: :py:class:`lv_utils.LVException` if the volume cannot be mounted
+
+        Mounting involves no LVM command and thus no LVM metadata scan.
+        """
+        lv_utils.lv_mount(vg_name, lv_name, mount_loc, create_filesystem=create_filesystem)
+
+    def lv_umount(self, vg_name, lv_name):
+        """
+        Unmount a logical volume.
+
+        :param str vg_name: name of the volume group
+        :param str lv_name: name of the logical volume
+        :raises: :py:class:`lv_utils.LVException` if the volume cannot be unmounted
+
+        Unmounting involves no LVM command and thus no LVM metadata scan.
+        """
+        lv_utils.lv_umount(vg_name, lv_name)
+
+
+_shell = None
+
+
+def get_shell():
+    """
+    Get the LVM shell shared by all offline state operations of the job.
+
+    :returns: the shared LVM shell
+    :rtype: :py:class:`LVMShell`
+
+    The shell is started with its first command and keeps running among
+    the (test) processes of the job which attach to it until it is closed
+    with :py:func:`close_shell` at the end of the job.
+    """
+    global _shell
+    if _shell is None:
+        _shell = LVMShell(id_file=SHELL_ID_FILE)
+    return _shell
+
+
+def release_shell():
+    """Release the shared LVM shell of this process keeping it running for the job."""
+    if _shell is not None:
+        _shell.release()
+
+
+def close_shell():
+    """Stop the shared LVM shell if it was started by any process of the job."""
+    if _shell is not None or os.path.exists(SHELL_ID_FILE):
+        get_shell().close()
@@ -18,6 +18,10 @@ import os
 import re
 import copy
 import shutil
+import pickle
+import hashlib
+import tempfile
+import itertools
 import collections
 
 from virttest import cartesian_config, utils_params
@@ -33,10 +37,15 @@ class EmptyCartesianProduct(Exception):
 
         :param str message: additional message about the excaption
         """
+        self.restriction = message
         message = "Empty Cartesian product of parameters!\n" + message
         message = "Check for self-excluding variants in your current configuration:\n" + message
         super(EmptyCartesianProduct, self).__init__(message)
 
+    def __reduce__(self):
+        # reconstruct from the original message when passed among processes
+        return (EmptyCartesianProduct, (self.restriction,))
+
 
 ###################################################################
 # preprocessing
@@ -58,10 +67,329 @@ if not os.path.exists(os.path.join(os.environ['HOME'], vms_ovrwrt_file)):
                     os.path.join(os.environ['HOME'], vms_ovrwrt_file))
 
 
+###################################################################
+# parsing cache
+###################################################################
+
+
+class ParserCache(object):
+    """
+    Persistent on-disk cache of the variant dictionaries obtained from
+    a Cartesian configuration.
+
+    The cache entries are content-addressed, i.e. identified by a hash of
+    all configuration files (with any files they include), strings, and
+    dictionaries participating in the parsing. Changing any of these will
+    therefore result in a different entry while the stale ones will get
+    evicted in LRU order once the size limit of the cache is reached.
+
+    Only files named as cache entries are considered part of the cache so
+    that any other files in the cache directory are left untouched.
+    """
+
+    #: file name suffix of all cache entries
+    ENTRY_SUFFIX = ".dicts"
+
+    def __init__(self, cache_dir, size_limit):
+        """
+        Construct an on-disk cache of parsed variant dictionaries.
+
+        :param str cache_dir: directory to store the cache entries in
+        :param int size_limit: maximal size of all cache entries in bytes,
+                               a non-positive value disables the cache
+        """
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+
+    def is_enabled(self):
+        """Check if the cache is used at all."""
+        return self.size_limit > 0
+
+    def key(self, base_file=None, base_str="", ovrwrt_file=None, ovrwrt_str="", limit=None):
+        """
+        Get the key of the cache entry for a given parser restriction.
+
+        :param base_file: absolute path of the file to be parsed first
+        :type base_file: str or None
+        :param str base_str: string to be parsed first
+        :param ovrwrt_file: absolute path of the file to be parsed last
+        :type ovrwrt_file: str or None
+        :param str ovrwrt_str: string to be parsed last
+        :param limit: maximal number of retained variant dictionaries
+        :type limit: int or None
+        :returns: hex digest identifying the cache entry
+        :rtype: str
+        """
+        hasher = hashlib.sha1()
+        hasher.update(_parser_digest().encode())
+        hasher.update(("limit=%s\n" % limit).encode())
+        for config_file in included_files(base_file, base_str) + included_files(ovrwrt_file, ovrwrt_str):
+            hasher.update(("file=%s\n" % config_file).encode())
+            with open(config_file, "rb") as f:
+                hasher.update(f.read())
+        hasher.update(("base_str=%s\n" % base_str).encode())
+        hasher.update(("ovrwrt_str=%s\n" % ovrwrt_str).encode())
+        return hasher.hexdigest()
+
+    def get(self, key):
+        """
+        Get the variant dictionaries stored in a cache entry.
+
+        :param str key: key of the cache entry
+        :returns: cached variant dictionaries or None if not cached
+        :rtype: [{str, str}] or None
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "rb") as f:
+                dicts = pickle.load(f)
+            # mark the entry as recently used for the LRU eviction
+            os.utime(entry_path, None)
+        except (OSError, EOFError, pickle.UnpicklingError) as error:
+            if os.path.exists(entry_path):
+                logging.debug("Ignoring corrupted parser cache entry %s: %s", key, error)
+            return None
+        return dicts
+
+    def set(self, key, dicts):
+        """
+        Store variant dictionaries in a cache entry.
+
+        :param str key: key of the cache entry
+        :param dicts: variant dictionaries to store
+        :type dicts: [{str, str}]
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write atomically since the cache could be shared among simultaneous runs
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(dicts, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._entry_path(key))
+        except OSError as error:
+            logging.warning("Could not store parser cache entry %s: %s", key, error)
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used cache entries until the size limit is satisfied."""
+        entries, total_size = [], 0
+        for entry_name in os.listdir(self.cache_dir):
+            if not entry_name.endswith(self.ENTRY_SUFFIX):
+                continue
+            entry_path = os.path.join(self.cache_dir, entry_name)
+            try:
+                entry_stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+            total_size += entry_stat.st_size
+        for _, entry_size, entry_path in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            logging.debug("Evicting parser cache entry %s", os.path.basename(entry_path))
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                pass
+            total_size -= entry_size
+
+    def clear(self):
+        """Remove all cache entries."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for entry_name in os.listdir(self.cache_dir):
+            if not entry_name.endswith(self.ENTRY_SUFFIX):
+                continue
+            try:
+                os.unlink(os.path.join(self.cache_dir, entry_name))
+            except FileNotFoundError:
+                pass
+
+    def _entry_path(self, key):
+        """Get the path of the file storing a cache entry."""
+        return os.path.join(self.cache_dir, key + self.ENTRY_SUFFIX)
+
+
+def included_files(config_file=None, config_str=""):
+    """
+    Get all configuration files participating in the parsing of a given
+    file and string, i.e. the files themselves and the files they include.
+
+    :param config_file: absolute path of the file to be parsed
+    :type config_file: str or None
+    :param str config_str: string to be parsed
+    :returns: paths to all participating files in order of discovery
+    :rtype: [str]
+
+    The inclusion is detected conservatively, i.e. includes within blocks
+    that might not be parsed due to some restriction are also considered.
+    """
+    files = []
+    to_scan = [] if config_file is None else [config_file]
+    to_scan += _include_paths(config_str, os.getcwd())
+    while len(to_scan) > 0:
+        config_file = to_scan.pop(0)
+        if config_file in files:
+            continue
+        files.append(config_file)
+        with open(config_file, "r") as f:
+            content = f.read()
+        to_scan += _include_paths(content, os.path.dirname(config_file))
+    return files
+
+
+def _include_paths(content, include_dir):
+    """Get the paths of all files included in some configuration content."""
+    paths = []
+    for include in re.findall(r"^\s*include\s+(.+?)\s*$", content, re.MULTILINE):
+        include = os.path.expanduser(include)
+        if not os.path.isabs(include):
+            include = os.path.join(include_dir, include)
+        paths.append(os.path.normpath(include))
+    return paths
+
+
+_parser_source_digest = None
+
+
+def _parser_digest():
+    """Get a digest of the parser implementation to invalidate cache entries on updates."""
+    global _parser_source_digest
+    if _parser_source_digest is None:
+        parser_source = cartesian_config.__file__
+        if parser_source.endswith(".pyc"):
+            parser_source = parser_source[:-1]
+        with open(parser_source, "rb") as f:
+            _parser_source_digest = hashlib.sha1(f.read()).hexdigest()
+    return _parser_source_digest
+
+
+_session_cache = {}
+
+
+def session_value(name, config_file, compute):
+    """
+    Get a value derived from a configuration file, computing it only once
+    per session as long as the file and the files it includes are unchanged.
+
+    :param str name: name of the derived value
+    :param str config_file: absolute path of the file the value is derived from
+    :param compute: function without arguments computing the value
+    :type compute: function
+    :returns: the (possibly already computed) derived value
+    """
+    stamp = tuple((path, os.stat(path).st_mtime_ns) for path in included_files(config_file))
+    cached = _session_cache.get(name)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    value = compute()
+    _session_cache[name] = (stamp, value)
+    return value
+
+
+def clear_session_cache():
+    """Forget all values derived from configuration files in the current session."""
+    _session_cache.clear()
+
+
+parser_cache_dir = settings.get_value('i2n.parser', 'cache_dir', default="~/.cache/avocado-i2n")
+parser_cache_size = settings.get_value('i2n.parser', 'cache_size', key_type=int, default=100)
+parser_cache = ParserCache(os.path.expanduser(parser_cache_dir), parser_cache_size * 1024 * 1024)
+
+
 ###################################################################
 # main parameter parsing methods
 ###################################################################
 
+
+class PeekableParser(cartesian_config.Parser):
+    """
+    Cartesian config parser retaining its first variant dictionary
+    and a bounded number of variants once these are computed.
+
+    Any further parsing of files or strings invalidates the retained results.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Construct a parser with arguments identical to the original parser.
+
+        :param args: arguments of the original parser
+        :param kwargs: keyword arguments of the original parser
+        """
+        self._reset_peek()
+        super(PeekableParser, self).__init__(*args, **kwargs)
+
+    def _reset_peek(self):
+        """Forget any retained results from previous evaluations."""
+        self._first_dict = None
+        self._peeked = False
+        self._count = 0
+        self._count_exhausted = False
+
+    def parse_file(self, *args, **kwargs):
+        """Parse a file and invalidate any retained results."""
+        self._reset_peek()
+        return super(PeekableParser, self).parse_file(*args, **kwargs)
+
+    def parse_string(self, s):
+        """Parse a string and invalidate any retained results unless empty."""
+        if s.strip() != "":
+            self._reset_peek()
+        return super(PeekableParser, self).parse_string(s)
+
+    def first_dict(self):
+        """
+        Get the first variant dictionary computing it at most once.
+
+        :returns: the first variant dictionary or None if the product is empty
+        :rtype: {str, str} or None
+        """
+        if not self._peeked:
+            self._first_dict = next(self.get_dicts(), None)
+            self._peeked = True
+        return self._first_dict
+
+    def is_empty(self):
+        """Check whether the Cartesian product of the parser is empty."""
+        return self.first_dict() is None
+
+    def count(self, limit):
+        """
+        Count the variant dictionaries up to some bound.
+
+        :param int limit: maximal number of variants to count
+        :returns: number of variants or the limit if there are at least as many
+        :rtype: int
+        """
+        if self._count_exhausted or self._count >= limit:
+            return min(self._count, limit)
+        self._count = 0
+        for d in itertools.islice(self.get_dicts(), limit):
+            # the first variant is retained as if peeked
+            if self._count == 0 and not self._peeked:
+                self._first_dict = d
+            self._count += 1
+        self._count_exhausted = self._count < limit
+        self._peeked = True
+        return self._count
+
+    def copy_peek(self, parser):
+        """
+        Reuse the retained results of another parser of identical configuration.
+
+        :param parser: parser to copy the retained results from
+        :type parser: :py:class:`PeekableParser`
+        """
+        self._first_dict = parser._first_dict
+        self._peeked = parser._peeked
+        self._count = parser._count
+        self._count_exhausted = parser._count_exhausted
+
+
 def print_restriction(base_file="", base_str="", ovrwrt_file="", ovrwrt_str=""):
     """
     Return any available information about a parser restriction.
@@ -90,10 +418,12 @@ def copy_parser(parser):
     :returns: new parser copy
     :rtype: Parser object
     """
-    new_parser = cartesian_config.Parser()
+    new_parser = PeekableParser()
     new_parser.node.content = copy.copy(parser.node.content)
     new_parser.node.children = copy.copy(parser.node.children)
     new_parser.node.labels = copy.copy(parser.node.labels)
+    if isinstance(parser, PeekableParser):
+        new_parser.copy_peek(parser)
     return new_parser
 
 
@@ -130,7 +460,7 @@ def prepare_parser(base_dict=None, base_str="", base_file=None,
     parameters is next and the file with parameters is taken as a base.
     The overwriting version is taken last, the base version first.
     """
-    parser = cartesian_config.Parser()
+    parser = PeekableParser()
 
     # configuration base
     if base_file is not None:
@@ -155,11 +485,9 @@ def prepare_parser(base_dict=None, base_str="", base_file=None,
         cartesian_config.print_dicts(options(False, show_dict_fullname, show_dict_contents), parser.get_dicts())
 
     # detect empty Cartesian product
-    try:
-        parser.get_dicts().__next__()
-    except StopIteration:
+    if parser.is_empty():
         raise EmptyCartesianProduct(print_restriction(base_file=base_file, base_str=base_str,
-                                                      ovrwrt_file=ovrwrt_file, ovrwrt_str=ovrwrt_str)) from None
+                                                      ovrwrt_file=ovrwrt_file, ovrwrt_str=ovrwrt_str))
 
     return parser
 
@@ -208,15 +536,71 @@ def update_parser(parser, ovrwrt_dict=None, ovrwrt_str="",
         cartesian_config.print_dicts(options(False, show_dict_fullname, show_dict_contents), parser.get_dicts())
 
     # detect empty Cartesian product
-    try:
-        parser.get_dicts().__next__()
-    except StopIteration:
+    if parser.is_empty():
         raise EmptyCartesianProduct(print_restriction(base_file=ovrwrt_base_file,
-                                                      ovrwrt_file=ovrwrt_file, ovrwrt_str=ovrwrt_str)) from None
+                                                      ovrwrt_file=ovrwrt_file, ovrwrt_str=ovrwrt_str))
 
     return parser
 
 
+def prepare_dicts(base_dict=None, base_str="", base_file=None,
+                  ovrwrt_dict=None, ovrwrt_str="", ovrwrt_file=None,
+                  limit=None, show_restriction=False):
+    """
+    Get the variant dictionaries of a basic parameters parser, reusing
+    the persistent parser cache whenever possible.
+
+    :param limit: maximal number of variant dictionaries to obtain or all if None
+    :type limit: int or None
+    :returns: the obtained variant dictionaries
+    :rtype: [{str, str}]
+    :raises: :py:class:`EmptyCartesianProduct` if no combination of the restrictions exists
+
+    The rest of the parameters are identical to the methods before.
+
+    Any parsing on a cache miss is performed just like via :py:func:`prepare_parser`
+    so the resulting dictionaries are identical to the ones from the parser.
+    """
+    base_path = None if base_file is None else os.path.join(custom_configs_dir, base_file)
+    ovrwrt_path = None if ovrwrt_file is None else os.path.join(os.environ['HOME'], ovrwrt_file)
+    if base_dict is not None:
+        base_str += dict_to_str(base_dict)
+    if ovrwrt_dict is not None:
+        ovrwrt_str += dict_to_str(ovrwrt_dict)
+    if show_restriction:
+        logging.debug(print_restriction(base_file=base_file, base_str=base_str,
+                                        ovrwrt_file=ovrwrt_file, ovrwrt_str=ovrwrt_str))
+
+    key = None
+    if parser_cache.is_enabled():
+        key = parser_cache.key(base_file=base_path, base_str=base_str,
+                               ovrwrt_file=ovrwrt_path, ovrwrt_str=ovrwrt_str, limit=limit)
+        dicts = parser_cache.get(key)
+        if dicts is not None:
+            logging.debug("Reusing %s cached variant dictionaries", len(dicts))
+    else:
+        dicts = None
+
+    if dicts is None:
+        parser = cartesian_config.Parser()
+        if base_path is not None:
+            parser.parse_file(base_path)
+        parser.parse_string(base_str)
+        if ovrwrt_path is not None:
+            parser.parse_file(ovrwrt_path)
+        parser.parse_string(ovrwrt_str)
+        dicts = list(itertools.islice(parser.get_dicts(), limit))
+        if key is not None:
+            parser_cache.set(key, dicts)
+
+    # detect empty Cartesian product
+    if len(dicts) == 0:
+        raise EmptyCartesianProduct(print_restriction(base_file=base_file, base_str=base_str,
+                                                      ovrwrt_file=ovrwrt_file, ovrwrt_str=ovrwrt_str))
+
+    return dicts
+
+
 def prepare_params(list_of_keys=None,
                    base_dict=None, base_str="", base_file=None,
                    ovrwrt_dict=None, ovrwrt_str="", ovrwrt_file=None,
@@ -237,13 +621,18 @@ def prepare_params(list_of_keys=None,
     used as a dummy restriction to get the parameters but avoid Cartesian explosion.
     So if you specify `only` be careful for such possibility.
     """
-    parser = prepare_parser(base_dict=base_dict, base_str=base_str, base_file=base_file,
-                            ovrwrt_dict=ovrwrt_dict, ovrwrt_str=ovrwrt_str, ovrwrt_file=ovrwrt_file,
-                            show_restriction=show_restriction,
-                            show_dictionaries=show_dictionaries,
-                            show_dict_fullname=show_dict_fullname,
-                            show_dict_contents=show_dict_contents)
-    return peek(parser)
+    if show_dictionaries:
+        parser = prepare_parser(base_dict=base_dict, base_str=base_str, base_file=base_file,
+                                ovrwrt_dict=ovrwrt_dict, ovrwrt_str=ovrwrt_str, ovrwrt_file=ovrwrt_file,
+                                show_restriction=show_restriction,
+                                show_dictionaries=show_dictionaries,
+                                show_dict_fullname=show_dict_fullname,
+                                show_dict_contents=show_dict_contents)
+        return peek(parser)
+    dicts = prepare_dicts(base_dict=base_dict, base_str=base_str, base_file=base_file,
+                          ovrwrt_dict=ovrwrt_dict, ovrwrt_str=ovrwrt_str, ovrwrt_file=ovrwrt_file,
+                          limit=1, show_restriction=show_restriction)
+    return utils_params.Params(dicts[0])
 
 
 ###################################################################
@@ -257,8 +646,12 @@ def all_vms():
 
     :returns: all available (from configuration) vms
     :rtype: list
+
+    The vms are parsed only once per session unless the configuration changes.
     """
-    return prepare_params(list_of_keys=["vms"], base_file="guest-base.cfg").objects("vms")
+    vms = session_value("all_vms", os.path.join(custom_configs_dir, "guest-base.cfg"),
+                        lambda: prepare_params(list_of_keys=["vms"], base_file="guest-base.cfg").objects("vms"))
+    return list(vms)
 
 
 def peek(parser, list_of_keys=None):
@@ -271,8 +664,16 @@ def peek(parser, list_of_keys=None):
     :type list_of_keys: [str] or None
     :returns: the first variant dictionary from the prepared parser
     :rtype: Params object
+
+    The first variant dictionary is computed only once for parsers
+    of type :py:class:`PeekableParser`.
     """
-    default_params = parser.get_dicts().__next__()
+    if isinstance(parser, PeekableParser):
+        default_params = parser.first_dict()
+        if default_params is None:
+            raise StopIteration
+    else:
+        default_params = parser.get_dicts().__next__()
     if list_of_keys is None:
         selected_params = default_params
     else:
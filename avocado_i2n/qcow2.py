@@ -0,0 +1,117 @@
+"""
+
+SUMMARY
+------------------------------------------------------
+Utility to read the internal snapshots of qcow2 images directly
+from their header and snapshot table without spawning any processes.
+
+Copyright: Intra2net AG
+
+
+INTERFACE
+------------------------------------------------------
+
+"""
+
+import struct
+import collections
+
+
+#: magic bytes at the beginning of each qcow2 image
+QCOW2_MAGIC = b"QFI\xfb"
+#: maximal number of snapshots in an image as enforced by qemu
+MAX_SNAPSHOTS = 65536
+#: maximal size of the extra data of a snapshot as enforced by qemu
+MAX_SNAPSHOT_EXTRA_DATA = 1024
+
+# header fields up to the snapshot table offset
+_HEADER = struct.Struct(">4sIQIIQIIQQIIQ")
+# snapshot table entry fields up to the extra data
+_SNAPSHOT_ENTRY = struct.Struct(">QIHHIIQII")
+
+
+#: internal snapshot of an image with its size in bytes, date in seconds
+#: since the epoch, and the vm clock in nanoseconds
+Snapshot = collections.namedtuple("Snapshot", ["id", "name", "vm_state_size", "date", "vm_clock"])
+
+
+class Qcow2Error(Exception):
+    """Invalid, truncated, or unsupported qcow2 image"""
+    pass
+
+
+def read_snapshots(image_path):
+    """
+    Read all internal snapshots of a qcow2 image.
+
+    :param str image_path: path to the qcow2 image
+    :returns: all snapshots in the order of the snapshot table
+    :rtype: [:py:class:`Snapshot`]
+    :raises: :py:class:`Qcow2Error` if the image is not a valid qcow2 image
+    :raises: :py:class:`OSError` if the image cannot be read
+
+    Only the header and snapshot table are read with bounded reads so that
+    the cost does not depend on the size of the image.
+    """
+    with open(image_path, "rb") as image:
+        header = _HEADER.unpack(_read(image, _HEADER.size, "header"))
+        magic, version = header[0], header[1]
+        if magic != QCOW2_MAGIC:
+            raise Qcow2Error("%s is not a qcow2 image" % image_path)
+        if version not in (2, 3):
+            raise Qcow2Error("Unsupported qcow2 version %s of %s" % (version, image_path))
+        snapshots_count, snapshots_offset = header[11], header[12]
+        if snapshots_count > MAX_SNAPSHOTS:
+            raise Qcow2Error("Too many snapshots (%s) in %s" % (snapshots_count, image_path))
+
+        snapshots = []
+        if snapshots_count == 0:
+            return snapshots
+        image.seek(snapshots_offset)
+        for _ in range(snapshots_count):
+            entry = _SNAPSHOT_ENTRY.unpack(_read(image, _SNAPSHOT_ENTRY.size, "snapshot table"))
+            (_, _, id_size, name_size, date_sec, date_nsec,
+             vm_clock, vm_state_size, extra_size) = entry
+            if extra_size > MAX_SNAPSHOT_EXTRA_DATA:
+                raise Qcow2Error("Too large snapshot extra data (%s) in %s" % (extra_size, image_path))
+            extra = _read(image, extra_size, "snapshot extra data")
+            # newer images store the full 64-bit vm state size in the extra data
+            if extra_size >= 8:
+                vm_state_size = struct.unpack(">Q", extra[:8])[0]
+            snapshot_id = _read(image, id_size, "snapshot id").decode()
+            snapshot_name = _read(image, name_size, "snapshot name").decode()
+            # each table entry is padded to a multiple of 8 bytes
+            entry_size = _SNAPSHOT_ENTRY.size + extra_size + id_size + name_size
+            image.seek((8 - entry_size % 8) % 8, 1)
+            snapshots.append(Snapshot(snapshot_id, snapshot_name, vm_state_size,
+                                      date_sec + date_nsec / 1e9, vm_clock))
+        return snapshots
+
+
+def read_backing_file(image_path):
+    """
+    Read the backing file of a qcow2 image.
+
+    :param str image_path: path to the qcow2 image
+    :returns: the backing file as stored in the image or None if there is none
+    :rtype: str or None
+    :raises: :py:class:`Qcow2Error` if the image is not a valid qcow2 image
+    :raises: :py:class:`OSError` if the image cannot be read
+    """
+    with open(image_path, "rb") as image:
+        header = _HEADER.unpack(_read(image, _HEADER.size, "header"))
+        if header[0] != QCOW2_MAGIC:
+            raise Qcow2Error("%s is not a qcow2 image" % image_path)
+        backing_file_offset, backing_file_size = header[2], header[3]
+        if backing_file_offset == 0:
+            return None
+        image.seek(backing_file_offset)
+        return _read(image, backing_file_size, "backing file name").decode()
+
+
+def _read(image, size, part):
+    """Read an exact number of bytes from an image or fail if it is truncated."""
+    data = image.read(size)
+    if len(data) != size:
+        raise Qcow2Error("Truncated %s in %s" % (part, image.name))
+    return data
@@ -13,19 +13,52 @@ INTERFACE
 """
 
 import os
+import time
+import queue
+import fcntl
+import pickle
 import logging
 import signal
+import collections
+import multiprocessing
 from multiprocessing import SimpleQueue
 
 from avocado.core.runner import TestRunner
+from virttest import utils_env, data_dir
 
 from . import params_parser as param
+from . import state_setup
+from . import lvm_shell
+from . import history
+from . import traversal
+from . import simulation
 from .cartesian_graph import TestGraph, TestNode
 
 
 class CartesianRunner(TestRunner):
     """Test runner for Cartesian graph traversal."""
 
+    def __init__(self, job, result):
+        """
+        Construct a runner with empty state operation statistics.
+
+        :param job: job to run the tests for
+        :param result: result instance to report the tests to
+        """
+        super().__init__(job, result)
+        #: number of performed (and skipped) state operations by type
+        self.state_operations = collections.Counter()
+        # last state each vm was brought to and that is still unchanged
+        self._unchanged_states = {}
+        #: speedup of the last traversal compared to running all its tests serially
+        self.traversal_speedup = 1.0
+        #: durations of previously run test nodes and state operations
+        self.history = history.duration_history
+        #: policy of the current (or last) traversal
+        self.policy = traversal.TraversalPolicy(self)
+        #: simulated state backend of a dry run or None for an actual run
+        self.simulator = None
+
     """running functionality"""
     def run_test_node(self, node):
         """
@@ -37,8 +70,11 @@ class CartesianRunner(TestRunner):
         :rtype: bool
 
         This is a simple wrapper to provide some default arguments
-        for simplicity of invocation.
+        for simplicity of invocation. During a dry run all test nodes
+        but the scan node are only simulated.
         """
+        if self.simulator is not None and not node.is_scan_node():
+            return self.simulator.run(node)
         return self.run_test(node.get_test_factory(self.job), SimpleQueue(), set())
 
     def run_traversal(self, graph, param_str):
@@ -59,11 +95,44 @@ class CartesianRunner(TestRunner):
 
         Of course all possible children are restricted by the user-defined "only" and
         the number of internal test nodes is minimized for achieving this goal.
+
+        If the `traversal_slots` parameter is larger than one, test nodes using
+        disjoint sets of test objects are run concurrently in that many slots
+        (separate processes with their own env files) with the same setup and
+        cleanup ordering as described above.
+
+        The choice of parents and children, the rerunning of ephemeral setup,
+        and the timing of cleanups are delegated to the traversal policy selected
+        with the `traversal_policy` parameter (see :py:mod:`traversal`).
+
+        If the `dry_run_traversal` parameter is set, all tests and their state
+        operations are only simulated (see :py:mod:`simulation`) starting from
+        the scanned states or the synthetic inventory in the
+        `dry_run_traversal_states` parameter.
         """
         shared_roots = graph.get_nodes_by("name", "(\.|^)0scan(\.|^)")
         assert len(shared_roots) == 1, "There can be only exactly one root node"
         root = shared_roots[0]
 
+        policy_name = root.params.get("traversal_policy", "name")
+        self.policy = traversal.traversal_policy(policy_name, self)
+        logging.info("Traversing the test graph with the %s policy", policy_name)
+
+        if root.params.get("dry_run_traversal", "no") == "yes":
+            costs = {kind: float(root.params.get("dry_run_traversal_%s_cost" % kind, cost))
+                     for kind, cost in simulation.DEFAULT_COSTS.items()}
+            present_states = (root.params.objects("dry_run_traversal_states")
+                              if "dry_run_traversal_states" in root.params else None)
+            self.simulator = simulation.StateSimulator(present_states, costs, self.history)
+            logging.info("Simulating the traversal without running any tests")
+        else:
+            self.simulator = None
+
+        slots = int(root.params.get("traversal_slots", "1"))
+        if slots > 1:
+            # nothing is left for the serial traversal below afterwards
+            self._run_parallel_traversal(graph, root, param_str, slots)
+
         if logging.getLogger('graph').level <= logging.DEBUG:
             traverse_dir = os.path.join(self.job.logdir, "graph_traverse")
             if not os.path.exists(traverse_dir):
@@ -71,14 +140,14 @@ class CartesianRunner(TestRunner):
             step = 0
 
         traverse_path = [root]
-        while not root.is_cleanup_ready():
+        while not self._awaits_deferred_cleanups(root):
             next = traverse_path[-1]
             if len(traverse_path) > 1:
                 previous = traverse_path[-2]
             else:
                 # since the loop is discontinued if len(traverse_path) == 0 or root.is_cleanup_ready()
                 # a valid current node with at least one child is guaranteed
-                traverse_path.append(next.pick_next_child())
+                traverse_path.append(self.policy.next_child(next))
                 continue
 
             logging.debug("At test node %s which is %sready with setup, %sready with cleanup,"
@@ -96,29 +165,40 @@ class CartesianRunner(TestRunner):
 
                 if next.is_setup_ready():
                     self._traverse_test_node(graph, next, param_str)
+                    graph.update_progress(next)
                     previous.visit_node(next)
                     traverse_path.pop()
                 else:
                     # inverse DFS
-                    traverse_path.append(next.pick_next_parent())
+                    traverse_path.append(self.policy.next_parent(next))
             elif previous in next.setup_nodes or previous in next.visited_setup_nodes:
 
+                # the cleanup of the test node might have been deferred with its last children
+                if next in self.policy.deferred_cleanups:
+                    traverse_path.pop()
+                    continue
                 # stop if test is not a setup leaf since parents have higher priority than children
-                if not next.is_setup_ready():
-                    traverse_path.append(next.pick_next_parent())
+                elif not next.is_setup_ready():
+                    traverse_path.append(self.policy.next_parent(next))
                     continue
                 else:
                     self._traverse_test_node(graph, next, param_str)
+                    graph.update_progress(next)
 
                 if next.is_cleanup_ready():
-                    self._reverse_test_node(graph, next, param_str)
-                    for setup in next.visited_setup_nodes:
-                        setup.visit_node(next)
+                    if self.policy.should_clean_now(next):
+                        self._reverse_test_node(graph, next, param_str)
+                        for setup in next.visited_setup_nodes:
+                            setup.visit_node(next)
+                            graph.update_progress(setup)
+                        self._defer_awaiting_setups(next)
+                    else:
+                        self._defer_cleanup(next)
                     traverse_path.pop()
                     graph.report_progress()
                 else:
                     # normal DFS
-                    traverse_path.append(next.pick_next_child())
+                    traverse_path.append(self.policy.next_child(next))
             else:
                 raise AssertionError("Discontinuous path in the test dependency graph detected")
 
@@ -126,6 +206,21 @@ class CartesianRunner(TestRunner):
                 step += 1
                 graph.visualize(traverse_dir, step)
 
+        self._run_deferred_cleanups(graph, param_str)
+
+        for operation, count in self.policy.avoided_operations.items():
+            self._count_state_operation("avoided " + operation, count)
+        logging.info("State operations: %s", ", ".join("%s %s" % (count, operation) for operation, count
+                                                        in sorted(self.state_operations.items())))
+        if self.simulator is not None:
+            with open(os.path.join(self.job.logdir, "dry_run_traversal"), "w") as f:
+                f.write(self.simulator.report())
+            logging.info("Dry run with %i operations estimated to take %0.2f s",
+                         len(self.simulator.operations), self.simulator.estimated_time)
+        else:
+            # other jobs recording durations meanwhile wait for the compaction
+            self.history.compact()
+
     def run_suite(self, test_suite, _variant, _timeout=0,
                   _replay_map=None, _execution_order=None):
         """
@@ -156,6 +251,9 @@ class CartesianRunner(TestRunner):
         except KeyboardInterrupt:
             TEST_LOG.error('Job interrupted by ctrl+c.')
             summary.add('INTERRUPTED')
+        finally:
+            # the LVM shell is shared by the offline state operations of all tests
+            lvm_shell.close_shell()
 
         if self.job.sysinfo is not None:
             self.job.sysinfo.end_job_hook()
@@ -182,9 +280,14 @@ class CartesianRunner(TestRunner):
         nodes = graph.get_nodes_by(param_key="name", param_val="(\.|^)0scan(\.|^)")
         assert len(nodes) == 1, "There can only be one shared root"
         test_node = nodes[0]
-        self.run_test_node(test_node)
+        if self.simulator is not None and self.simulator.synthetic:
+            graph.scan_object_states(None, present_states=self.simulator.states)
+        else:
+            self.run_test_node(test_node)
+            graph.load_setup_list(self.job.logdir)
+        if self.simulator is not None:
+            self.simulator.seed(graph)
 
-        graph.load_setup_list(self.job.logdir)
         for node in graph.nodes:
             self.result.cancelled += 1 if not node.should_run else 0
 
@@ -264,21 +367,375 @@ class CartesianRunner(TestRunner):
             self.run_test_node(TestNode("0q", install_parser, test_node.objects))
 
     """internals"""
+    def _run_parallel_traversal(self, graph, root, param_str, slots):
+        """
+        Run all tests from a test graph concurrently where their test objects allow it.
+
+        :param graph: test graph to traverse
+        :type graph: :py:class:`TestGraph`
+        :param root: shared root of all test nodes
+        :type root: :py:class:`TestNode`
+        :param str param_str: block of command line parameters
+        :param int slots: maximal number of test nodes run at the same time
+        :raises: :py:class:`AssertionError` if the traversal cannot proceed
+
+        Each test node locks all test objects (vms) it uses while it is run or
+        cleaned up so that only test nodes with disjoint test objects overlap.
+        A test node is run once all its setup nodes were run and is cleaned up
+        once all its cleanup nodes were cleaned up. Cleanups are picked before
+        runs, the former by their ordering keys and the latter by the priority
+        of the traversal policy, among the nodes whose test objects are free.
+        The first error stops the scheduling of further test nodes and is raised
+        once the running ones are finished. Any cleanups deferred by the
+        traversal policy are performed at the end.
+
+        Each traversal step is performed in a separate process of its slot (see
+        :py:meth:`_run_traversal_step`) while all scheduling is done in this
+        process. During a dry run the steps are only simulated in this process.
+        """
+        start_time = time.time()
+        serial_time = self._timed_traversal_step(graph, root, param_str)
+        graph.update_progress(root)
+
+        to_run, to_clean = [], []
+        def setup_finished(test_node):
+            for child in list(test_node.cleanup_nodes):
+                child.visit_node(test_node)
+                if child.is_setup_ready():
+                    to_run.append(child)
+        def cleanup_ready(test_node):
+            if self.policy.should_clean_now(test_node):
+                to_clean.append(test_node)
+            else:
+                self._defer_cleanup(test_node)
+        def cleanup_finished(test_node):
+            for setup in test_node.visited_setup_nodes:
+                setup.visit_node(test_node)
+                graph.update_progress(setup)
+                if setup is not root and setup.is_cleanup_ready():
+                    cleanup_ready(setup)
+            self._defer_awaiting_setups(test_node)
+            graph.report_progress()
+        setup_finished(root)
+
+        # the steps refer to the test nodes by position among processes
+        nodes = list(graph.nodes)
+        node_indices = {test_node: index for index, test_node in enumerate(nodes)}
+        messages = multiprocessing.get_context("fork").Queue()
+        running = {}
+        locked_objects = set()
+        error = None
+        try:
+            while running or (error is None and not self._awaits_deferred_cleanups(root)):
+                if error is None:
+                    for test_node, cleanup in self._pick_ready_nodes(to_clean, to_run):
+                        free_slots = [slot for slot in range(slots) if slot not in running]
+                        if len(free_slots) == 0:
+                            break
+                        objects = self._traversal_objects(test_node, cleanup)
+                        if objects & locked_objects:
+                            continue
+                        (to_clean if cleanup else to_run).remove(test_node)
+                        locked_objects |= objects
+                        process = self._start_traversal_step(graph, node_indices, test_node, param_str,
+                                                             cleanup, free_slots[0], messages)
+                        running[free_slots[0]] = (process, test_node, cleanup, objects)
+                if not running:
+                    raise AssertionError("Test traversal cannot proceed with %s still to run "
+                                         "and %s still to clean" % (to_run, to_clean))
+
+                slot, duration, step_error = self._finish_traversal_step(nodes, running, messages)
+                _, test_node, cleanup, objects = running.pop(slot)
+                locked_objects -= objects
+                if step_error is not None:
+                    if error is None:
+                        error = step_error
+                    else:
+                        logging.error("Test node %s failed as well: %s", test_node, step_error)
+                    continue
+                serial_time += duration
+
+                if cleanup:
+                    cleanup_finished(test_node)
+                else:
+                    graph.update_progress(test_node)
+                    if test_node.is_cleanup_ready():
+                        cleanup_ready(test_node)
+                    else:
+                        setup_finished(test_node)
+        except KeyboardInterrupt:
+            # the running steps receive the interrupt as well
+            for process, _, _, _ in running.values():
+                if process is not None:
+                    process.join()
+            raise
+        if error is not None:
+            raise error
+        serial_time += self._run_deferred_cleanups(graph, param_str)
+
+        parallel_time = time.time() - start_time
+        self.traversal_speedup = serial_time / parallel_time if parallel_time > 0 else 1.0
+        logging.info("Parallel traversal in %i slots took %0.2f s compared to %0.2f s of serial "
+                     "traversal (%0.2fx speedup)", slots, parallel_time, serial_time,
+                     self.traversal_speedup)
+
+    def _start_traversal_step(self, graph, node_indices, test_node, param_str, cleanup, slot, messages):
+        """
+        Start a step of the parallel traversal in a slot.
+
+        :param graph: test graph the test node belongs to
+        :type graph: :py:class:`TestGraph`
+        :param node_indices: positions of all test nodes of the test graph to refer to them by
+        :type node_indices: {:py:class:`TestNode`, int}
+        :param test_node: test node to run or clean up
+        :type test_node: :py:class:`TestNode`
+        :param str param_str: block of command line parameters
+        :param bool cleanup: whether to clean up instead of run the test node
+        :param int slot: slot to perform the step in
+        :param messages: queue to report the tests and the finished step to
+        :type messages: :py:class:`multiprocessing.Queue`
+        :returns: process performing the step or None if it was already performed
+        :rtype: :py:class:`multiprocessing.Process` or None
+        """
+        if self.simulator is not None:
+            # simulated steps do not run any tests and share the simulated states
+            self._run_traversal_step(graph, node_indices, test_node, param_str, cleanup, slot, messages)
+            return None
+        process = multiprocessing.get_context("fork").Process(target=self._run_traversal_step,
+                                                              args=(graph, node_indices, test_node, param_str,
+                                                                    cleanup, slot, messages, True))
+        process.start()
+        return process
+
+    def _run_traversal_step(self, graph, node_indices, test_node, param_str, cleanup, slot, messages,
+                            forked=False):
+        """
+        Perform a step of the parallel traversal and report its changes.
+
+        :param bool forked: whether the step is performed in a separate process
+        :raises: :py:class:`AssertionError` if the step process crashed
+
+        The rest of the parameters are identical to :py:meth:`_start_traversal_step`.
+
+        A separate process runs the tests in its own main thread and keeps the
+        vms it uses in an env file of its slot so that concurrent tests never
+        share the env file, the signal handling, or the test result. All tests
+        are reported to the result of the main process together with the
+        changed states of the traversed test nodes and their test objects.
+        """
+        if forked:
+            self.result = _SlotResult(self.result, messages)
+            self.state_operations = collections.Counter()
+        step_nodes = [test_node]
+        if not cleanup:
+            step_nodes += [setup for setup in test_node.visited_setup_nodes if setup.is_ephemeral()]
+        vms = self._traversal_objects(test_node, cleanup)
+
+        duration, error = 0.0, None
+        try:
+            if forked:
+                env_file = os.path.join(data_dir.get_tmp_dir(), test_node.params.get("env", "env"))
+                slot_env = "env_slot%i" % slot
+                slot_env_file = os.path.join(data_dir.get_tmp_dir(), slot_env)
+                if os.path.exists(slot_env_file):
+                    os.unlink(slot_env_file)
+                _transfer_env_vms(env_file, slot_env_file, vms)
+                for step_node in step_nodes:
+                    step_node.params["env"] = slot_env
+                param_str += param.dict_to_str({"env": slot_env})
+                try:
+                    duration = self._timed_traversal_step(graph, test_node, param_str, cleanup)
+                finally:
+                    _transfer_env_vms(slot_env_file, env_file, vms)
+            else:
+                duration = self._timed_traversal_step(graph, test_node, param_str, cleanup)
+        except BaseException as step_error:
+            error = step_error
+            try:
+                pickle.dumps(error)
+            except Exception:
+                error = AssertionError("%s: %s" % (error.__class__.__name__, error))
+
+        changes = {"nodes": [(node_indices[n], n.should_run, n.should_clean) for n in step_nodes],
+                   "objects": {o.name: o.current_state for n in step_nodes for o in n.objects},
+                   "unchanged": {vm: self._unchanged_states.get(vm) for vm in vms},
+                   "operations": self.state_operations if forked else collections.Counter()}
+        messages.put(("step", slot, duration, error, changes))
+
+    def _finish_traversal_step(self, nodes, running, messages):
+        """
+        Wait for any running step of the parallel traversal and apply its changes.
+
+        :param nodes: all test nodes of the test graph to refer to them by position
+        :type nodes: [:py:class:`TestNode`]
+        :param running: processes, test nodes, cleanup flags, and locked test objects by slot
+        :type running: {int, (:py:class:`multiprocessing.Process` or None, :py:class:`TestNode`, bool, {str})}
+        :param messages: queue the steps report their tests and changes to
+        :type messages: :py:class:`multiprocessing.Queue`
+        :returns: slot of the finished step, its duration, and its error if any
+        :rtype: (int, float, Exception or None)
+        """
+        while True:
+            try:
+                message = messages.get(timeout=1)
+            except queue.Empty:
+                for slot, (process, test_node, _, _) in running.items():
+                    if process is not None and process.exitcode not in [None, 0]:
+                        process.join()
+                        return slot, 0.0, AssertionError("Traversal step of %s exited with code %s"
+                                                         % (test_node, process.exitcode))
+                continue
+            if message[0] == "result":
+                getattr(self.result, message[1])(message[2])
+                continue
+
+            _, slot, duration, error, changes = message
+            if slot not in running:
+                continue
+            process = running[slot][0]
+            if process is not None:
+                process.join()
+            for index, should_run, should_clean in changes["nodes"]:
+                nodes[index].should_run, nodes[index].should_clean = should_run, should_clean
+                for test_object in nodes[index].objects:
+                    test_object.current_state = changes["objects"].get(test_object.name,
+                                                                       test_object.current_state)
+            for vm_name, state in changes["unchanged"].items():
+                if state is None:
+                    self._unchanged_states.pop(vm_name, None)
+                else:
+                    self._unchanged_states[vm_name] = state
+            self.state_operations.update(changes["operations"])
+            return slot, duration, error
+
+    def _pick_ready_nodes(self, to_clean, to_run):
+        """
+        Get all test nodes ready to be cleaned up or run in order of priority.
+
+        :param to_clean: test nodes ready to be cleaned up
+        :type to_clean: [:py:class:`TestNode`]
+        :param to_run: test nodes ready to be run
+        :type to_run: [:py:class:`TestNode`]
+        :returns: test nodes and whether they are to be cleaned up
+        :rtype: [(:py:class:`TestNode`, bool)]
+        """
+        cleanups = sorted(to_clean, key=lambda n: n.order_key)
+        runs = sorted(to_run, key=self.policy.priority)
+        return [(n, True) for n in cleanups] + [(n, False) for n in runs]
+
+    def _traversal_objects(self, test_node, cleanup=False):
+        """
+        Get the names of all test objects a traversal step of a test node uses.
+
+        :param test_node: test node to run or clean up
+        :type test_node: :py:class:`TestNode`
+        :param bool cleanup: whether the test node is cleaned up
+        :returns: names of the used test objects
+        :rtype: {str}
+
+        Running a test node can also rerun any of its ephemeral setup nodes.
+        """
+        objects = set(test_node.params.objects("vms"))
+        if not cleanup:
+            for setup in test_node.visited_setup_nodes:
+                if setup.is_ephemeral():
+                    objects |= set(setup.params.objects("vms"))
+        return objects
+
+    def _defer_cleanup(self, test_node):
+        """
+        Defer the cleanup of a test node until the end of the traversal.
+
+        :param test_node: test node ready to be cleaned up
+        :type test_node: :py:class:`TestNode`
+
+        The test node is not visited by its setup nodes until it is cleaned up
+        so that their own cleanup is deferred until after it as well.
+        """
+        self.policy.deferred_cleanups[test_node] = None
+        self._defer_awaiting_setups(test_node)
+
+    def _defer_awaiting_setups(self, test_node):
+        """
+        Defer the cleanup of all setup nodes of a test node awaiting deferred cleanups only.
+
+        :param test_node: test node that was cleaned up or deferred
+        :type test_node: :py:class:`TestNode`
+        """
+        for setup in test_node.visited_setup_nodes:
+            if setup.is_shared_root() or setup.is_cleanup_ready() or setup in self.policy.deferred_cleanups:
+                continue
+            if self._awaits_deferred_cleanups(setup):
+                self._defer_cleanup(setup)
+
+    def _awaits_deferred_cleanups(self, test_node):
+        """
+        Check whether all children of a test node left to clean up have deferred cleanups.
+
+        :param test_node: test node to check
+        :type test_node: :py:class:`TestNode`
+        :returns: whether the traversal cannot proceed below the test node before its end
+        :rtype: bool
+        """
+        return all(child in self.policy.deferred_cleanups for child in test_node.cleanup_nodes)
+
+    def _run_deferred_cleanups(self, graph, param_str):
+        """
+        Clean up all test nodes with deferred cleanups in the order they were deferred.
+
+        :param graph: test graph the test nodes belong to
+        :type graph: :py:class:`TestGraph`
+        :param str param_str: block of command line parameters
+        :returns: duration of all cleanups in seconds
+        :rtype: float
+        """
+        duration = 0.0
+        deferred_cleanups = self.policy.deferred_cleanups
+        while len(deferred_cleanups) > 0:
+            test_node = next(iter(deferred_cleanups))
+            duration += self._timed_traversal_step(graph, test_node, param_str, cleanup=True)
+            del deferred_cleanups[test_node]
+            for setup in test_node.visited_setup_nodes:
+                setup.visit_node(test_node)
+                graph.update_progress(setup)
+            graph.report_progress()
+        return duration
+
+    def _timed_traversal_step(self, graph, test_node, param_str, cleanup=False):
+        """
+        Run or clean up a test node as a single step of the test traversal.
+
+        :param graph: test graph the test node belongs to
+        :type graph: :py:class:`TestGraph`
+        :param test_node: test node to run or clean up
+        :type test_node: :py:class:`TestNode`
+        :param str param_str: block of command line parameters
+        :param bool cleanup: whether to clean up instead of run the test node
+        :returns: duration of the step in seconds
+        :rtype: float
+
+        Any ephemeral setup nodes that got lost are rerun before running the
+        test node just like when passing through them in the serial traversal.
+        """
+        start_time = time.time()
+        if cleanup:
+            self._reverse_test_node(graph, test_node, param_str)
+        else:
+            for setup in test_node.visited_setup_nodes:
+                if setup.is_ephemeral():
+                    self._traverse_test_node(graph, setup, param_str)
+            self._traverse_test_node(graph, test_node, param_str)
+        return time.time() - start_time
+
     def _traverse_test_node(self, graph, test_node, param_str):
         """Run a single test according to user defined policy and state availability."""
         # ephemeral setup can get lost and if so must be repeated
-        if not test_node.should_run and test_node.is_ephemeral() and not test_node.is_cleanup_ready():
-            for test_object in test_node.objects:
-                object_name = test_object.name
-                object_params = test_node.params.object_params(object_name)
-                # if previous state is not known keep behavior assuming that the user knows what they are doing
-                if object_params.get("set_state") != test_object.current_state != "unknown":
-                    logging.debug("Re-running ephemeral setup %s since %s state was switched to %s",
-                                  test_node.params["shortname"], test_object.name, test_object.current_state)
-                    test_node.should_run = True
-                    break
+        if not test_node.should_run and test_node.is_ephemeral() and self.policy.should_rerun(test_node):
+            test_node.should_run = True
+            self._count_state_operation("ephemeral rerun")
 
         if test_node.should_run:
+            start_time = time.time()
             if test_node.is_scan_node():
                 logging.debug("Test run started from the shared root")
                 self.run_scan_node(graph, param_str)
@@ -291,10 +748,19 @@ class CartesianRunner(TestRunner):
                     self.run_create_node(graph, test_node.params.get("vms", ""), setup_str)
                 elif test_node.is_install_node():
                     self.run_install_node(graph, test_node.params.get("vms", ""), setup_str)
+                for test_object in test_node.objects:
+                    self._unchanged_states.pop(test_object.name, None)
 
             else:
                 # finally, good old running of an actual test
-                self.run_test_node(test_node)
+                skipped_states = self._skip_unchanged_states(test_node)
+                if len(skipped_states) > 0:
+                    # the cached parameters of the test node must remain intact
+                    run_parser = param.update_parser(test_node.parser, ovrwrt_dict=skipped_states)
+                    status = self.run_test_node(TestNode(test_node.name, run_parser, test_node.objects))
+                else:
+                    status = self.run_test_node(test_node)
+                self._track_unchanged_states(test_node, status)
 
             for test_object in test_node.objects:
                 object_name = test_object.name
@@ -302,6 +768,8 @@ class CartesianRunner(TestRunner):
                 if object_params.get("set_state") is not None and object_params.get("set_state") != "":
                     test_object.current_state = object_params.get("set_state")
             test_node.should_run = False
+            if self.simulator is None:
+                self.history.record("node", test_node.params["shortname"], time.time() - start_time)
         else:
             logging.debug("Skipping test %s", test_node.params["shortname"])
 
@@ -336,10 +804,69 @@ class CartesianRunner(TestRunner):
                                                              ovrwrt_base_file="sets.cfg",
                                                              ovrwrt_file=param.tests_ovrwrt_file)
                         self.run_test_node(TestNode("c" + test_node.name, forward_parser, [test_object]))
+                        self._count_state_operation("unset")
+                        self._unchanged_states.pop(vm_name, None)
 
         else:
             logging.debug("The test %s doesn't leave any states to be cleaned up", test_node.params["shortname"])
 
+    def _skip_unchanged_states(self, test_node):
+        """
+        Skip retrieving the states of all vms that are still in these states.
+
+        :param test_node: test node to skip state retrieval for
+        :type test_node: :py:class:`TestNode`
+        :returns: parameters to run the test node with to skip the state retrieval
+        :rtype: {str, str}
+
+        A vm is still in the retrieved state if the previous tests using it
+        only retrieved the same state and declared they do not modify it via
+        `mutates_state = no` so that no revert is needed in between.
+        """
+        skipped_states = {}
+        for vm_name in test_node.params.objects("vms"):
+            vm_params = test_node.params.object_params(vm_name)
+            get_state = vm_params.get("get_state", "")
+            if get_state in [""] + state_setup.OFFLINE_ROOTS + state_setup.ONLINE_ROOTS:
+                continue
+            if (vm_params.get("mutates_state", "yes") == "no" and
+                    self._unchanged_states.get(vm_name) == (get_state, vm_params.get("get_type", "any"))):
+                logging.debug("Skipping the retrieval of the unchanged state %s of %s", get_state, vm_name)
+                skipped_states["get_state_%s" % vm_name] = ""
+                self._count_state_operation("skipped get")
+                if traversal.is_online_state(test_node, vm_name, get_state):
+                    self._count_state_operation("skipped online get")
+            else:
+                self._count_state_operation("get")
+                if traversal.is_online_state(test_node, vm_name, get_state):
+                    self._count_state_operation("online get")
+        return skipped_states
+
+    def _track_unchanged_states(self, test_node, status):
+        """
+        Track which vms remain in their last retrieved state after a test.
+
+        :param test_node: test node that was just run
+        :type test_node: :py:class:`TestNode`
+        :param bool status: run status of the test node
+
+        A failed test might have left its vms in any state so they are no
+        longer considered in their retrieved state.
+        """
+        for vm_name in test_node.params.objects("vms"):
+            vm_params = test_node.params.object_params(vm_name)
+            if vm_params.get("set_state"):
+                self._count_state_operation("set")
+            if (status and vm_params.get("get_state") and not vm_params.get("set_state") and
+                    vm_params.get("mutates_state", "yes") == "no" and vm_params.get("kill_vm", "no") != "yes"):
+                self._unchanged_states[vm_name] = (vm_params["get_state"], vm_params.get("get_type", "any"))
+            else:
+                self._unchanged_states.pop(vm_name, None)
+
+    def _count_state_operation(self, operation, count=1):
+        """Count a performed (or skipped) state operation."""
+        self.state_operations[operation] += count
+
     def _graph_from_suite(self, test_suite):
         """
         Restore a Cartesian graph from the digested list of test object factories.
@@ -355,3 +882,48 @@ class CartesianRunner(TestRunner):
             assert node1 == node2.get_test_factory()
 
         return graph
+
+
+def _transfer_env_vms(source_file, target_file, vm_names):
+    """
+    Transfer the vms of some test objects from one env file to another.
+
+    :param str source_file: env file to take the vms from
+    :param str target_file: env file to put the vms in (replacing its vms)
+    :param vm_names: names of the vms to transfer
+    :type vm_names: {str}
+
+    The transfer is locked among all processes using the same env files.
+    """
+    with open(os.path.join(os.path.dirname(target_file), ".env.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        source, target = utils_env.Env(source_file), utils_env.Env(target_file)
+        for vm_name in vm_names:
+            vm = source.get_vm(vm_name)
+            if vm is not None:
+                target.register_vm(vm_name, vm)
+            elif target.get_vm(vm_name) is not None:
+                target.unregister_vm(vm_name)
+        target.save()
+
+
+class _SlotResult(object):
+    """
+    Test result of a traversal step process passing on all reported tests
+    to the test result of the main process.
+    """
+
+    def __init__(self, result, messages):
+        self._result = result
+        self._messages = messages
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def start_test(self, state):
+        self._result.start_test(state)
+        self._messages.put(("result", "start_test", state))
+
+    def check_test(self, state):
+        self._result.check_test(state)
+        self._messages.put(("result", "check_test", state))
@@ -0,0 +1,137 @@
+"""
+
+SUMMARY
+------------------------------------------------------
+Simulated state backend for dry runs of the Cartesian graph traversal
+which estimate the state operations and duration of a test run without
+running any tests.
+
+Copyright: Intra2net AG
+
+
+INTERFACE
+------------------------------------------------------
+
+"""
+
+import logging
+import threading
+
+from . import state_setup
+from . import history
+
+
+#: durations in seconds of the simulated operations without any history
+DEFAULT_COSTS = {"node": 60.0, "get": 10.0, "set": 30.0, "unset": 5.0}
+
+
+class StateSimulator(object):
+    """
+    Simulated state backend keeping all states of all vms in memory.
+
+    Each simulated test node retrieves (gets) the states it requires, is
+    run, and finally creates (sets) the states it leaves behind while any
+    cleanup node removes (unsets) them. Each operation is estimated by its
+    duration from previous runs or by the cost table if it has no history.
+    The estimated duration of a test node from previous runs already
+    includes its state operations which are then not added on top of it.
+    """
+
+    def __init__(self, present_states=None, costs=None, durations=None):
+        """
+        Construct a simulator of all state operations of a traversal.
+
+        :param present_states: synthetic inventory of the states present at the
+                               start as "vm/state" names or None to use the
+                               actual states from a scan of the test graph
+        :type present_states: [str] or None
+        :param costs: durations overriding the :py:data:`DEFAULT_COSTS`
+        :type costs: {str, float} or None
+        :param durations: durations of previously run test nodes and state operations
+        :type durations: :py:class:`history.DurationHistory` or None
+        """
+        self.synthetic = present_states is not None
+        #: names of all currently present states as "vm/state"
+        self.states = set(present_states or [])
+        self.costs = dict(DEFAULT_COSTS)
+        self.costs.update(costs or {})
+        self.durations = durations if durations is not None else history.DurationHistory("")
+        #: simulated operations as kind, name, and estimated duration
+        self.operations = []
+        #: states required by test nodes but missing at the time
+        self.missing_states = []
+        #: estimated duration of all simulated operations in seconds
+        self.estimated_time = 0.0
+        self._lock = threading.Lock()
+
+    def seed(self, graph):
+        """
+        Add the states of all test nodes that will not be run to the present states.
+
+        :param graph: test graph whose object states were scanned
+        :type graph: :py:class:`cartesian_graph.TestGraph`
+        """
+        for test_node in graph.nodes:
+            if test_node.should_run or test_node.is_shared_root():
+                continue
+            for vm_name in test_node.params.objects("vms"):
+                state = test_node.params.object_params(vm_name).get("set_state", "")
+                if state:
+                    self.states.add(history.state_name(vm_name, state))
+
+    def run(self, test_node):
+        """
+        Simulate a test node and all its state operations.
+
+        :param test_node: test node to simulate
+        :type test_node: :py:class:`cartesian_graph.TestNode`
+        :returns: whether the simulated test node passed
+        :rtype: bool
+        """
+        before, after = [], []
+        for vm_name in test_node.params.objects("vms"):
+            vm_params = test_node.params.object_params(vm_name)
+            get_state = vm_params.get("get_state", "")
+            if get_state not in [""] + state_setup.OFFLINE_ROOTS + state_setup.ONLINE_ROOTS:
+                before.append(("get", history.state_name(vm_name, get_state)))
+            if vm_params.get("unset_state"):
+                before.append(("unset", history.state_name(vm_name, vm_params["unset_state"])))
+            if vm_params.get("set_state"):
+                after.append(("set", history.state_name(vm_name, vm_params["set_state"])))
+
+        shortname = test_node.params["shortname"]
+        node_duration = self.durations.estimate("node", shortname)
+        with self._lock:
+            total = 0.0
+            for kind, name in before + [("node", shortname)] + after:
+                duration = self.durations.estimate(kind, name, self.costs[kind])
+                self.operations.append((kind, name, duration))
+                total += duration
+                logging.info("Dry run: %s %s (%0.2f s)", kind, name, duration)
+                if kind == "get" and name not in self.states:
+                    logging.warning("Dry run: the state %s is missing at the time of %s", name, shortname)
+                    self.missing_states.append(name)
+                elif kind == "unset":
+                    self.states.discard(name)
+                elif kind == "set":
+                    self.states.add(name)
+            self.estimated_time += node_duration if node_duration is not None else total
+        return True
+
+    def report(self):
+        """
+        Get a report of all simulated operations.
+
+        :returns: one line per operation followed by the counts of all operation
+                  kinds and the estimated duration
+        :rtype: str
+        """
+        lines = ["%s %s %0.2f" % operation for operation in self.operations]
+        counts = {}
+        for kind, _, _ in self.operations:
+            counts[kind] = counts.get(kind, 0) + 1
+        lines.append("# %s" % ", ".join("%s %s" % (counts[kind], kind) for kind in sorted(counts)))
+        if self.missing_states:
+            lines.append("# missing states: %s" % " ".join(self.missing_states))
+        lines.append("# estimated duration: %0.2f s" % self.estimated_time)
+        return "\n".join(lines) + "\n"
@@ -14,41 +14,296 @@ INTERFACE
 
 import os
 import re
+import time
 import logging
 import glob
+import json
+import shutil
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 
 from avocado.core import exceptions
 from avocado.utils import process
 from avocado.utils import lv_utils
 
+from . import qcow2
+from . import lvm_shell
+from . import history
+
 
 #: keywords reserved for offline root states
 OFFLINE_ROOTS = ['root', '0root']
 #: keywords reserved for online root states
 ONLINE_ROOTS = ['boot', '0boot']
 
+#: fields of the logical volumes to report for each volume group
+LV_REPORT_FIELDS = ['lv_name', 'lv_path', 'lv_attr', 'origin', 'pool_lv', 'lv_size']
+# reports of logical volumes per volume group valid within a single state
+# operation (until its next mutation) since other processes may modify them
+_lv_reports = {}
+# number of state operations in progress in this process where nested
+# (e.g. root) operations might run within the threads of an outer one
+_operations_in_progress = 0
+_operations_lock = threading.Lock()
 
-def set_root(run_params):
+
+class StateInventory(object):
     """
-    Create a ramdisk, virtual group, thin pool and logical volume
-    for each vm (all offline).
+    In-memory inventory of the available states of all volume groups,
+    images, and state directories, listing each of these at most once.
 
-    :param run_params: configuration parameters
-    :type run_params: {str, str}
-    :raises: :py:class:`exceptions.TestError` if the root state already exists
+    This is meant to answer a large number of state checks (e.g. when
+    scanning a test graph) without a separate state listing for each check.
+    The inventory does not track any states created or removed afterwards.
     """
-    vms = run_params.objects("vms")
-    for vm_name in vms:
-        vm_params = run_params.object_params(vm_name)
 
-        if lv_utils.vg_check(vm_params["vg_name"]):
+    def __init__(self):
+        """Construct an empty state inventory."""
+        self._offline = {}
+        self._online = {}
+        self._ramfile = {}
+        self._file = {}
+
+    def offline_states(self, vg_name):
+        """
+        Get the offline states (logical volumes) of a volume group.
+
+        :param str vg_name: name of the volume group
+        :returns: names of all logical volumes in the volume group
+        :rtype: {str}
+        """
+        if vg_name not in self._offline:
+            self._offline[vg_name] = set(lv_report(vg_name).keys())
+        return self._offline[vg_name]
+
+    def online_states(self, vm_image, qemu_img="/usr/bin/qemu-img"):
+        """
+        Get the online states (internal snapshots) of an image.
+
+        :param str vm_image: path to the qcow2 image
+        :param str qemu_img: qemu-img binary to list the snapshots with
+        :returns: names of all snapshots in the image
+        :rtype: {str}
+        """
+        if vm_image not in self._online:
+            self._online[vm_image] = set(name for name, _ in _list_online_states(vm_image, qemu_img))
+        return self._online[vm_image]
+
+    def ramfile_states(self, state_dir):
+        """
+        Get the ramfile states of a directory.
+
+        :param str state_dir: directory containing the state files
+        :returns: paths of all state files in the directory
+        :rtype: {str}
+        """
+        if state_dir not in self._ramfile:
+            self._ramfile[state_dir] = set(glob.glob(os.path.join(state_dir, "*.state")))
+        return self._ramfile[state_dir]
+
+    def file_states(self, state_dir):
+        """
+        Get the offline states (image copies) of a state directory.
+
+        :param str state_dir: directory containing the image copies
+        :returns: paths of all image copies in the directory
+        :rtype: {str}
+        """
+        if state_dir not in self._file:
+            self._file[state_dir] = set(glob.glob(os.path.join(state_dir, "*")))
+        return self._file[state_dir]
+
+
+def lv_report(vg_name):
+    """
+    Report all logical volumes of a volume group with a single LVM call.
+
+    :param str vg_name: name of the volume group
+    :returns: reported fields of each logical volume in the volume group
+    :rtype: {str, {str, str}}
+
+    The report is reused for all further queries about the volume group
+    within the current state operation until an offline state operation
+    modifies it. Each state operation starts with fresh reports since the
+    volume groups might have been modified by other (test) processes.
+    """
+    report = _lv_reports.get(vg_name)
+    if report is not None:
+        return report
+    cmd = "lvs --reportformat json --units b -o %s %s" % (",".join(LV_REPORT_FIELDS), vg_name)
+    result = process.run(cmd, ignore_status=True)
+    report = collections.OrderedDict()
+    if result.exit_status != 0:
+        logging.debug("No logical volumes could be reported for %s: %s",
+                      vg_name, result.stderr_text.strip())
+    else:
+        for report_part in json.loads(result.stdout_text)["report"]:
+            for volume in report_part.get("lv", []):
+                report[volume["lv_name"]] = volume
+    _lv_reports[vg_name] = report
+    return report
+
+
+def clear_lv_reports(vg_name=None):
+    """
+    Drop the reported logical volumes of a volume group or of all volume groups.
+
+    :param vg_name: name of the volume group or None for all volume groups
+    :type vg_name: str or None
+    """
+    if vg_name is None:
+        _lv_reports.clear()
+    else:
+        _lv_reports.pop(vg_name, None)
+
+
+class StateBackend(object):
+    """
+    Interface for the state operations of a given state type.
+
+    Each backend implements the listing, checking, retrieving, creating,
+    and removing of states while the state policies (modes), state types,
+    and root states are handled by the generic state setup functions.
+    """
+
+    def show_states(self, vm_params):
+        """
+        Return a list of available states of a vm.
+
+        :param vm_params: configuration parameters of the vm
+        :type vm_params: {str, str}
+        :returns: names (or paths) of all available states
+        :rtype: [str]
+        """
+        raise NotImplementedError("Listing states is not supported by %s" % self.__class__.__name__)
+
+    def check_root(self, vm, vm_params, inventory=None):
+        """
+        Check whether the root state (the vm image) exists.
+
+        :param vm: vm object or None if unavailable
+        :param vm_params: configuration parameters of the vm
+        :type vm_params: {str, str}
+        :param inventory: inventory of already listed states or None
+        :type inventory: :py:class:`StateInventory` or None
+        :returns: whether the root state exists
+        :rtype: bool
+        """
+        if vm_params.get("image_format", "qcow2") != "raw":
+            logging.debug("Checking using %s image", vm_params.get("image_format", "qcow2"))
+            return os.path.exists("%s.%s" % (vm_params["image_name"],
+                                             vm_params.get("image_format", "qcow2")))
+        else:
+            logging.debug("Checking using raw image")
+            return os.path.exists(vm_params["image_name"])
+
+    def set_root(self, vm_params):
+        """
+        Create the root state of a vm.
+
+        :param vm_params: configuration parameters of the vm
+        :type vm_params: {str, str}
+        """
+        raise NotImplementedError("Creating root states is not supported by %s" % self.__class__.__name__)
+
+    def unset_root(self, vm_params):
+        """
+        Remove the root state of a vm.
+
+        :param vm_params: configuration parameters of the vm
+        :type vm_params: {str, str}
+        """
+        raise NotImplementedError("Removing root states is not supported by %s" % self.__class__.__name__)
+
+    def check_state(self, vm, vm_params, state, inventory=None):
+        """
+        Check whether a state of a vm exists.
+
+        :param vm: vm object or None if unavailable
+        :param vm_params: configuration parameters of the vm
+        :type vm_params: {str, str}
+        :param str state: name of the state
+        :param inventory: inventory of already listed states or None
+        :type inventory: :py:class:`StateInventory` or None
+        :returns: whether the state exists
+        :rtype: bool
+        """
+        raise NotImplementedError("Checking states is not supported by %s" % self.__class__.__name__)
+
+    def get_state(self, vm, vm_params, state):
+        """
+        Restore a vm to a state.
+
+        :param vm: vm object
+        :param vm_params: configuration parameters of the vm
+        :type vm_params: {str, str}
+        :param str state: name of the state
+        """
+        raise NotImplementedError("Retrieving states is not supported by %s" % self.__class__.__name__)
+
+    def set_state(self, vm, vm_params, state):
+        """
+        Save the current vm state.
+
+        :param vm: vm object
+        :param vm_params: configuration parameters of the vm
+        :type vm_params: {str, str}
+        :param str state: name of the state
+        """
+        raise NotImplementedError("Saving states is not supported by %s" % self.__class__.__name__)
+
+    def unset_state(self, vm, vm_params, state):
+        """
+        Remove a state of a vm.
+
+        :param vm: vm object
+        :param vm_params: configuration parameters of the vm
+        :type vm_params: {str, str}
+        :param str state: name of the state
+        """
+        raise NotImplementedError("Removing states is not supported by %s" % self.__class__.__name__)
+
+
+class LVMBackend(StateBackend):
+    """Offline states as thin snapshots of a logical volume in a ramdisk volume group."""
+
+    def show_states(self, vm_params):
+        """See :py:meth:`StateBackend.show_states`."""
+        states = list(lv_report(vm_params["vg_name"]).keys())
+        logging.info("Detected offline states for %s: %s", vm_params["vms"], ", ".join(states))
+        return states
+
+    def check_root(self, vm, vm_params, inventory=None):
+        """See :py:meth:`StateBackend.check_root`."""
+        condition = super(LVMBackend, self).check_root(vm, vm_params, inventory)
+        if not condition and vm_params.get("vg_name") is not None:
+            if inventory is not None:
+                condition = vm_params["lv_name"] in inventory.offline_states(vm_params["vg_name"])
+            else:
+                condition = _lv_tool(vm_params).lv_check(vm_params["vg_name"],
+                                                         vm_params["lv_name"])
+        return condition
+
+    def set_root(self, vm_params):
+        """
+        Create a ramdisk, virtual group, thin pool and logical volume.
+
+        See :py:meth:`StateBackend.set_root`.
+
+        :raises: :py:class:`exceptions.TestError` if the root state already exists
+        """
+        vm_name = vm_params["vms"]
+        clear_lv_reports(vm_params["vg_name"])
+
+        if _lv_tool(vm_params).vg_check(vm_params["vg_name"]):
             if vm_params.get("force_create", "no") == "yes":
                 logging.info("Removing the previously created %s", vm_name)
                 if vm_params.get("image_raw_device", "yes") == "no":
                     mount_loc = os.path.dirname(vm_params["image_name"])
                     try:
-                        lv_utils.lv_umount(vm_params["vg_name"],
-                                           vm_params["lv_pointer_name"])
+                        _lv_tool(vm_params).lv_umount(vm_params["vg_name"],
+                                                      vm_params["lv_pointer_name"])
                     except lv_utils.LVException:
                         pass
                 logging.debug("Removing previous volume group of %s", vm_name)
@@ -75,36 +330,30 @@ def set_root(run_params):
                            # accepted upstream for backward API compatibility
                            pool_name=vm_params["pool_name"],
                            pool_size=vm_params["pool_size"])
-        lv_utils.lv_take_snapshot(vm_params["vg_name"],
-                                  vm_params["lv_name"],
-                                  vm_params["lv_pointer_name"])
+        _lv_tool(vm_params).lv_take_snapshot(vm_params["vg_name"],
+                                             vm_params["lv_name"],
+                                             vm_params["lv_pointer_name"])
         if vm_params.get("image_raw_device", "yes") == "no":
             mount_loc = os.path.dirname(vm_params["image_name"])
             if not os.path.exists(mount_loc):
                 os.mkdir(mount_loc)
-            lv_utils.lv_mount(vm_params["vg_name"], vm_params["lv_pointer_name"],
-                              mount_loc, create_filesystem="ext4")
+            _lv_tool(vm_params).lv_mount(vm_params["vg_name"], vm_params["lv_pointer_name"],
+                                         mount_loc, create_filesystem="ext4")
 
+    def unset_root(self, vm_params):
+        """
+        Remove the ramdisk, virtual group, thin pool and logical volume.
 
-def unset_root(run_params):
-    """
-    Remove the ramdisk, virtual group, thin pool and logical volume
-    of each vm (all offline).
-
-    :param run_params: configuration parameters
-    :type run_params: {str, str}
-    """
-    vms = run_params.objects("vms")
-    logging.info("Removing vms %s with their images", run_params["vms"])
-    for vm_name in vms:
-        vm_params = run_params.object_params(vm_name)
+        See :py:meth:`StateBackend.unset_root`.
+        """
+        clear_lv_reports(vm_params["vg_name"])
         try:
             if vm_params.get("image_raw_device", "yes") == "no":
                 mount_loc = os.path.dirname(vm_params["image_name"])
-                if lv_utils.vg_check(vm_params["vg_name"]):
+                if _lv_tool(vm_params).vg_check(vm_params["vg_name"]):
                     try:
-                        lv_utils.lv_umount(vm_params["vg_name"],
-                                           vm_params["lv_pointer_name"])
+                        _lv_tool(vm_params).lv_umount(vm_params["vg_name"],
+                                                      vm_params["lv_pointer_name"])
                     except lv_utils.LVException:
                         pass
                 if os.path.exists(mount_loc):
@@ -124,6 +373,347 @@ def unset_root(run_params):
         except exceptions.TestError as ex:
             logging.error(ex)
 
+    def check_state(self, vm, vm_params, state, inventory=None):
+        """See :py:meth:`StateBackend.check_state`."""
+        vm_params["lv_snapshot_name"] = state
+        if inventory is not None:
+            return vm_params["lv_snapshot_name"] in inventory.offline_states(vm_params["vg_name"])
+        return _lv_tool(vm_params).lv_check(vm_params["vg_name"], vm_params["lv_snapshot_name"])
+
+    def get_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.get_state`."""
+        vm_params["lv_snapshot_name"] = state
+        clear_lv_reports(vm_params["vg_name"])
+        if vm_params.get("image_raw_device", "yes") == "no":
+            mount_loc = os.path.dirname(vm_params["image_name"])
+            try:
+                _lv_tool(vm_params).lv_umount(vm_params["vg_name"],
+                                              vm_params["lv_pointer_name"])
+            except lv_utils.LVException:
+                pass
+        try:
+            _lv_tool(vm_params).lv_remove(vm_params["vg_name"], vm_params["lv_pointer_name"])
+            _lv_tool(vm_params).lv_take_snapshot(vm_params["vg_name"],
+                                                 vm_params["lv_snapshot_name"],
+                                                 vm_params["lv_pointer_name"])
+        finally:
+            if vm_params.get("image_raw_device", "yes") == "no":
+                mount_loc = os.path.dirname(vm_params["image_name"])
+                _lv_tool(vm_params).lv_mount(vm_params["vg_name"],
+                                             vm_params["lv_pointer_name"],
+                                             mount_loc)
+
+    def set_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.set_state`."""
+        vm_params["lv_snapshot_name"] = state
+        clear_lv_reports(vm_params["vg_name"])
+        _lv_tool(vm_params).lv_take_snapshot(vm_params["vg_name"],
+                                             vm_params["lv_pointer_name"],
+                                             vm_params["lv_snapshot_name"])
+
+    def unset_state(self, vm, vm_params, state):
+        """
+        See :py:meth:`StateBackend.unset_state`.
+
+        :raises: :py:class:`ValueError` if the state is the built-in pointer volume
+        """
+        lv_pointer = vm_params["lv_pointer_name"]
+        if state == lv_pointer:
+            raise ValueError("Cannot unset built-in offline state '%s'" % lv_pointer)
+        vm_params["lv_snapshot_name"] = state
+        clear_lv_reports(vm_params["vg_name"])
+        _lv_tool(vm_params).lv_remove(vm_params["vg_name"], vm_params["lv_snapshot_name"])
+
+
+class FileBackend(StateBackend):
+    """
+    Offline states as copies of the vm image in a state directory.
+
+    The copies are reflinked on filesystems supporting this (e.g. btrfs
+    or xfs) and sparse otherwise, requiring neither root nor LVM.
+    """
+
+    @staticmethod
+    def _image_path(vm_params):
+        return "%s.%s" % (vm_params["image_name"], vm_params.get("image_format", "qcow2"))
+
+    @staticmethod
+    def _state_dir(vm_params):
+        return vm_params.get("states_dir", "%s.states" % FileBackend._image_path(vm_params))
+
+    @staticmethod
+    def _state_path(vm_params, state):
+        return os.path.join(FileBackend._state_dir(vm_params),
+                            "%s.%s" % (state, vm_params.get("image_format", "qcow2")))
+
+    @staticmethod
+    def _copy(source, destination):
+        """Copy an image as a reflink or sparse file replacing the destination at once."""
+        partial = "%s.part" % destination
+        process.run("cp --reflink=auto --sparse=always %s %s" % (source, partial))
+        os.rename(partial, destination)
+
+    def show_states(self, vm_params):
+        """See :py:meth:`StateBackend.show_states`."""
+        state_dir = self._state_dir(vm_params)
+        extension = ".%s" % vm_params.get("image_format", "qcow2")
+        states = []
+        if os.path.isdir(state_dir):
+            states = sorted(f[:-len(extension)] for f in os.listdir(state_dir) if f.endswith(extension))
+        logging.info("Detected offline states for %s: %s", vm_params["vms"], ", ".join(states))
+        return states
+
+    def set_root(self, vm_params):
+        """
+        Create the state directory while the image is created by the vm setup.
+
+        See :py:meth:`StateBackend.set_root`.
+        """
+        state_dir = self._state_dir(vm_params)
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+
+    def unset_root(self, vm_params):
+        """
+        Remove the image and all its states.
+
+        See :py:meth:`StateBackend.unset_root`.
+        """
+        image_path = self._image_path(vm_params)
+        if os.path.exists(image_path):
+            os.unlink(image_path)
+        shutil.rmtree(self._state_dir(vm_params), ignore_errors=True)
+
+    def check_state(self, vm, vm_params, state, inventory=None):
+        """See :py:meth:`StateBackend.check_state`."""
+        state_path = self._state_path(vm_params, state)
+        if inventory is not None:
+            return state_path in inventory.file_states(self._state_dir(vm_params))
+        return os.path.exists(state_path)
+
+    def get_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.get_state`."""
+        self._copy(self._state_path(vm_params, state), self._image_path(vm_params))
+
+    def set_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.set_state`."""
+        self.set_root(vm_params)
+        self._copy(self._image_path(vm_params), self._state_path(vm_params, state))
+
+    def unset_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.unset_state`."""
+        os.unlink(self._state_path(vm_params, state))
+
+
+class OverlayBackend(FileBackend):
+    """
+    Offline states as image copies like the file backend with the vm image
+    being a disposable qcow2 overlay on top of the retrieved state.
+
+    Retrieving a state only creates a new (empty) overlay discarding any
+    previous one so that tests that start from the same state do not pay
+    for any copying. Saving a state flattens the overlay into a standalone
+    image which keeps saved states independent of each other.
+    """
+
+    @staticmethod
+    def _qemu_img(vm_params):
+        return vm_params.get("qemu_img_binary", "/usr/bin/qemu-img")
+
+    def get_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.get_state`."""
+        if vm_params.get("image_format", "qcow2") != "qcow2":
+            logging.debug("Overlays require qcow2 images, copying the state instead")
+            return super(OverlayBackend, self).get_state(vm, vm_params, state)
+        image_path = self._image_path(vm_params)
+        partial = "%s.part" % image_path
+        process.run("%s create -f qcow2 -F qcow2 -b %s %s" % (self._qemu_img(vm_params),
+                                                             self._state_path(vm_params, state),
+                                                             partial))
+        os.rename(partial, image_path)
+
+    def set_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.set_state`."""
+        if vm_params.get("image_format", "qcow2") != "qcow2":
+            return super(OverlayBackend, self).set_state(vm, vm_params, state)
+        self.set_root(vm_params)
+        state_path = self._state_path(vm_params, state)
+        partial = "%s.part" % state_path
+        process.run("%s convert -O qcow2 %s %s" % (self._qemu_img(vm_params),
+                                                   self._image_path(vm_params),
+                                                   partial))
+        os.rename(partial, state_path)
+
+    def unset_state(self, vm, vm_params, state):
+        """
+        See :py:meth:`StateBackend.unset_state`.
+
+        The current overlay is made standalone first if it is based on the
+        removed state.
+        """
+        image_path = self._image_path(vm_params)
+        state_path = self._state_path(vm_params, state)
+        try:
+            backing_file = qcow2.read_backing_file(image_path)
+        except (OSError, qcow2.Qcow2Error):
+            backing_file = None
+        if backing_file is not None and os.path.abspath(backing_file) == os.path.abspath(state_path):
+            logging.debug("Detaching the image of %s from the removed state %s", vm_params["vms"], state)
+            process.run("%s rebase -b '' %s" % (self._qemu_img(vm_params), image_path))
+        super(OverlayBackend, self).unset_state(vm, vm_params, state)
+
+
+class QCOW2Backend(StateBackend):
+    """Online states as internal snapshots of the qcow2 image of a running vm."""
+
+    def show_states(self, vm_params):
+        """See :py:meth:`StateBackend.show_states`."""
+        vm_image = "%s.%s" % (vm_params["image_name"],
+                              vm_params.get("image_format", "qcow2"))
+        qemu_img = vm_params.get("qemu_img_binary", "/usr/bin/qemu-img")
+        states = []
+        for state_name, state_size in _list_online_states(vm_image, qemu_img):
+            logging.info("Detected online state '%s' of size %s", state_name, state_size)
+            states.append(state_name)
+        return states
+
+    def check_state(self, vm, vm_params, state, inventory=None):
+        """See :py:meth:`StateBackend.check_state`."""
+        vm_image = "%s.%s" % (vm_params["image_name"],
+                              vm_params.get("image_format", "qcow2"))
+        if not os.path.exists(vm_image):
+            return False
+        qemu_img = vm_params.get("qemu_img_binary", "/usr/bin/qemu-img")
+        if inventory is not None:
+            state_names = inventory.online_states(vm_image, qemu_img)
+        else:
+            state_names = [name for name, _ in _list_online_states(vm_image, qemu_img)]
+        return state in state_names
+
+    def get_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.get_state`."""
+        vm.loadvm(state)
+
+    def set_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.set_state`."""
+        vm.savevm(state)
+
+    def unset_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.unset_state`."""
+        # NOTE: this was supposed to be implemented in the Qemu VM object but
+        # it is not unlike savevm and loadvm, perhaps due to command availability
+        vm.verify_status('paused')
+        logging.debug("Deleting VM %s from %s", vm_params["vms"], state)
+        vm.monitor.send_args_cmd("delvm id=%s" % state)
+        vm.verify_status('paused')
+
+
+class RamfileBackend(StateBackend):
+    """Online states as memory dumps of a running vm next to its image."""
+
+    @staticmethod
+    def _state_dir(vm_params):
+        return os.path.dirname(vm_params.get("image_name", ""))
+
+    @staticmethod
+    def _state_path(vm_params, state):
+        return "%s.state" % os.path.join(RamfileBackend._state_dir(vm_params), state)
+
+    def show_states(self, vm_params):
+        """See :py:meth:`StateBackend.show_states`."""
+        states = glob.glob(os.path.join(self._state_dir(vm_params), "*.state"))
+        logging.info("Detected ramfile snapshots for %s: %s", vm_params["vms"], ", ".join(states))
+        return states
+
+    def check_state(self, vm, vm_params, state, inventory=None):
+        """See :py:meth:`StateBackend.check_state`."""
+        state_file = self._state_path(vm_params, state)
+        if inventory is not None:
+            return state_file in inventory.ramfile_states(self._state_dir(vm_params))
+        return os.path.exists(state_file)
+
+    def get_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.get_state`."""
+        vm.restore_from_file(self._state_path(vm_params, state))
+
+    def set_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.set_state`."""
+        state_file = self._state_path(vm_params, state)
+        vm.save_to_file(state_file)
+        # BUG: because the built-in functionality uses system_reset
+        # which leads to unclean file systems in some cases it is
+        # better to restore from the saved state
+        vm.restore_from_file(state_file)
+
+    def unset_state(self, vm, vm_params, state):
+        """See :py:meth:`StateBackend.unset_state`."""
+        os.unlink(self._state_path(vm_params, state))
+
+
+#: available state backends by name
+BACKENDS = {"lvm": LVMBackend(), "file": FileBackend(), "overlay": OverlayBackend(),
+            "qcow2": QCOW2Backend(), "ramfile": RamfileBackend()}
+
+
+def state_backend(state_type, vm_params):
+    """
+    Get the backend to perform state operations of a given type with.
+
+    :param str state_type: "offline", "online", or "ramfile"
+    :param vm_params: configuration parameters of the vm
+    :type vm_params: {str, str}
+    :returns: backend selected with the `offline_backend` or `online_backend`
+              parameter for the respective state type
+    :rtype: :py:class:`StateBackend`
+    :raises: :py:class:`ValueError` if the state type or backend is unknown
+    """
+    if state_type == "offline":
+        backend = vm_params.get("offline_backend", "lvm")
+    elif state_type == "online":
+        backend = vm_params.get("online_backend", "qcow2")
+    elif state_type == "ramfile":
+        backend = "ramfile"
+    else:
+        raise ValueError("Unknown state type %s" % state_type)
+    if backend not in BACKENDS:
+        raise ValueError("Unknown %s state backend %s" % (state_type, backend))
+    return BACKENDS[backend]
+
+
+def set_root(run_params):
+    """
+    Create the root state of each vm (all offline), e.g. a ramdisk,
+    virtual group, thin pool and logical volume for LVM states.
+
+    :param run_params: configuration parameters
+    :type run_params: {str, str}
+    :raises: :py:class:`exceptions.TestError` if the root state already exists
+    """
+    def set_vm_root(vm_name):
+        vm_params = run_params.object_params(vm_name)
+        vm_params["vms"] = vm_name
+        state_backend("offline", vm_params).set_root(vm_params)
+
+    _for_each_vm(run_params, set_vm_root)
+
+
+def unset_root(run_params):
+    """
+    Remove the root state of each vm (all offline), e.g. the ramdisk,
+    virtual group, thin pool and logical volume for LVM states.
+
+    :param run_params: configuration parameters
+    :type run_params: {str, str}
+    """
+    logging.info("Removing vms %s with their images", run_params["vms"])
+
+    def unset_vm_root(vm_name):
+        vm_params = run_params.object_params(vm_name)
+        vm_params["vms"] = vm_name
+        state_backend("offline", vm_params).unset_root(vm_params)
+
+    _for_each_vm(run_params, unset_vm_root)
+
 
 def show_states(run_params, env):
     """
@@ -134,38 +724,20 @@ def show_states(run_params, env):
     :param env: test environment
     :type env: Env object
     """
+    clear_lv_reports()
     states = []
     for vm_name in run_params.objects("vms"):
         vm_params = run_params.object_params(vm_name)
-        vm = env.get_vm(vm_name)
+        vm_params["vms"] = vm_name
 
-        if vm_params.get("check_type", "offline") == "offline":
-            logging.debug("Checking %s for available offline states", vm_name)
-            states = lv_utils.lv_list(vm_params["vg_name"])
-            logging.info("Detected offline states for %s: %s", vm_name, ", ".join(states))
-        else:
-            if vm_params["check_type"] == "ramfile":
-                state_dir = vm_params.get("image_name", "")
-                state_dir = os.path.dirname(state_dir)
-                state_path = os.path.join(state_dir, "*.state")
-                states = glob.glob(state_path)
-                logging.info("Detected ramfile snapshots for %s: %s", vm_name, ", ".join(states))
-            else:
-                vm_image = "%s.%s" % (vm_params["image_name"],
-                                      vm_params.get("image_format", "qcow2"))
-                qemu_img = vm_params.get("qemu_img_binary", "/usr/bin/qemu-img")
-                online_snapshots_dump = process.system_output("%s snapshot -l %s -U" % (qemu_img, vm_image)).decode()
-                state_tuples = re.findall("\d+\s+([\w\.]+)\s+([\w\.]+)\s+\d{4}-\d\d-\d\d",
-                                          online_snapshots_dump)
-                for state_tuple in state_tuples:
-                    logging.info("Detected online state '%s' of size %s",
-                                 state_tuple[0], state_tuple[1])
-                    states.append(state_tuple[0])
+        state_type = vm_params.get("check_type", "offline")
+        logging.debug("Checking %s for available %s states", vm_name, state_type)
+        states += state_backend(state_type, vm_params).show_states(vm_params)
     return states
 
 
 def check_state(run_params, env,
-                print_pos=False, print_neg=False):
+                print_pos=False, print_neg=False, inventory=None):
     """
     Check whether a given state/snapshot exits and return True if it does,
     False otherwise.
@@ -176,6 +748,9 @@ def check_state(run_params, env,
     :type env: Env object
     :param bool print_pos: whether to print that the state was found
     :param bool print_neg: whether to print that the state wasn't found
+    :param inventory: inventory of already listed states to check in or
+                      None to list the states separately for this check
+    :type inventory: :py:class:`StateInventory` or None
 
     If not state type is specified explicitly, we will search for all types
     in order of performance (online->offline).
@@ -184,6 +759,10 @@ def check_state(run_params, env,
         more than one are present, the setup for all will be evaluated through
         bitwise AND, i.e. it will determine the existence of a given state configuration.
     """
+    with _operations_lock:
+        # reports of an operation in progress are shared with its other vms
+        if inventory is None and _operations_in_progress == 0:
+            clear_lv_reports()
     exists = True
     for vm_name in run_params.objects("vms"):
         vm_params = run_params.object_params(vm_name)
@@ -199,19 +778,23 @@ def check_state(run_params, env,
         if vm_params["check_type"] == "any":
             vm_params["check_type"] = "online"
             run_params["found_type_%s" % vm_name] = "online"
-            if not _check_state(vm, vm_params, print_pos=print_pos, print_neg=print_neg):
+            if not _check_state(vm, vm_params, print_pos=print_pos, print_neg=print_neg,
+                                inventory=inventory):
                 vm_params["check_type"] = "ramfile"
                 run_params["found_type_%s" % vm_name] = "ramfile"
                 # BUG: currently "ramfile" is very error-prone so let's not mention it
-                if not _check_state(vm, vm_params, print_pos=True, print_neg=False):
+                if not _check_state(vm, vm_params, print_pos=True, print_neg=False,
+                                    inventory=inventory):
                     vm_params["check_type"] = "offline"
                     run_params["found_type_%s" % vm_name] = "offline"
-                    if not _check_state(vm, vm_params, print_pos=print_pos, print_neg=print_neg):
+                    if not _check_state(vm, vm_params, print_pos=print_pos, print_neg=print_neg,
+                                        inventory=inventory):
                         # default type to treat in case of no result
                         run_params["found_type_%s" % vm_name] = "online"
                         exists = False
                         break
-        elif not _check_state(vm, vm_params, print_pos=print_pos, print_neg=print_neg):
+        elif not _check_state(vm, vm_params, print_pos=print_pos, print_neg=print_neg,
+                              inventory=inventory):
             exists = False
             break
 
@@ -230,12 +813,12 @@ def get_state(run_params, env):
         the vm is unavailable from the env, or snapshot exists in passive mode (abort)
     :raises: :py:class:`exceptions.TestError` if invalid policy was used
     """
-    for vm_name in run_params.objects("vms"):
+    def get_vm_state(vm_name):
         vm = env.get_vm(vm_name)
         vm_params = run_params.object_params(vm_name)
         # if the snapshot is not defined skip (leaf tests that are no setup)
         if not vm_params.get("get_state"):
-            continue
+            return
         vm_params["get_type"] = vm_params.get("get_type", "any")
         vm_params["get_mode"] = vm_params.get("get_mode", "ar")
 
@@ -283,6 +866,8 @@ def get_state(run_params, env):
             raise exceptions.TestError("Invalid policy %s: The start action on present state can be "
                                        "either of 'abort', 'reuse', 'ignore'." % vm_params["get_mode"])
 
+    _for_each_vm(run_params, get_vm_state)
+
 
 def set_state(run_params, env):
     """
@@ -295,12 +880,12 @@ def set_state(run_params, env):
     :raises: :py:class:`exceptions.TestAbortError` if unexpected/missing snapshot in passive mode (abort)
     :raises: :py:class:`exceptions.TestError` if invalid policy was used
     """
-    for vm_name in run_params.objects("vms"):
+    def set_vm_state(vm_name):
         vm = env.get_vm(vm_name)
         vm_params = run_params.object_params(vm_name)
         # if the snapshot is not defined skip (leaf tests that are no setup)
         if not vm_params.get("set_state"):
-            continue
+            return
         vm_params["set_type"] = vm_params.get("set_type", "any")
         vm_params["set_mode"] = vm_params.get("set_mode", "ff")
 
@@ -313,7 +898,7 @@ def set_state(run_params, env):
         # online/offline filter
         if vm_params["set_type"] in run_params.get("skip_types", []):
             logging.debug("Skip setting states of types %s" % ", ".join(run_params.objects("skip_types")))
-            continue
+            return
         if vm_params["set_type"] == "offline":
             vm.destroy(gracefully=True)
         # NOTE: setting an online state assumes that the vm is online just like
@@ -332,8 +917,7 @@ def set_state(run_params, env):
             if vm_params["set_state"] in OFFLINE_ROOTS and vm_params["set_type"] == "offline":
                 unset_root(vm_params)
             elif vm_params["set_type"] == "offline":
-                vm_params["lv_snapshot_name"] = vm_params["set_state"]
-                lv_utils.lv_remove(vm_params["vg_name"], vm_params["lv_snapshot_name"])
+                state_backend("offline", vm_params).unset_state(vm, vm_params, vm_params["set_state"])
             else:
                 logging.debug("Overwriting online snapshot simply by writing it again")
             _set_state(vm, vm_params)
@@ -350,6 +934,8 @@ def set_state(run_params, env):
             raise exceptions.TestError("Invalid policy %s: The end action on missing state can be "
                                        "either of 'abort', 'force'." % vm_params["set_mode"])
 
+    _for_each_vm(run_params, set_vm_state)
+
 
 def unset_state(run_params, env):
     """
@@ -362,12 +948,12 @@ def unset_state(run_params, env):
     :raises: :py:class:`exceptions.TestAbortError` if missing snapshot in passive mode (abort)
     :raises: :py:class:`exceptions.TestError` if invalid policy was used
     """
-    for vm_name in run_params.objects("vms"):
+    def unset_vm_state(vm_name):
         vm = env.get_vm(vm_name)
         vm_params = run_params.object_params(vm_name)
         if not vm_params.get("unset_state"):
             # if the snapshot is not defined skip (leaf tests that are no setup)
-            continue
+            return
         vm_params["unset_type"] = vm_params.get("unset_type", "any")
         vm_params["unset_mode"] = vm_params.get("unset_mode", "fi")
 
@@ -398,6 +984,8 @@ def unset_state(run_params, env):
             raise exceptions.TestError("Invalid policy %s: The unset action on present state can be "
                                        "either of 'reuse', 'force'." % vm_params["unset_mode"])
 
+    _for_each_vm(run_params, unset_vm_state)
+
 
 def push_state(run_params, env):
     """
@@ -450,26 +1038,126 @@ def pop_state(run_params, env):
         unset_state(vm_params, env)
 
 
-def _check_state(vm, vm_params, print_pos=False, print_neg=False):
+def _for_each_vm(run_params, vm_operation):
+    """
+    Perform a state operation for each vm serially or concurrently.
+
+    :param run_params: configuration parameters
+    :type run_params: {str, str}
+    :param vm_operation: state operation taking the name of a vm
+    :type vm_operation: function
+    :raises: the error of the first vm (in the order of the vms) whose operation failed
+
+    The operations are performed concurrently in a pool of threads (one per
+    vm) if the `parallel_states` parameter is set to "yes". Just like for
+    serial operations, no operation of a vm following a failed vm is started
+    (any such operation is cancelled) and the error of the first failed vm
+    is raised. Operations already running cannot be interrupted and are
+    completed with the errors of any other failed vms only logged.
+
+    Any logical volumes reported before the operation are reported anew and
+    the LVM shell used by the operation (if any) is released at its end but
+    kept running for the remaining operations of the job. Operations nested
+    within another operation (e.g. of root states) share both with it.
+    """
+    global _operations_in_progress
+    with _operations_lock:
+        if _operations_in_progress == 0:
+            clear_lv_reports()
+        _operations_in_progress += 1
+    try:
+        vms = run_params.objects("vms")
+        if run_params.get("parallel_states", "no") != "yes" or len(vms) < 2:
+            for vm_name in vms:
+                vm_operation(vm_name)
+            return
+
+        # index of the first vm (in the order of the vms) whose operation failed
+        failed = [len(vms)]
+        failed_lock = threading.Lock()
+
+        def guarded_operation(index):
+            with failed_lock:
+                if failed[0] < index:
+                    logging.debug("Cancelling the state operation of %s after a failed vm", vms[index])
+                    return False
+            try:
+                vm_operation(vms[index])
+            except Exception:
+                with failed_lock:
+                    failed[0] = min(failed[0], index)
+                raise
+            return True
+
+        with ThreadPoolExecutor(max_workers=len(vms)) as executor:
+            futures = [executor.submit(guarded_operation, i) for i in range(len(vms))]
+            _, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            with failed_lock:
+                for future in pending:
+                    if futures.index(future) > failed[0]:
+                        future.cancel()
+        failures = [(vm_name, future.exception()) for vm_name, future in zip(vms, futures)
+                    if not future.cancelled() and future.exception() is not None]
+        for vm_name, error in failures[1:]:
+            logging.error("State operation of %s failed as well: %s", vm_name, error)
+        if len(failures) > 0:
+            raise failures[0][1]
+    finally:
+        with _operations_lock:
+            _operations_in_progress -= 1
+            if _operations_in_progress == 0:
+                # the shell is closed at the end of the job (and not of the test process)
+                lvm_shell.release_shell()
+
+
+def _list_online_states(vm_image, qemu_img="/usr/bin/qemu-img"):
+    """
+    List the online states (internal snapshots) of an image.
+
+    :param str vm_image: path to the qcow2 image
+    :param str qemu_img: qemu-img binary to list the snapshots with
+    :returns: names and VM state sizes of all snapshots
+    :rtype: [(str, str)]
+
+    The snapshot table of the image is read directly and qemu-img is
+    only used as a fallback for images that cannot be parsed natively.
+    """
+    try:
+        snapshots = qcow2.read_snapshots(vm_image)
+        logging.debug("Read online states: %s", ", ".join(s.name for s in snapshots))
+        return [(s.name, str(s.vm_state_size)) for s in snapshots]
+    except (OSError, qcow2.Qcow2Error) as error:
+        logging.debug("Falling back to qemu-img for the online states: %s", error)
+    online_snapshots_dump = process.system_output("%s snapshot -l %s -U" % (qemu_img, vm_image)).decode()
+    logging.debug("Listed online states:\n%s", online_snapshots_dump)
+    return re.findall("\d+\s+([\w\.]+)\s+([\w\.]+)\s+\d{4}-\d\d-\d\d", online_snapshots_dump)
+
+
+def _lv_tool(vm_params):
+    """
+    Get the tool to perform logical volume operations with.
+
+    :param vm_params: configuration parameters of the vm
+    :type vm_params: {str, str}
+    :returns: the shared LVM shell if enabled or the LVM utilities otherwise
+    :rtype: :py:class:`lvm_shell.LVMShell` or module
+    """
+    if vm_params.get("lvm_shell", "no") == "yes":
+        return lvm_shell.get_shell()
+    return lv_utils
+
+
+def _check_state(vm, vm_params, print_pos=False, print_neg=False, inventory=None):
     """
     Check for an online/offline state of a vm object.
 
-    We use LVM for offline snapshots and QCOW2 for online snapshots.
+    The state is checked by the backend of its state type.
     """
     vm_name = vm_params["vms"]
     if vm_params["check_type"] == "offline":
-        vm_params["lv_snapshot_name"] = vm_params["check_state"]
         if vm_params.get("check_state", "root") in OFFLINE_ROOTS:
             logging.debug("Checking whether %s exists (root offline state requested)", vm_name)
-            if vm_params.get("image_format", "qcow2") != "raw":
-                logging.debug("Checking using %s image", vm_params.get("image_format", "qcow2"))
-                condition = os.path.exists("%s.%s" % (vm_params["image_name"],
-                                                      vm_params.get("image_format", "qcow2")))
-            else:
-                logging.debug("Checking using raw image")
-                condition = os.path.exists(vm_params["image_name"])
-            if not condition and vm_params.get("vg_name") is not None:
-                condition = lv_utils.lv_check(vm_params["vg_name"], vm_params["lv_name"])
+            condition = state_backend("offline", vm_params).check_root(vm, vm_params, inventory)
             if not condition:
                 if print_neg:
                     logging.info("The required virtual machine %s doesn't exist", vm_name)
@@ -478,138 +1166,73 @@ def _check_state(vm, vm_params, print_pos=False, print_neg=False):
                 if print_pos:
                     logging.info("The required virtual machine %s exists", vm_name)
                 return True
-        else:
-            logging.debug("Checking %s for offline state '%s'", vm_name, vm_params["check_state"])
-            if not lv_utils.lv_check(vm_params["vg_name"], vm_params["lv_snapshot_name"]):
-                if print_neg:
-                    logging.info("Offline snapshot '%s' of %s doesn't exist",
-                                 vm_params["check_state"], vm_name)
-                return False
-            else:
-                if print_pos:
-                    logging.info("Offline snapshot '%s' of %s exists",
-                                 vm_params["check_state"], vm_name)
-                return True
+    elif vm_params.get("check_state", "boot") in ONLINE_ROOTS:
+        logging.debug("Checking whether %s is online (root online state requested)", vm_name)
+        try:
+            state_exists = vm.is_alive()
+        except ValueError:
+            state_exists = False
+        if state_exists and print_pos:
+            logging.info("The required virtual machine %s is online", vm_name)
+        elif not state_exists and print_neg:
+            logging.info("The required virtual machine %s is offline", vm_name)
+        return state_exists
+
+    logging.debug("Checking %s for %s state '%s'", vm_name,
+                  vm_params["check_type"], vm_params["check_state"])
+    backend = state_backend(vm_params["check_type"], vm_params)
+    if not backend.check_state(vm, vm_params, vm_params["check_state"], inventory=inventory):
+        if print_neg:
+            logging.info("%s snapshot '%s' of %s doesn't exist", vm_params["check_type"].capitalize(),
+                         vm_params["check_state"], vm_name)
+        return False
     else:
-        if vm_params.get("check_state", "boot") in ONLINE_ROOTS:
-            logging.debug("Checking whether %s is online (root online state requested)", vm_name)
-            try:
-                state_exists = vm.is_alive()
-            except ValueError:
-                state_exists = False
-            if state_exists and print_pos:
-                logging.info("The required virtual machine %s is online", vm_name)
-            elif not state_exists and print_neg:
-                logging.info("The required virtual machine %s is offline", vm_name)
-            return state_exists
-        else:
-            if vm_params["check_type"] == "ramfile":
-                state_dir = vm_params.get("image_name", "")
-                state_dir = os.path.dirname(state_dir)
-                state_file = os.path.join(state_dir, vm_params["check_state"])
-                state_file = "%s.state" % state_file
-                if not os.path.exists(state_file):
-                    if print_neg:
-                        logging.info("Ramfile snapshot '%s' of %s doesn't exist",
-                                     vm_params["check_state"], vm_name)
-                    return False
-                else:
-                    if print_pos:
-                        logging.info("Ramfile snapshot '%s' of %s exists",
-                                     vm_params["check_state"], vm_name)
-                    return True
-            else:
-                logging.debug("Checking %s for online state '%s'",
-                              vm_name, vm_params["check_state"])
-
-                vm_image = "%s.%s" % (vm_params["image_name"],
-                                      vm_params.get("image_format", "qcow2"))
-                if not os.path.exists(vm_image):
-                    return False
-                qemu_img = vm_params.get("qemu_img_binary", "/usr/bin/qemu-img")
-                online_snapshots_dump = process.system_output("%s snapshot -l %s -U" % (qemu_img, vm_image)).decode()
-                logging.debug("Listed online states:\n%s", online_snapshots_dump)
-                state_tuples = re.findall("\d+\s+([\w\.]+)\s+([\w\.]+)\s+\d{4}-\d\d-\d\d",
-                                          online_snapshots_dump)
-                for state_tuple in state_tuples:
-                    logging.debug("Detected online state '%s' of size %s",
-                                  state_tuple[0], state_tuple[1])
-                    if state_tuple[0] == vm_params["check_state"]:
-                        if print_pos:
-                            logging.info("Online snapshot '%s' of %s exists",
-                                         vm_params["check_state"], vm_name)
-                        return True
-                # at this point we didn't find the online state in the listed ones
-                if print_neg:
-                    logging.info("Online snapshot '%s' of %s doesn't exist",
-                                 vm_params["check_state"], vm_name)
-                return False
+        if print_pos:
+            logging.info("%s snapshot '%s' of %s exists", vm_params["check_type"].capitalize(),
+                         vm_params["check_state"], vm_name)
+        return True
 
 
 def _get_state(vm, vm_params):
     """
     Get to an online/offline state of a vm object.
 
-    We use LVM for offline snapshots and QCOW2 for online snapshots.
+    The state is retrieved by the backend of its state type.
     """
     vm_name = vm_params["vms"]
     if vm_params["get_state"] in OFFLINE_ROOTS + ONLINE_ROOTS:
         # reusing root states (offline root and online boot) is analogical to not doing anything
         return
 
+    start_time = time.time()
+    backend = state_backend(vm_params["get_type"], vm_params)
     if vm_params["get_type"] == "offline":
-        vm_params["lv_snapshot_name"] = vm_params["get_state"]
-        if vm_params.get("image_raw_device", "yes") == "no":
-            mount_loc = os.path.dirname(vm_params["image_name"])
-            try:
-                lv_utils.lv_umount(vm_params["vg_name"],
-                                   vm_params["lv_pointer_name"])
-            except lv_utils.LVException:
-                pass
-        try:
-            logging.info("Restoring %s to state %s", vm_name, vm_params["get_state"])
-            lv_utils.lv_remove(vm_params["vg_name"], vm_params["lv_pointer_name"])
-            lv_utils.lv_take_snapshot(vm_params["vg_name"],
-                                      vm_params["lv_snapshot_name"],
-                                      vm_params["lv_pointer_name"])
-        finally:
-            if vm_params.get("image_raw_device", "yes") == "no":
-                mount_loc = os.path.dirname(vm_params["image_name"])
-                lv_utils.lv_mount(vm_params["vg_name"],
-                                  vm_params["lv_pointer_name"],
-                                  mount_loc)
+        logging.info("Restoring %s to state %s", vm_name, vm_params["get_state"])
+        backend.get_state(vm, vm_params, vm_params["get_state"])
     else:
         logging.info("Reusing online state '%s' of %s", vm_params["get_state"], vm_name)
         vm.pause()
-        # NOTE: second online type is available and still supported but not recommended
-        if vm_params["get_type"] != "ramfile":
-            vm.loadvm(vm_params["get_state"])
-        else:
-            state_dir = vm_params.get("image_name", "")
-            state_dir = os.path.dirname(state_dir)
-            state_file = os.path.join(state_dir, vm_params["get_state"])
-            state_file = "%s.state" % state_file
-            vm.restore_from_file(state_file)
+        backend.get_state(vm, vm_params, vm_params["get_state"])
         vm.resume()
+    history.duration_history.record("get", history.state_name(vm_name, vm_params["get_state"]),
+                                    time.time() - start_time)
 
 
 def _set_state(vm, vm_params):
     """
     Set an online/offline state of a vm object.
 
-    We use LVM for offline snapshots and QCOW2 for online snapshots.
+    The state is saved by the backend of its state type.
     """
     vm_name = vm_params["vms"]
+    start_time = time.time()
     if vm_params["set_state"] in OFFLINE_ROOTS:
         # vm_params["vms"] = vm_name
         vm_params["main_vm"] = vm_name
         set_root(vm_params)
     elif vm_params["set_type"] == "offline":
-        vm_params["lv_snapshot_name"] = vm_params["set_state"]
         logging.info("Taking a snapshot '%s' of %s", vm_params["set_state"], vm_name)
-        lv_utils.lv_take_snapshot(vm_params["vg_name"],
-                                  vm_params["lv_pointer_name"],
-                                  vm_params["lv_snapshot_name"])
+        state_backend("offline", vm_params).set_state(vm, vm_params, vm_params["set_state"])
     elif vm_params["set_state"] in ONLINE_ROOTS:
         # set boot state
         if vm is None or not vm.is_alive():
@@ -617,29 +1240,20 @@ def _set_state(vm, vm_params):
     else:
         logging.info("Setting online state '%s' of %s", vm_params["set_state"], vm_name)
         vm.pause()
-        # NOTE: second online type is available and still supported but not recommended
-        if vm_params["set_type"] != "ramfile":
-            vm.savevm(vm_params["set_state"])
-        else:
-            state_dir = vm_params.get("image_name", "")
-            state_dir = os.path.dirname(state_dir)
-            state_file = os.path.join(state_dir, vm_params["set_state"])
-            state_file = "%s.state" % state_file
-            vm.save_to_file(state_file)
-            # BUG: because the built-in functionality uses system_reset
-            # which leads to unclean file systems in some cases it is
-            # better to restore from the saved state
-            vm.restore_from_file(state_file)
+        state_backend(vm_params["set_type"], vm_params).set_state(vm, vm_params, vm_params["set_state"])
         vm.resume()
+    history.duration_history.record("set", history.state_name(vm_name, vm_params["set_state"]),
+                                    time.time() - start_time)
 
 
 def _unset_state(vm, vm_params):
     """
     Unset an online/offline state of a vm object.
 
-    We use LVM for offline snapshots and QCOW2 for online snapshots.
+    The state is removed by the backend of its state type.
     """
     vm_name = vm_params["vms"]
+    start_time = time.time()
     if vm_params["unset_state"] in OFFLINE_ROOTS:
         # offline switch to protect from online leftover state
         if vm is not None and vm.is_alive():
@@ -648,30 +1262,15 @@ def _unset_state(vm, vm_params):
         vm_params["main_vm"] = vm_name
         unset_root(vm_params)
     elif vm_params["unset_type"] == "offline":
-        lv_pointer = vm_params["lv_pointer_name"]
-        if vm_params["unset_state"] == lv_pointer:
-            raise ValueError("Cannot unset built-in offline state '%s'" % lv_pointer)
-        vm_params["lv_snapshot_name"] = vm_params["unset_state"]
-        logging.info("Removing snapshot %s of %s", vm_params["lv_snapshot_name"], vm_name)
-        lv_utils.lv_remove(vm_params["vg_name"], vm_params["lv_snapshot_name"])
+        logging.info("Removing snapshot %s of %s", vm_params["unset_state"], vm_name)
+        state_backend("offline", vm_params).unset_state(vm, vm_params, vm_params["unset_state"])
     elif vm_params["unset_state"] in ONLINE_ROOTS:
         if vm is not None and vm.is_alive():
             vm.destroy(gracefully=False)
     else:
         logging.info("Removing online state '%s' of %s", vm_params["unset_state"], vm_name)
         vm.pause()
-        # NOTE: second online type is available and still supported but not recommended
-        if vm_params["unset_type"] != "ramfile":
-            # NOTE: this was supposed to be implemented in the Qemu VM object but
-            # it is not unlike savevm and loadvm, perhaps due to command availability
-            vm.verify_status('paused')
-            logging.debug("Deleting VM %s from %s", vm_name, vm_params["unset_state"])
-            vm.monitor.send_args_cmd("delvm id=%s" % vm_params["unset_state"])
-            vm.verify_status('paused')
-        else:
-            state_dir = vm_params.get("image_name", "")
-            state_dir = os.path.dirname(state_dir)
-            state_file = os.path.join(state_dir, vm_params["set_state"])
-            state_file = "%s.state" % state_file
-            os.unlink(state_file)
+        state_backend(vm_params["unset_type"], vm_params).unset_state(vm, vm_params, vm_params["unset_state"])
         vm.resume()
+    history.duration_history.record("unset", history.state_name(vm_name, vm_params["unset_state"]),
+                                    time.time() - start_time)
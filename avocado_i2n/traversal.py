@@ -0,0 +1,354 @@
+"""
+
+SUMMARY
+------------------------------------------------------
+Policies for the decisions taken while traversing a Cartesian graph,
+i.e. which tests to run next, when to rerun ephemeral setup, and when
+to clean up the states of finished tests.
+
+Copyright: Intra2net AG
+
+
+INTERFACE
+------------------------------------------------------
+
+"""
+
+import logging
+import itertools
+import importlib
+import collections
+
+from . import state_setup
+from . import history
+
+
+def state_provider(test_node, vm_name, state):
+    """
+    Get the setup node of a test node providing a state of one of its test objects.
+
+    :param test_node: test node requiring the state
+    :type test_node: :py:class:`cartesian_graph.TestNode`
+    :param str vm_name: name of the test object (vm) to get the state of
+    :param str state: required state of the test object
+    :returns: the setup node leaving the required state or None if there is none
+    :rtype: :py:class:`cartesian_graph.TestNode` or None
+    """
+    for setup in itertools.chain(test_node.setup_nodes, test_node.visited_setup_nodes):
+        if vm_name in setup.params.objects("vms"):
+            if setup.params.object_params(vm_name).get("set_state") == state:
+                return setup
+    return None
+
+
+def is_online_state(test_node, vm_name, state):
+    """
+    Check whether a state required by a test node is an online state (retrieved via loadvm).
+
+    :param test_node: test node requiring the state
+    :type test_node: :py:class:`cartesian_graph.TestNode`
+    :param str vm_name: name of the test object (vm) to get the state of
+    :param str state: required state of the test object
+    :returns: whether the state is an online state
+    :rtype: bool
+    """
+    provider = state_provider(test_node, vm_name, state)
+    if provider is None:
+        return test_node.params.object_params(vm_name).get("get_type") == "online"
+    return provider.params.object_params(vm_name).get("set_type", "online") == "online"
+
+
+def state_switches(test_node):
+    """
+    Get all state switches of the test objects a test node would require.
+
+    :param test_node: test node to get the state switches for
+    :type test_node: :py:class:`cartesian_graph.TestNode`
+    :returns: names of the switched test objects, their required states,
+              and the setup nodes providing these states (if any)
+    :rtype: [(str, str, :py:class:`cartesian_graph.TestNode` or None)]
+    """
+    switches = []
+    for test_object in test_node.objects:
+        state = test_node.params.object_params(test_object.name).get("get_state", "")
+        if state in [""] + state_setup.OFFLINE_ROOTS + state_setup.ONLINE_ROOTS:
+            continue
+        if state != test_object.current_state:
+            switches.append((test_object.name, state, state_provider(test_node, test_object.name, state)))
+    return switches
+
+
+class TraversalPolicy(object):
+    """
+    Default policy of the Cartesian graph traversal.
+
+    Parents and children are picked by test name, ephemeral setup is rerun
+    whenever the state it provides was switched, and each test node is
+    cleaned up as soon as all its children were cleaned up.
+
+    Custom policies can override any of these decisions and are selected
+    with the `traversal_policy` parameter either by their name among the
+    :py:data:`POLICIES` or by their full class path.
+    """
+
+    def __init__(self, runner):
+        """
+        Construct a policy for a single traversal.
+
+        :param runner: runner performing the traversal
+        :type runner: :py:class:`runner.CartesianRunner`
+        """
+        self.runner = runner
+        #: test nodes whose cleanup was deferred until the end of the traversal in order
+        self.deferred_cleanups = collections.OrderedDict()
+        #: state operations avoided (if positive) compared to picking children by name
+        self.avoided_operations = collections.Counter()
+
+    def next_parent(self, test_node):
+        """
+        Choose the next parent of a test node to run.
+
+        :param test_node: test node whose setup is not yet ready
+        :type test_node: :py:class:`cartesian_graph.TestNode`
+        :returns: the next parent node
+        :rtype: :py:class:`cartesian_graph.TestNode`
+        """
+        return test_node.pick_next_parent()
+
+    def next_child(self, test_node):
+        """
+        Choose the next child of a test node to run.
+
+        :param test_node: test node whose cleanup is not yet ready
+        :type test_node: :py:class:`cartesian_graph.TestNode`
+        :returns: the next child node
+        :rtype: :py:class:`cartesian_graph.TestNode`
+
+        Children whose cleanup was deferred are not picked again.
+        """
+        return test_node.pick_next_child(exclude=self.deferred_cleanups)
+
+    def priority(self, test_node):
+        """
+        Get the priority key of a test node ready to be run with lower keys run first.
+
+        :param test_node: test node ready to be run
+        :type test_node: :py:class:`cartesian_graph.TestNode`
+        :returns: comparable priority key
+        :rtype: tuple
+
+        This orders the ready test nodes of the parallel traversal.
+        """
+        return test_node.order_key
+
+    def should_rerun(self, test_node):
+        """
+        Decide whether to rerun an already run ephemeral test node.
+
+        :param test_node: ephemeral test node passed through again
+        :type test_node: :py:class:`cartesian_graph.TestNode`
+        :returns: whether the test node has to be run again
+        :rtype: bool
+
+        Ephemeral setup can get lost and if so must be repeated for any of its
+        remaining children.
+        """
+        if test_node.is_cleanup_ready():
+            return False
+        for test_object in test_node.objects:
+            object_params = test_node.params.object_params(test_object.name)
+            # if previous state is not known keep behavior assuming that the user knows what they are doing
+            if object_params.get("set_state") != test_object.current_state != "unknown":
+                logging.debug("Re-running ephemeral setup %s since %s state was switched to %s",
+                              test_node.params["shortname"], test_object.name, test_object.current_state)
+                return True
+        return False
+
+    def should_clean_now(self, test_node):
+        """
+        Decide whether to clean up a test node as soon as it is ready for cleanup.
+
+        :param test_node: test node whose children were all cleaned up
+        :type test_node: :py:class:`cartesian_graph.TestNode`
+        :returns: whether to clean up now rather than at the end of the traversal
+        :rtype: bool
+
+        The setup nodes of a test node whose cleanup is deferred are cleaned up
+        after it and thus at the end of the traversal as well.
+        """
+        return True
+
+
+class PriorityPolicy(TraversalPolicy):
+    """
+    Policy picking the children of each test node by their priority keys
+    instead of by test name (the ordering keys unless overridden).
+
+    Before the first child of a test node is picked, all its children are
+    passed through in test name order and in priority order starting from
+    the current states of their test objects and the state switches (online
+    ones via loadvm) and ephemeral setup reruns each order would require are
+    compared with the difference counted among the avoided operations.
+    """
+
+    def __init__(self, runner):
+        """See :py:meth:`TraversalPolicy.__init__`."""
+        super(PriorityPolicy, self).__init__(runner)
+        # test nodes whose children orders were already compared
+        self._compared_parents = set()
+
+    def next_child(self, test_node):
+        if test_node not in self._compared_parents:
+            self._compared_parents.add(test_node)
+            children = [c for c in test_node.cleanup_nodes if c not in self.deferred_cleanups]
+            name_operations = self._order_operations(sorted(children, key=lambda c: c.order_key))
+            operations = self._order_operations(sorted(children, key=self.priority))
+            for operation in ["loadvm", "ephemeral rerun"]:
+                self.avoided_operations[operation] += name_operations[operation] - operations[operation]
+        return test_node.pick_next_child(self.priority, exclude=self.deferred_cleanups)
+
+    def _order_operations(self, test_nodes):
+        """Count the loadvm calls and ephemeral setup reruns of switching states for test nodes in order."""
+        operations = collections.Counter()
+        states = {}
+        for test_node in test_nodes:
+            for test_object in test_node.objects:
+                vm_params = test_node.params.object_params(test_object.name)
+                state = vm_params.get("get_state", "")
+                current_state = states.get(test_object.name, test_object.current_state)
+                if state not in [""] + state_setup.OFFLINE_ROOTS + state_setup.ONLINE_ROOTS and \
+                        state != current_state:
+                    if is_online_state(test_node, test_object.name, state):
+                        operations["loadvm"] += 1
+                    provider = state_provider(test_node, test_object.name, state)
+                    if provider is not None and provider.is_ephemeral():
+                        operations["ephemeral rerun"] += 1
+                    states[test_object.name] = state
+                if vm_params.get("set_state"):
+                    states[test_object.name] = vm_params["set_state"]
+        return operations
+
+
+class CostPolicy(PriorityPolicy):
+    """
+    Policy picking the children of each test node by their historical cost.
+
+    Children leaving no new states come first since they do not change the
+    states of their test objects which would otherwise have to be retrieved
+    again (rerunning any ephemeral setup) for the remaining children. Among
+    them cheaper children come first where the cost of a child includes the
+    switches of its test objects from their current states to the states it
+    requires, i.e. the retrieval of these states and the rerun of any lost
+    ephemeral setup providing them. Test nodes or states without any history
+    are estimated by the mean duration of all test nodes or states with history.
+    """
+
+    def __init__(self, runner):
+        """See :py:meth:`TraversalPolicy.__init__`."""
+        super(CostPolicy, self).__init__(runner)
+        # mean durations of the history for the entries without history
+        self._mean_durations = None
+
+    def _estimate(self, kind, name):
+        """Estimate the duration of an entry of the history or of any entry of its kind."""
+        durations = self.runner.history
+        if self._mean_durations is None:
+            self._mean_durations = {"node": durations.mean("node"), "get": durations.mean("get")}
+        return durations.estimate(kind, name, self._mean_durations[kind])
+
+    def switch_cost(self, test_node):
+        """
+        Estimate the cost of switching the test objects of a test node to the states it requires.
+
+        :param test_node: test node to switch the test objects for
+        :type test_node: :py:class:`cartesian_graph.TestNode`
+        :returns: estimated duration of all state retrievals and ephemeral setup reruns
+        :rtype: float
+
+        Each required state is retrieved while switching a test object away
+        from its current state additionally reruns any ephemeral setup
+        providing the required state since the latter was lost.
+        """
+        cost = 0.0
+        for vm_name in test_node.params.objects("vms"):
+            state = test_node.params.object_params(vm_name).get("get_state", "")
+            if state not in [""] + state_setup.OFFLINE_ROOTS + state_setup.ONLINE_ROOTS:
+                cost += self._estimate("get", history.state_name(vm_name, state))
+        for _, _, provider in state_switches(test_node):
+            if provider is not None and provider.is_ephemeral():
+                cost += self._estimate("node", provider.params["shortname"])
+        return cost
+
+    def priority(self, test_node):
+        """
+        Get the priority key of a test node from its historical cost.
+
+        :returns: whether the test node leaves new states, its estimated
+                  duration including its state switches, and its ordering
+                  key for any ties
+        :rtype: (bool, float, tuple)
+        """
+        leaves_states = False
+        for vm_name in test_node.params.objects("vms"):
+            if test_node.params.object_params(vm_name).get("set_state"):
+                leaves_states = True
+        cost = self._estimate("node", test_node.params["shortname"]) + self.switch_cost(test_node)
+        return (leaves_states, cost, test_node.order_key)
+
+
+class LocalityPolicy(PriorityPolicy):
+    """
+    Policy picking the children of each test node by the current states of
+    their test objects.
+
+    Children requiring the current states of their test objects come first
+    while the rest are grouped by the states they require so that each
+    state is switched to (possibly rerunning its ephemeral setup) once.
+    Children leaving new states come after their siblings requiring the
+    same states as they switch their test objects away from these states.
+    """
+
+    def priority(self, test_node):
+        """
+        Get the priority key of a test node from the current states of its test objects.
+
+        :returns: number of state switches the test node requires, whether it
+                  leaves new states, its required states, and its ordering key
+        :rtype: (int, bool, (str), tuple)
+        """
+        states, leaves_states = [], False
+        for test_object in test_node.objects:
+            object_params = test_node.params.object_params(test_object.name)
+            states.append(object_params.get("get_state", ""))
+            if object_params.get("set_state"):
+                leaves_states = True
+        return (len(state_switches(test_node)), leaves_states, tuple(states), test_node.order_key)
+
+
+#: traversal policies selectable by name
+POLICIES = {"name": TraversalPolicy, "cost": CostPolicy, "locality": LocalityPolicy}
+
+
+def traversal_policy(policy_name, runner):
+    """
+    Get a policy to traverse a Cartesian graph with.
+
+    :param str policy_name: name of a policy among the :py:data:`POLICIES` or
+                            full class path of a custom policy
+    :param runner: runner performing the traversal
+    :type runner: :py:class:`runner.CartesianRunner`
+    :returns: a new policy for the traversal
+    :rtype: :py:class:`TraversalPolicy`
+    :raises: :py:class:`ValueError` if the policy is unknown
+    """
+    if policy_name in POLICIES:
+        return POLICIES[policy_name](runner)
+    module_name, _, class_name = policy_name.rpartition(".")
+    try:
+        policy_class = getattr(importlib.import_module(module_name), class_name)
+    except (ValueError, ImportError, AttributeError):
+        raise ValueError("Unknown traversal policy %s - can be either of %s or a full class path"
+                         % (policy_name, ", ".join(sorted(POLICIES))))
+    if not (isinstance(policy_class, type) and issubclass(policy_class, TraversalPolicy)):
+        raise ValueError("Traversal policy %s is not a subclass of TraversalPolicy" % policy_name)
+    return policy_class(runner)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+Benchmark the parsing, scanning, and traversal of synthetic Cartesian graphs.
+
+Each graph is generated from synthetic Cartesian configs with a number of
+vms, tests per vm, and a depth of setup tests leading to each test. The
+states are scanned with a mocked state backend and the traversal runs
+mocked tests so that only the overhead of the loader and runner is timed.
+One JSON line is appended to the output file per benchmarked graph.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+import unittest.mock as mock
+
+import unittest_importer
+from avocado_i2n.cartesian_graph import TestGraph
+from avocado_i2n.loader import CartesianLoader
+from avocado_i2n.runner import CartesianRunner
+from avocado_i2n import params_parser as param
+from avocado_i2n.history import DurationHistory
+
+
+def write_configs(config_dir, vms, tests, depth):
+    """
+    Write a minimal suite of synthetic Cartesian configs.
+
+    :param str config_dir: directory to write the configs in
+    :param int vms: number of vms
+    :param int tests: number of tests run on each vm
+    :param int depth: number of setup tests each test depends on in a chain
+    """
+    vm_names = ["vm%i" % (i + 1) for i in range(vms)]
+    with open(os.path.join(config_dir, "guest-base.cfg"), "w") as f:
+        f.write("vms = %s\nmain_vm = %s\n" % (" ".join(vm_names), vm_names[0]))
+
+    objects = "include guest-base.cfg\n\nvms =\n"
+    for vm_name in vm_names:
+        objects += "variants:\n    - %s:\n        vms += \" %s\"\n    - @no_%s:\n" % (vm_name, vm_name, vm_name)
+    with open(os.path.join(config_dir, "objects.cfg"), "w") as f:
+        f.write(objects)
+
+    groups = ("base_vm = %s\n\nvariants:\n"
+              "    - internal:\n        variants:\n"
+              "            - stateless:\n                variants:\n"
+              "                    - 0scan:\n                    - 0root:\n"
+              "                    - manage:\n                        variants:\n"
+              "                            - unchanged:\n"
+              "                                vm_action = check\n" % vm_names[0])
+    if depth > 0:
+        groups += ("            - permanent:\n"
+                   "                get_type = offline\n                set_type = offline\n"
+                   "                variants:\n")
+    previous_state = "0root"
+    for level in range(1, depth + 1):
+        groups += ("                    - setup%i:\n                        get_state = %s\n"
+                   "                        set_state = setup%i\n" % (level, previous_state, level))
+        previous_state = "setup%i" % level
+    groups += "    - bench:\n        get_state = %s\n        variants:\n" % previous_state
+    for test in range(1, tests + 1):
+        groups += "            - test%i:\n" % test
+    groups += "        variants:\n"
+    for vm_name in vm_names:
+        groups += "            - on_%s:\n                vms = %s\n                base_vm = %s\n" % (vm_name, vm_name, vm_name)
+    with open(os.path.join(config_dir, "groups.cfg"), "w") as f:
+        f.write(groups)
+
+    with open(os.path.join(config_dir, "sets.cfg"), "w") as f:
+        f.write("include groups.cfg\n\nvariants:\n"
+                "    - leaves:\n        no internal\n"
+                "    - all:\n        no internal\n"
+                "    - @nonleaves:\n        only internal\n")
+
+
+def benchmark(vms, tests, depth, present=0, repeat=1, parse_workers=1):
+    """
+    Time the parsing, scanning, and traversal of a synthetic Cartesian graph.
+
+    :param int vms: number of vms
+    :param int tests: number of tests run on each vm
+    :param int depth: number of setup tests each test depends on in a chain
+    :param int present: number of setup states (from the root) already present
+    :param int repeat: number of repetitions to take the fastest timings from
+    :param int parse_workers: number of worker processes to parse with
+    :returns: size of the graph and fastest timings of each stage in seconds
+    :rtype: {str, int or float}
+    """
+    suite_dir = tempfile.mkdtemp(prefix="bench-i2n-")
+    config_dir = os.path.join(suite_dir, "configs")
+    os.mkdir(config_dir)
+    write_configs(config_dir, vms, tests, depth)
+    present_states = ["root"] + ["setup%i" % level for level in range(1, present + 1)]
+
+    def check_state(params, env, print_pos=False, print_neg=False, inventory=None):
+        return params.get("check_state") in present_states
+
+    args = mock.MagicMock()
+    job = mock.MagicMock()
+    job.logdir = suite_dir
+    result = {"vms": vms, "tests": tests, "depth": depth, "present": present}
+    timings = {}
+    try:
+        with mock.patch.object(param, "custom_configs_dir", config_dir), \
+                mock.patch.object(param, "parser_cache", param.ParserCache(suite_dir, 0)), \
+                mock.patch("avocado_i2n.cartesian_graph.state_setup.check_state", check_state), \
+                mock.patch.object(CartesianRunner, "run_test_node", lambda _self, _node: True), \
+                mock.patch.object(TestGraph, "load_setup_list", mock.MagicMock()):
+            for _ in range(repeat):
+                param.clear_session_cache()
+                loader = CartesianLoader(args=args, extra_params={"parse_workers": parse_workers})
+                runner = CartesianRunner(job=job, result=mock.MagicMock())
+                runner.history = DurationHistory("")
+
+                start = time.time()
+                graph = loader.parse_object_trees("", "only all\n", {}, verbose=False)
+                parsed = time.time()
+                graph.scan_object_states(None)
+                scanned = time.time()
+                runner.run_traversal(graph, "")
+                traversed = time.time()
+
+                for stage, duration in [("parse_object_trees", parsed - start),
+                                        ("scan_object_states", scanned - parsed),
+                                        ("run_traversal", traversed - scanned)]:
+                    timings[stage] = min(timings.get(stage, duration), duration)
+                result["nodes"] = len(graph.nodes)
+    finally:
+        shutil.rmtree(suite_dir, ignore_errors=True)
+    result.update(timings)
+    return result
+
+
+def current_commit():
+    """Get the commit of the benchmarked source tree if available."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vms", type=int, nargs="+", default=[1, 2], help="numbers of vms")
+    parser.add_argument("--tests", type=int, nargs="+", default=[5, 20], help="numbers of tests per vm")
+    parser.add_argument("--depth", type=int, nargs="+", default=[1, 3], help="depths of the setup chains")
+    parser.add_argument("--present", type=int, default=0,
+                        help="number of setup states already present for the scan")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of repetitions to take the fastest timings from")
+    parser.add_argument("--parse-workers", type=int, default=1,
+                        help="number of worker processes to parse with")
+    parser.add_argument("--output", default="bench_cartesian_graph.jsonl",
+                        help="file to append the JSON results to")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    record = {"commit": current_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "parse_workers": options.parse_workers}
+    with open(options.output, "a") as f:
+        for vms, tests, depth in itertools.product(options.vms, options.tests, options.depth):
+            result = benchmark(vms, tests, depth, present=min(options.present, depth),
+                               repeat=options.repeat, parse_workers=options.parse_workers)
+            print("%(vms)i vms x %(tests)i tests x %(depth)i depth (%(nodes)i nodes): "
+                  "parse %(parse_object_trees).3f s, scan %(scan_object_states).3f s, "
+                  "traverse %(run_traversal).3f s" % result)
+            result.update(record)
+            f.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
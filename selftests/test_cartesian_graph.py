@@ -4,13 +4,20 @@ import unittest
 import unittest.mock as mock
 import shutil
 import re
+import os
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from avocado.core import exceptions
 
 import unittest_importer
-from avocado_i2n.cartesian_graph import TestGraph
+from avocado_i2n.cartesian_graph import TestGraph, TestObject, TestNode, NodeQueue
 from avocado_i2n.loader import CartesianLoader
 from avocado_i2n.runner import CartesianRunner
+from avocado_i2n import params_parser as param
+from avocado_i2n import traversal
+from avocado_i2n.history import DurationHistory
 
 
 class DummyTestRunning(object):
@@ -45,7 +52,7 @@ class DummyStateCheck(object):
 
     present_states = []
 
-    def __init__(self, params, env, print_pos=True, print_neg=True):
+    def __init__(self, params, env, print_pos=True, print_neg=True, inventory=None):
         if params.get("check_state") in self.present_states:
             self.result = True
         else:
@@ -56,8 +63,11 @@ def mock_run_test_node(_self, node):
     return DummyTestRunning(node).result()
 
 
-def mock_check_state(params, env, print_pos=True, print_neg=True):
-    return DummyStateCheck(params, env, print_pos=True, print_neg=True).result
+actual_run_test_node = CartesianRunner.run_test_node
+
+
+def mock_check_state(params, env, print_pos=True, print_neg=True, inventory=None):
+    return DummyStateCheck(params, env, print_pos=True, print_neg=True, inventory=inventory).result
 
 
 @mock.patch('avocado_i2n.cartesian_graph.state_setup.check_state', mock_check_state)
@@ -83,6 +93,7 @@ class CartesianGraphTest(unittest.TestCase):
         self.job.logdir = "."
         self.result = mock.MagicMock()
         self.runner = CartesianRunner(job=self.job, result=self.result)
+        self.runner.history = DurationHistory("")
 
     def tearDown(self):
         shutil.rmtree("./graph_parse", ignore_errors=True)
@@ -100,6 +111,20 @@ class CartesianGraphTest(unittest.TestCase):
         for key in dict1.keys():
             self.assertEqual(dict1[key], test_object.params[key], "The values of key %s %s=%s must be the same" % (key, dict1[key], test_object.params[key]))
 
+    def test_object_params_cache(self):
+        self.args.tests_str += "only tutorial1\n"
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        test_object = graph.objects[0]
+        params = test_object.params
+        hits, misses = TestObject.params_hits, TestObject.params_misses
+        self.assertIs(test_object.params, params)
+        self.assertEqual(TestObject.params_hits, hits + 1)
+        self.assertEqual(TestObject.params_misses, misses)
+        # a new parser invalidates the cached parameters
+        test_object.parser = test_object.parser
+        self.assertIsNot(test_object.params, params)
+        self.assertEqual(TestObject.params_misses, misses + 1)
+
     def test_node_params(self):
         self.args.tests_str += "only tutorial1\n"
         graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
@@ -112,6 +137,79 @@ class CartesianGraphTest(unittest.TestCase):
         for key in dict1.keys():
             self.assertEqual(dict1[key], test_node.params[key], "The values of key %s %s=%s must be the same" % (key, dict1[key], test_node.params[key]))
 
+    def test_parallel_parsing(self):
+        self.args.tests_str += "only tutorial1,tutorial2\n"
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        parallel_loader = CartesianLoader(args=self.args, extra_params={"parse_workers": 4})
+        with mock.patch("avocado_i2n.loader.ProcessPoolExecutor", wraps=ProcessPoolExecutor) as pool_class:
+            parallel_graph = parallel_loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        # a single pool is reused for all parsing calls and shut down at the end
+        self.assertEqual(pool_class.call_count, 1)
+        self.assertIsNone(parallel_loader._parse_pool)
+        self.assertEqual([n.params["shortname"] for n in graph.nodes],
+                         [n.params["shortname"] for n in parallel_graph.nodes])
+        self.assertEqual([n.id for n in graph.nodes], [n.id for n in parallel_graph.nodes])
+        self.assertEqual([o.id for o in graph.objects], [o.id for o in parallel_graph.objects])
+        for test_object, parallel_object in zip(graph.objects, parallel_graph.objects):
+            self.assertEqual(dict(test_object.params), dict(parallel_object.params))
+        for node, parallel_node in zip(graph.nodes, parallel_graph.nodes):
+            self.assertEqual(dict(node.params), dict(parallel_node.params))
+
+    def test_indexed_queries(self):
+        self.args.tests_str += "only tutorial1,tutorial2\n"
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        queries = [("vms", "^vm1$"), ("vms", r"(^|\s)vm2($|\s)"), ("set_state", "^root$"),
+                   ("set_state", "^customize"), ("name", r"(\.|^)0root(\.|$)"), ("name", r"(\.|^)0scan(\.|^)")]
+        for param_key, param_val in queries:
+            expected = [n for n in graph.nodes if re.search(param_val, n.params.get(param_key, ""))]
+            self.assertEqual(graph.get_nodes_by(param_key, param_val), expected)
+            subset = graph.get_nodes_by("vms", r"(^|\s)vm1($|\s)")
+            expected = [n for n in subset if re.search(param_val, n.params.get(param_key, ""))]
+            self.assertEqual(graph.get_nodes_by(param_key, param_val, subset=subset), expected)
+        for test_object in graph.objects:
+            self.assertEqual(graph.get_objects_by("main_vm", "^%s$" % test_object.name), [test_object])
+        self.assertIsNotNone(graph.nodes_index.candidates("vms", r"(^|\s)vm1($|\s)"))
+        self.assertIsNone(graph.nodes_index.candidates("name", "tutorial.+"))
+
+    def test_new_nodes_registry(self):
+        self.args.tests_str += "only tutorial1\n"
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        nodes, objects = list(graph.nodes), list(graph.objects)
+        graph.new_nodes(nodes)
+        graph.new_objects(objects)
+        self.assertEqual(graph.nodes, nodes)
+        self.assertEqual(graph.objects, objects)
+        self.assertEqual(sorted(graph.nodes_index.ids.keys()), sorted(graph.test_nodes.keys()))
+
+        reused_graph = TestGraph()
+        reused_graph.new_nodes(nodes + nodes)
+        self.assertEqual(reused_graph.nodes, nodes)
+
+    def test_node_queue(self):
+        nodes = [TestNode(count, None, []) for count in ["10", "2", "1a1", "1", "0s", "2b1", "1a10", "1a2"]]
+        queue = NodeQueue(nodes)
+        self.assertEqual(list(queue), nodes)
+        ordered = []
+        while len(queue) > 0:
+            ordered.append(queue.first().count)
+            queue.remove(queue.first())
+        self.assertEqual(ordered, ["0s", "1", "1a1", "1a2", "1a10", "2", "2b1", "10"])
+        for node1, node2 in zip(nodes, nodes[1:]):
+            self.assertEqual(TestNode.comes_before(node1, node2), node1.order_key < node2.order_key)
+
+        queue = NodeQueue(nodes + nodes[:2])
+        self.assertEqual(len(queue), len(nodes))
+        queue.remove(nodes[3])
+        self.assertNotIn(nodes[3], queue)
+        self.assertIn(nodes[4], queue)
+        self.assertRaises(ValueError, queue.remove, nodes[3])
+        self.assertEqual(list(queue), nodes[:3] + nodes[4:])
+        # excluded test nodes are skipped but remain in the queue
+        self.assertEqual(queue.first(exclude={nodes[4], nodes[2]}).count, "1a2")
+        self.assertEqual(queue.first(exclude={nodes[6]}).count, "0s")
+        self.assertEqual(len(queue), len(nodes) - 1)
+        self.assertRaises(IndexError, queue.first, exclude=set(nodes))
+
     def test_one_leaf(self):
         self.args.tests_str += "only tutorial1\n"
         graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
@@ -127,6 +225,11 @@ class CartesianGraphTest(unittest.TestCase):
         DummyTestRunning.fail_switch = [False] * 7
         self.runner.run_traversal(graph, self.args.param_str)
         self.assertEqual(len(DummyTestRunning.asserted_tests), 0, "Some tests weren't run: %s" % DummyTestRunning.asserted_tests)
+        # the incrementally updated progress must agree with a full recount
+        finished, total = graph.progress
+        self.assertEqual(total, len(graph.nodes))
+        self.assertEqual(finished, len([n for n in graph.nodes if n.is_finished()]))
+        self.assertEqual(finished, total)
 
     def test_one_leaf_with_path_setup(self):
         self.args.tests_str += "only tutorial1\n"
@@ -159,6 +262,158 @@ class CartesianGraphTest(unittest.TestCase):
         self.runner.run_traversal(graph, self.args.param_str)
         self.assertEqual(len(DummyTestRunning.asserted_tests), 0, "Some tests weren't run: %s" % DummyTestRunning.asserted_tests)
 
+    def test_nonmutating_leaves(self):
+        self.args.tests_str += "only tutorial1,tutorial2\n"
+        self.args.param_str += param.dict_to_str({"mutates_state": "no"})
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        DummyStateCheck.present_states = ["root", "install", "customize_vm", "online_deploy"]
+        graph.scan_object_states(None)
+        DummyTestRunning.asserted_tests = [
+            {"shortname": "^internal.stateless.0scan.vm1", "vms": "^vm1$"},
+            {"shortname": "^all.quicktest.tutorial1.vm1", "vms": "^vm1$", "get_state": "^online_deploy$"},
+            # the state is already retrieved and not modified by the previous leaves
+            {"shortname": "^all.quicktest.tutorial2.files.vm1", "vms": "^vm1$", "get_state_vm1": "^$"},
+            {"shortname": "^all.quicktest.tutorial2.names.vm1", "vms": "^vm1$", "get_state_vm1": "^$"},
+        ]
+        DummyTestRunning.fail_switch = [False] * 4
+        self.runner.run_traversal(graph, self.args.param_str)
+        self.assertEqual(len(DummyTestRunning.asserted_tests), 0, "Some tests weren't run: %s" % DummyTestRunning.asserted_tests)
+        self.assertEqual(self.runner.state_operations["get"], 1)
+        self.assertEqual(self.runner.state_operations["skipped get"], 2)
+        self.assertEqual(self.runner.state_operations["online get"], 1)
+        self.assertEqual(self.runner.state_operations["skipped online get"], 2)
+        # the original parameters of the test nodes are restored
+        for node in graph.get_nodes_by("name", "tutorial2"):
+            self.assertNotIn("get_state_vm1", node.params)
+
+    def test_nonmutating_leaves_failure(self):
+        self.args.tests_str += "only tutorial1,tutorial2\n"
+        self.args.param_str += param.dict_to_str({"mutates_state": "no"})
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        DummyStateCheck.present_states = ["root", "install", "customize_vm", "online_deploy"]
+        graph.scan_object_states(None)
+        DummyTestRunning.asserted_tests = [
+            {"shortname": "^internal.stateless.0scan.vm1", "vms": "^vm1$"},
+            {"shortname": "^all.quicktest.tutorial1.vm1", "vms": "^vm1$", "get_state": "^online_deploy$"},
+            # the failed previous leaf might have modified the state so it is retrieved again
+            {"shortname": "^all.quicktest.tutorial2.files.vm1", "vms": "^vm1$", "get_state": "^online_deploy$"},
+            {"shortname": "^all.quicktest.tutorial2.names.vm1", "vms": "^vm1$", "get_state_vm1": "^$"},
+        ]
+        DummyTestRunning.fail_switch = [False, True, False, False]
+        self.runner.run_traversal(graph, self.args.param_str)
+        self.assertEqual(len(DummyTestRunning.asserted_tests), 0, "Some tests weren't run: %s" % DummyTestRunning.asserted_tests)
+        self.assertEqual(self.runner.state_operations["get"], 2)
+        self.assertEqual(self.runner.state_operations["skipped get"], 1)
+
+    def test_cost_priority(self):
+        self.args.tests_str += "only tutorial1,tutorial2\n"
+        self.args.param_str += param.dict_to_str({"traversal_policy": "cost"})
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        DummyStateCheck.present_states = ["root", "install", "customize_vm", "online_deploy"]
+        graph.scan_object_states(None)
+        history_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, history_dir)
+        self.runner.history = DurationHistory(os.path.join(history_dir, "history"))
+        for name, duration in [("tutorial1", 10.0), ("files", 5.0), ("names", 1.0)]:
+            node = graph.get_nodes_by("name", "(\\.|^)%s(\\.|$)" % name)[0]
+            self.runner.history.record("node", node.params["shortname"], duration)
+        DummyTestRunning.asserted_tests = [
+            {"shortname": "^internal.stateless.0scan.vm1", "vms": "^vm1$"},
+            # the cheapest children are run first instead of ordering by name
+            {"shortname": "^all.quicktest.tutorial2.names.vm1", "vms": "^vm1$"},
+            {"shortname": "^all.quicktest.tutorial2.files.vm1", "vms": "^vm1$"},
+            {"shortname": "^all.quicktest.tutorial1.vm1", "vms": "^vm1$"},
+        ]
+        DummyTestRunning.fail_switch = [False] * 4
+        self.runner.run_traversal(graph, self.args.param_str)
+        self.assertEqual(len(DummyTestRunning.asserted_tests), 0, "Some tests weren't run: %s" % DummyTestRunning.asserted_tests)
+        # the durations of the run tests are recorded for the next runs
+        self.assertEqual(len(self.runner.history.estimates["node"]), 4)
+
+    def test_locality_priority(self):
+        self.args.tests_str += "only tutorial1,tutorial3\n"
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        tutorial1 = graph.get_nodes_by("name", "(\\.|^)tutorial1(\\.|$)")[0]
+        tutorial3 = graph.get_nodes_by("name", "(\\.|^)tutorial3(\\.|$)")[0]
+        current_states = {"vm1": "online_with_provider", "vm2": "online_deploy"}
+        for test_object in tutorial1.objects + tutorial3.objects:
+            test_object.current_state = current_states[test_object.name]
+
+        self.assertEqual(traversal.state_switches(tutorial3), [])
+        switches = traversal.state_switches(tutorial1)
+        self.assertEqual([switch[:2] for switch in switches], [("vm1", "online_deploy")])
+        # the required state is provided by an ephemeral setup that would have to be rerun
+        self.assertRegex(switches[0][2].params["shortname"], "^internal.ephemeral.online_deploy.vm1")
+        self.assertTrue(switches[0][2].is_ephemeral())
+        policy = traversal.LocalityPolicy(self.runner)
+        self.assertLess(policy.priority(tutorial3), policy.priority(tutorial1))
+
+        tutorial1.objects[0].current_state = "online_deploy"
+        self.assertLess(policy.priority(tutorial1), policy.priority(tutorial3))
+
+    def test_traversal_policy(self):
+        self.assertIsInstance(traversal.traversal_policy("name", self.runner), traversal.TraversalPolicy)
+        self.assertIsInstance(traversal.traversal_policy("locality", self.runner), traversal.LocalityPolicy)
+        policy = traversal.traversal_policy("avocado_i2n.traversal.CostPolicy", self.runner)
+        self.assertIsInstance(policy, traversal.CostPolicy)
+        self.assertIs(policy.runner, self.runner)
+        with self.assertRaises(ValueError):
+            traversal.traversal_policy("nonexistent", self.runner)
+        with self.assertRaises(ValueError):
+            traversal.traversal_policy("avocado_i2n.history.DurationHistory", self.runner)
+
+    @mock.patch.object(CartesianRunner, 'run_test_node', actual_run_test_node)
+    def test_dry_run_traversal(self):
+        self.args.tests_str += "only tutorial1\n"
+        self.args.param_str += param.dict_to_str({"dry_run_traversal": "yes", "dry_run_traversal_states": "vm1/root vm1/install"})
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        self.addCleanup(os.unlink, "./dry_run_traversal")
+        history_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, history_dir)
+        self.runner.history = DurationHistory(os.path.join(history_dir, "history"))
+        # no test is run (not even the scan with a synthetic inventory)
+        DummyTestRunning.asserted_tests = []
+        self.runner.run_traversal(graph, self.args.param_str)
+        expected_operations = [
+            ("get", "^vm1/install$"), ("node", "^internal.permanent.customize_vm.vm1"), ("set", "^vm1/customize_vm$"),
+            ("get", "^vm1/customize_vm$"), ("node", "^internal.ephemeral.online_deploy.vm1"), ("set", "^vm1/online_deploy$"),
+            ("get", "^vm1/online_deploy$"), ("node", "^all.quicktest.tutorial1.vm1"),
+        ]
+        operations = self.runner.simulator.operations
+        self.assertEqual(len(operations), len(expected_operations), "Unexpected operations: %s" % operations)
+        for (kind, name, _), (expected_kind, expected_name) in zip(operations, expected_operations):
+            self.assertEqual(kind, expected_kind)
+            self.assertRegex(name, expected_name)
+        self.assertEqual(self.runner.simulator.missing_states, [])
+        self.assertEqual(self.runner.simulator.estimated_time, 3 * 60.0 + 3 * 10.0 + 2 * 30.0)
+        with open("./dry_run_traversal") as f:
+            self.assertIn("# estimated duration: 270.00 s", f.read())
+        # simulated durations are not recorded as history
+        self.assertEqual(len(self.runner.history.estimates["node"]), 0)
+
+    def test_deferred_cleanup(self):
+        self.args.tests_str += "only tutorial1,tutorial2\n"
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        DummyStateCheck.present_states = ["root", "install", "customize_vm", "online_deploy"]
+        graph.scan_object_states(None)
+        tutorial1 = graph.get_nodes_by("name", "(\\.|^)tutorial1(\\.|$)")[0]
+
+        class DeferringPolicy(traversal.TraversalPolicy):
+            def should_clean_now(self, test_node):
+                return test_node is not tutorial1
+        cleanups = []
+        with mock.patch.object(traversal, "traversal_policy", lambda _name, runner: DeferringPolicy(runner)), \
+                mock.patch.object(CartesianRunner, "run_test_node", lambda _self, _node: True), \
+                mock.patch.object(CartesianRunner, "_reverse_test_node",
+                                  lambda _self, _graph, test_node, _param_str: cleanups.append(test_node)):
+            self.runner.run_traversal(graph, self.args.param_str)
+        self.assertEqual(len(self.runner.policy.deferred_cleanups), 0)
+        # the setup nodes of the deferred test node are cleaned up only after it
+        setups = [setup for setup in tutorial1.visited_setup_nodes if not setup.is_shared_root()]
+        self.assertGreater(len(setups), 0)
+        for setup in setups:
+            self.assertGreater(cleanups.index(setup), cleanups.index(tutorial1))
+
     def test_two_objects_without_setup(self):
         self.args.tests_str += "only tutorial3\n"
         graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
@@ -201,6 +456,54 @@ class CartesianGraphTest(unittest.TestCase):
         self.runner.run_traversal(graph, self.args.param_str)
         self.assertEqual(len(DummyTestRunning.asserted_tests), 0, "Some tests weren't run: %s" % DummyTestRunning.asserted_tests)
 
+    def test_parallel_traversal(self):
+        self.args.tests_str += "only tutorial3\n"
+        self.args.param_str += param.dict_to_str({"traversal_slots": "2"})
+        graph = self.loader.parse_object_trees(self.args.param_str, self.args.tests_str, self.args.vm_strs, self.prefix, self.main_vm)
+        DummyStateCheck.present_states = ["root", "install", "customize_vm"]
+        graph.scan_object_states(None)
+
+        # each test node is run in a separate process logging its start and end
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        log_file = os.path.join(tmp_dir, "parallel.log")
+        barrier = multiprocessing.get_context("fork").Barrier(2, timeout=10)
+        def run_test_node(_self, node):
+            shortname = node.params["shortname"]
+            with open(log_file, "a") as log:
+                log.write("start %s %s\n" % (shortname, node.params["vms"]))
+            # both tests on disjoint vms have to be run at the same time to pass the barrier
+            if re.match("^internal.permanent.set_provider.vm1|^internal.ephemeral.online_deploy.vm2", shortname):
+                barrier.wait()
+            with open(log_file, "a") as log:
+                log.write("end %s %s\n" % (shortname, node.params["vms"]))
+            return True
+
+        with mock.patch.object(CartesianRunner, 'run_test_node', run_test_node), \
+                mock.patch('avocado_i2n.runner.data_dir.get_tmp_dir', lambda: tmp_dir):
+            self.runner.run_traversal(graph, self.args.param_str)
+        run_tests, running_vms = [], set()
+        with open(log_file) as log:
+            for line in log:
+                event, shortname, vms = line.split(" ", 2)
+                vms = set(vms.split())
+                if event == "start":
+                    self.assertFalse(running_vms & vms, "%s run while %s are in use" % (shortname, running_vms))
+                    running_vms.update(vms)
+                    run_tests.append(shortname)
+                else:
+                    running_vms.difference_update(vms)
+        expected = ["^internal.stateless.0scan.vm1", "^internal.permanent.set_provider.vm1",
+                    "^internal.ephemeral.online_with_provider.vm1", "^internal.ephemeral.online_deploy.vm2",
+                    "^all.tutorial3"]
+        self.assertEqual(len(run_tests), len(expected), "Unexpected tests run: %s" % run_tests)
+        positions = [[re.match(e, t) is not None for t in run_tests].index(True) for e in expected]
+        # setup tests are still run before the tests depending on them
+        self.assertEqual(positions[0], 0)
+        self.assertLess(positions[1], positions[2])
+        self.assertEqual(positions[4], len(expected) - 1)
+        self.assertFalse(barrier.broken)
+
     def test_abort_run(self):
         self.args.tests_str += "only tutorial1\n"
         self.args.param_str += "abort_on_error=yes\n"
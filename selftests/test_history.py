@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import os
+import fcntl
+import threading
+
+import unittest_importer
+from avocado_i2n import history
+
+
+class DurationHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history_dir = tempfile.mkdtemp()
+        self.history_file = os.path.join(self.history_dir, "history")
+        self.history = history.DurationHistory(self.history_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.history_dir)
+
+    def test_estimates(self):
+        self.assertIsNone(self.history.estimate("node", "tutorial1"))
+        self.assertEqual(self.history.estimate("node", "tutorial1", 1.0), 1.0)
+        self.assertEqual(self.history.mean("node"), 0.0)
+
+        self.history.record("node", "tutorial1", 10.0)
+        self.history.record("node", "tutorial1", 20.0)
+        self.history.record("node", "tutorial2", 3.0)
+        self.history.record("get", history.state_name("vm1", "launch"), 2.0)
+        # recent durations weigh more than older ones
+        self.assertEqual(self.history.estimate("node", "tutorial1"), 15.0)
+        self.history.record("node", "tutorial1", 5.0)
+        self.assertEqual(self.history.estimate("node", "tutorial1"), 10.0)
+        self.assertEqual(self.history.mean("node"), 6.5)
+        self.assertEqual(self.history.estimate("get", "vm1/launch"), 2.0)
+
+        # the durations are preserved among runs
+        loaded_history = history.DurationHistory(self.history_file)
+        self.assertEqual(loaded_history.estimates, self.history.estimates)
+
+    def test_compact(self):
+        for duration in [10.0, 20.0, 5.0]:
+            self.history.record("node", "tutorial1", duration)
+        self.history.record("set", "vm1/launch", 1.0)
+        with open(self.history_file) as f:
+            self.assertEqual(len(f.readlines()), 4)
+
+        # durations from other processes are included
+        other_history = history.DurationHistory(self.history_file)
+        other_history.record("node", "tutorial2", 3.0)
+        self.history.compact()
+        with open(self.history_file) as f:
+            self.assertEqual(len(f.readlines()), 3)
+        self.assertEqual(self.history.estimate("node", "tutorial2"), 3.0)
+        loaded_history = history.DurationHistory(self.history_file)
+        self.assertEqual(loaded_history.estimates, self.history.estimates)
+        self.assertEqual(loaded_history.estimate("node", "tutorial1"), 10.0)
+
+    def test_compact_locked(self):
+        self.history.record("node", "tutorial1", 10.0)
+        # a process recording a duration holds the lock
+        with open(self.history_file + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            compaction = threading.Thread(target=self.history.compact)
+            compaction.start()
+            compaction.join(0.1)
+            self.assertTrue(compaction.is_alive())
+        compaction.join()
+        self.assertEqual(self.history.estimate("node", "tutorial1"), 10.0)
+
+    def test_corrupted_records(self):
+        with open(self.history_file, "w") as f:
+            f.write('{"kind": "node", "name": "tutorial1", "duration": 1.0}\n'
+                    '{"kind": "node", "name": "tutor\n'
+                    '{"kind": "node", "duration": 2.0}\n')
+        self.assertEqual(dict(self.history.estimates), {"node": {"tutorial1": 1.0}})
+
+    def test_disabled(self):
+        disabled_history = history.DurationHistory("")
+        disabled_history.record("node", "tutorial1", 1.0)
+        disabled_history.compact()
+        self.assertIsNone(disabled_history.estimate("node", "tutorial1"))
+        self.assertEqual(os.listdir(self.history_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
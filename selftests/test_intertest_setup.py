@@ -80,9 +80,12 @@ class IntertestSetupTest(unittest.TestCase):
 
     # TODO: avoid direct calls to the avocado process module and use calls to the state setup instead
     @mock.patch('avocado_i2n.intertest_setup.process')
-    def test_update(self, _mock_process):
+    @mock.patch('avocado_i2n.state_setup.lv_report')
+    def test_update(self, mock_lv_report, mock_process):
         self.run_params["vms"] = "vm1 vm2"
         self.run_params["dry_run"] = "yes"
+        mock_lv_report.return_value = {"current_state": {"lv_attr": "Vwi-aotz--", "lv_path": "/dev/vg/current_state"},
+                                       "launch": {"lv_attr": "Vwi-a-tz--", "lv_path": "/dev/vg/launch"}}
         self.args.vm_strs = {"vm1": "only CentOS\n", "vm2": "only Win10\n"}
         DummyTestRunning.asserted_tests = [
             {"shortname": "^internal.stateless.manage.unchanged.vm1", "vms": "^vm1$", "get_state": "^install$"},
@@ -94,6 +97,10 @@ class IntertestSetupTest(unittest.TestCase):
         ]
         intertest_setup.update(self.args, self.run_params, tag="2")
         self.assertEqual(len(DummyTestRunning.asserted_tests), 0, "Some tests weren't run: %s" % DummyTestRunning.asserted_tests)
+        # a single report per volume group and no removals in a dry run
+        mock_lv_report.assert_has_calls([mock.call("at_vm1_ramdisk"), mock.call("at_vm2_ramdisk")])
+        self.assertEqual(mock_lv_report.call_count, 2)
+        mock_process.run.assert_not_called()
 
     def test_graphfull_default(self):
         self.run_params["vms"] = "vm1 vm2"
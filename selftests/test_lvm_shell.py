@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from avocado.utils import lv_utils
+
+import unittest_importer
+from avocado_i2n import lvm_shell
+
+
+class LVMShellTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shell = lvm_shell.LVMShell()
+        self.outputs = []
+        self.config = "--config 'log/report_command_log=1'"
+
+        expect_patch = mock.patch('avocado_i2n.lvm_shell.aexpect.Expect')
+        self.mock_expect = expect_patch.start()
+        self.addCleanup(expect_patch.stop)
+        self.mock_session = self.mock_expect.return_value
+        self.mock_session.is_alive.return_value = True
+        self.mock_session.a_id = "lvm-shell"
+        self.mock_session.read_until_last_line_matches.side_effect = self._read_output
+
+    def _read_output(self, *args, **kwargs):
+        return 0, self.outputs.pop(0)
+
+    def test_commands_in_one_session(self):
+        self.outputs = ["lvm> ",
+                        "lvremove -f vg/launch %s\n  Logical volume \"launch\" successfully removed\nlvm> " % self.config,
+                        "  success\nlvm> ",
+                        "lvcreate -s -ay -K -n launch vg/current_state %s\n  Logical volume \"launch\" created.\nlvm> " % self.config,
+                        "  success\nlvm> "]
+        self.shell.lv_remove("vg", "launch")
+        self.shell.lv_take_snapshot("vg", "current_state", "launch")
+        self.mock_expect.assert_called_once()
+        lastlog = mock.call("lastlog -S log_type=status -o log_message --noheadings")
+        self.mock_session.sendline.assert_has_calls([mock.call("lvremove -f vg/launch " + self.config), lastlog,
+                                                     mock.call("lvcreate -s -ay -K -n launch vg/current_state " + self.config),
+                                                     lastlog])
+        self.assertEqual(len(self.outputs), 0)
+
+    def test_command_output(self):
+        self.outputs = ["lvm> ",
+                        "lvs vg %s\n  LV     VG Attr\n  launch vg Vwi-a-tz--\nlvm> " % self.config,
+                        "  success\nlvm> "]
+        output = self.shell.cmd("lvs vg")
+        self.assertEqual(output, "  LV     VG Attr\n  launch vg Vwi-a-tz--")
+
+    def test_command_failure(self):
+        self.outputs = ["lvm> ",
+                        "lvremove -f vg/launch %s\n  Failed to find logical volume \"vg/launch\"\nlvm> " % self.config,
+                        "  failure\nlvm> "]
+        self.assertRaises(lv_utils.LVException, self.shell.lv_remove, "vg", "launch")
+
+    def test_shell_failure(self):
+        self.outputs = ["lvm> "]
+        self.shell.start()
+        self.mock_session.read_until_last_line_matches.side_effect = lvm_shell.aexpect.ExpectError("lvm", "")
+        self.assertRaises(lv_utils.LVException, self.shell.lv_remove, "vg", "launch")
+        self.mock_session.close.assert_called_once()
+        self.assertIsNone(self.shell.session)
+
+    def test_volume_checks(self):
+        self.outputs = ["lvm> ",
+                        "vgs vg %s\n  VG #PV #LV\n  vg   1   2\nlvm> " % self.config,
+                        "  success\nlvm> ",
+                        "lvs vg/launch %s\n  Failed to find logical volume \"vg/launch\"\nlvm> " % self.config,
+                        "  failure\nlvm> "]
+        self.assertTrue(self.shell.vg_check("vg"))
+        self.assertFalse(self.shell.lv_check("vg", "launch"))
+        self.mock_expect.assert_called_once()
+        self.assertEqual(len(self.outputs), 0)
+
+        self.mock_session.read_until_last_line_matches.side_effect = lvm_shell.aexpect.ExpectError("lvm", "")
+        self.assertRaises(lvm_shell.LVMShellError, self.shell.lv_check, "vg", "launch")
+
+    def test_locked_close(self):
+        self.outputs = ["lvm> "]
+        self.shell.start()
+        self.shell._lock = mock.MagicMock()
+        self.shell.close()
+        self.shell._lock.__enter__.assert_called_once_with()
+        self.mock_session.close.assert_called_once()
+        self.assertIsNone(self.shell.session)
+
+    def test_attached_shell(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        id_file = os.path.join(tmpdir, "shell")
+        self.outputs = ["lvm> ", "lvremove -f vg/launch %s\nlvm> " % self.config, "  success\nlvm> "]
+
+        shell = lvm_shell.LVMShell(id_file=id_file)
+        shell.start()
+        self.assertEqual(self.mock_expect.call_args[0], ("lvm",))
+        shell.release()
+        # the shell process is kept running for other processes
+        self.mock_session.close.assert_not_called()
+        self.assertTrue(os.path.exists(id_file))
+
+        other_shell = lvm_shell.LVMShell(id_file=id_file)
+        other_shell.lv_remove("vg", "launch")
+        self.assertEqual(self.mock_expect.call_count, 2)
+        self.assertEqual(self.mock_expect.call_args[1]["a_id"], "lvm-shell")
+        self.assertEqual(len(self.outputs), 0)
+
+        shell.close()
+        self.mock_session.close.assert_called_once()
+        self.assertFalse(os.path.exists(id_file))
+
+    def test_shared_shell(self):
+        self.outputs = ["lvm> ", "lvremove -f vg/launch %s\nlvm> " % self.config, "  success\nlvm> "]
+        shell = lvm_shell.get_shell()
+        self.assertIs(shell, lvm_shell.get_shell())
+        shell.lv_remove("vg", "launch")
+        lvm_shell.close_shell()
+        self.mock_session.close.assert_called_once()
+        self.assertIsNone(shell.session)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
+import unittest.mock as mock
 
 import unittest_importer
 import avocado_i2n.params_parser as param
@@ -40,6 +45,123 @@ class ParamsParserTest(unittest.TestCase):
         for key in params.keys():
             self.assertEqual(params[key], d[key], "The %s parameter must coincide: %s != %s" % (key, params[key], d[key]))
 
+    def test_parser_peek_once(self):
+        self.base_str = "only tutorial1\n"
+        parser = param.prepare_parser(base_str=self.base_str, base_file=self.base_file)
+        first_dict = next(parser.get_dicts())
+        with mock.patch.object(parser, 'get_dicts') as mock_get_dicts:
+            self.assertEqual(param.peek(parser)["shortname"], first_dict["shortname"])
+            self.assertEqual(param.peek(parser)["shortname"], first_dict["shortname"])
+            self.assertFalse(parser.is_empty())
+            mock_get_dicts.assert_not_called()
+
+        # any restriction results in reevaluation
+        updated_parser = param.update_parser(parser, ovrwrt_dict={"peeked_key": "peeked_value"})
+        self.assertEqual(param.peek(updated_parser)["peeked_key"], "peeked_value")
+        self.assertNotIn("peeked_key", param.peek(parser))
+        self.assertEqual(parser.count(limit=1), 1)
+
+    def test_parser_count_peek(self):
+        self.base_str = "only tutorial1\n"
+        parser = param.prepare_parser(base_str=self.base_str, base_file=self.base_file)
+        first_dict = next(parser.get_dicts())
+        updated_parser = param.update_parser(parser, ovrwrt_dict={"peeked_key": "peeked_value"})
+        self.assertEqual(updated_parser.count(limit=2), 1)
+        # the first variant was already computed while counting
+        with mock.patch.object(updated_parser, 'get_dicts') as mock_get_dicts:
+            self.assertEqual(updated_parser.first_dict()["shortname"], first_dict["shortname"])
+            self.assertEqual(updated_parser.first_dict()["peeked_key"], "peeked_value")
+            mock_get_dicts.assert_not_called()
+
+    def test_all_vms_session_cache(self):
+        param.clear_session_cache()
+        vms = param.all_vms()
+        with mock.patch('avocado_i2n.params_parser.prepare_params') as mock_prepare_params:
+            self.assertEqual(param.all_vms(), vms)
+            self.assertEqual(param.vm_str(vms[0], ""), param.vm_str(vms[0], ""))
+            mock_prepare_params.assert_not_called()
+
+        # any configuration change should result in reparsing
+        config_file = os.path.join(param.custom_configs_dir, "guest-base.cfg")
+        stat = os.stat(config_file)
+        os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.addCleanup(os.utime, config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        with mock.patch('avocado_i2n.params_parser.prepare_params') as mock_prepare_params:
+            param.all_vms()
+            mock_prepare_params.assert_called_once()
+
+
+class ParserCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = param.ParserCache(self.cache_dir, 1024 * 1024)
+        self.cache_patch = mock.patch('avocado_i2n.params_parser.parser_cache', self.cache)
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_cached_dicts(self):
+        ovrwrt_str = "only tutorial1\n"
+        parser = param.prepare_parser(base_file="sets.cfg", ovrwrt_str=ovrwrt_str)
+        dicts = param.prepare_dicts(base_file="sets.cfg", ovrwrt_str=ovrwrt_str)
+        self.assertEqual(dicts, list(parser.get_dicts()))
+        with mock.patch('avocado_i2n.params_parser.cartesian_config.Parser') as mock_parser:
+            cached_dicts = param.prepare_dicts(base_file="sets.cfg", ovrwrt_str=ovrwrt_str)
+            mock_parser.assert_not_called()
+        self.assertEqual(dicts, cached_dicts)
+
+    def test_cached_empty_product(self):
+        ovrwrt_str = "only nonexistent_variant\n"
+        with self.assertRaises(param.EmptyCartesianProduct):
+            param.prepare_dicts(base_file="sets.cfg", ovrwrt_str=ovrwrt_str)
+        with mock.patch('avocado_i2n.params_parser.cartesian_config.Parser') as mock_parser:
+            with self.assertRaises(param.EmptyCartesianProduct):
+                param.prepare_dicts(base_file="sets.cfg", ovrwrt_str=ovrwrt_str)
+            mock_parser.assert_not_called()
+
+    def test_key_included_files(self):
+        config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_dir)
+        base_file = os.path.join(config_dir, "base.cfg")
+        include_file = os.path.join(config_dir, "included.cfg")
+        with open(base_file, "w") as f:
+            f.write("include included.cfg\n")
+        with open(include_file, "w") as f:
+            f.write("key = value1\n")
+        self.assertEqual(param.included_files(base_file), [base_file, include_file])
+
+        key = self.cache.key(base_file=base_file)
+        self.assertEqual(key, self.cache.key(base_file=base_file))
+        self.assertNotEqual(key, self.cache.key(base_file=base_file, ovrwrt_str="key = value2\n"))
+        self.assertNotEqual(key, self.cache.key(base_file=base_file, limit=1))
+        with open(include_file, "w") as f:
+            f.write("key = value2\n")
+        self.assertNotEqual(key, self.cache.key(base_file=base_file))
+
+    def test_lru_eviction(self):
+        dicts = [{"name": "x" * 1024}]
+        entry_size = len(pickle.dumps(dicts, protocol=pickle.HIGHEST_PROTOCOL))
+        self.cache.size_limit = 2 * entry_size
+        # files which are not cache entries are never removed
+        with open(os.path.join(self.cache_dir, "history"), "w") as f:
+            f.write("x" * 4 * entry_size)
+        self.cache.set("first", dicts)
+        self.cache.set("second", dicts)
+        os.utime(os.path.join(self.cache_dir, "first.dicts"), (0, 0))
+        os.utime(os.path.join(self.cache_dir, "second.dicts"), (1, 1))
+        # using the first entry makes the second one least recently used
+        self.assertEqual(self.cache.get("first"), dicts)
+        self.cache.set("third", dicts)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["first.dicts", "history", "third.dicts"])
+        self.assertIsNone(self.cache.get("second"))
+
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.cache_dir), ["history"])
+        self.assertIsNone(self.cache.get("first"))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import struct
+import os
+
+import unittest_importer
+from avocado_i2n import qcow2
+
+
+def create_qcow2_image(image_path, snapshots, version=3, extra_size=16, backing_file=None):
+    """
+    Create a minimal qcow2 image with only a header and a snapshot table.
+
+    :param str image_path: path to the image to create
+    :param snapshots: snapshot ids, names, vm state sizes, dates, and vm clocks
+    :type snapshots: [(str, str, int, int, int)]
+    :param int version: qcow2 version of the image
+    :param int extra_size: size of the extra data of each snapshot
+    :param backing_file: backing file of the image if any
+    :type backing_file: str or None
+    """
+    snapshots_offset = 0x10000
+    backing_file = backing_file.encode() if backing_file is not None else b""
+    backing_file_offset = 0x1000 if backing_file else 0
+    header = struct.pack(">4sIQIIQIIQQIIQ", qcow2.QCOW2_MAGIC, version, backing_file_offset,
+                         len(backing_file), 16, 1024**3, 0, 0, 0x30000, 0x20000, 1,
+                         len(snapshots), snapshots_offset)
+    table = b""
+    for snapshot_id, name, vm_state_size, date, vm_clock in snapshots:
+        entry = struct.pack(">QIHHIIQII", 0x40000, 0, len(snapshot_id), len(name),
+                            date, 0, vm_clock, min(vm_state_size, 2**32 - 1), extra_size)
+        if extra_size >= 8:
+            entry += struct.pack(">Q", vm_state_size) + b"\0" * (extra_size - 8)
+        else:
+            entry += b"\0" * extra_size
+        entry += snapshot_id.encode() + name.encode()
+        entry += b"\0" * ((8 - len(entry) % 8) % 8)
+        table += entry
+    with open(image_path, "wb") as image:
+        image.write(header)
+        image.seek(backing_file_offset)
+        image.write(backing_file)
+        image.seek(snapshots_offset)
+        image.write(table)
+
+
+class Qcow2Test(unittest.TestCase):
+
+    def setUp(self):
+        self.image_dir = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.image_dir, "image.qcow2")
+
+    def tearDown(self):
+        shutil.rmtree(self.image_dir)
+
+    def test_read_snapshots(self):
+        create_qcow2_image(self.image_path, [("1", "launch", 354418688, 1400242425, 34079000000),
+                                             ("2", "with.dot", 5 * 1024**3, 1400242425, 34079000000),
+                                             ("10", "odd_length_name", 0, 1400242426, 0)])
+        snapshots = qcow2.read_snapshots(self.image_path)
+        self.assertEqual([s.id for s in snapshots], ["1", "2", "10"])
+        self.assertEqual([s.name for s in snapshots], ["launch", "with.dot", "odd_length_name"])
+        # sizes above 4GB are only available from the extra data
+        self.assertEqual([s.vm_state_size for s in snapshots], [354418688, 5 * 1024**3, 0])
+        self.assertEqual([s.date for s in snapshots], [1400242425, 1400242425, 1400242426])
+        self.assertEqual(snapshots[0].vm_clock, 34079000000)
+
+    def test_read_snapshots_v2(self):
+        create_qcow2_image(self.image_path, [("1", "launch", 354418688, 1400242425, 0)],
+                           version=2, extra_size=0)
+        snapshots = qcow2.read_snapshots(self.image_path)
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(snapshots[0].name, "launch")
+        self.assertEqual(snapshots[0].vm_state_size, 354418688)
+
+    def test_read_no_snapshots(self):
+        create_qcow2_image(self.image_path, [])
+        self.assertEqual(qcow2.read_snapshots(self.image_path), [])
+
+    def test_read_backing_file(self):
+        create_qcow2_image(self.image_path, [])
+        self.assertIsNone(qcow2.read_backing_file(self.image_path))
+        create_qcow2_image(self.image_path, [("1", "launch", 0, 0, 0)],
+                           backing_file="/vm1/image.qcow2.states/launch.qcow2")
+        self.assertEqual(qcow2.read_backing_file(self.image_path), "/vm1/image.qcow2.states/launch.qcow2")
+        self.assertEqual([s.name for s in qcow2.read_snapshots(self.image_path)], ["launch"])
+
+    def test_read_invalid(self):
+        with open(self.image_path, "wb") as image:
+            image.write(b"\0" * 1024)
+        self.assertRaises(qcow2.Qcow2Error, qcow2.read_snapshots, self.image_path)
+
+        create_qcow2_image(self.image_path, [("1", "launch", 0, 0, 0)])
+        with open(self.image_path, "r+b") as image:
+            image.truncate(0x10000 + 20)
+        self.assertRaises(qcow2.Qcow2Error, qcow2.read_snapshots, self.image_path)
+
+        self.assertRaises(OSError, qcow2.read_snapshots, os.path.join(self.image_dir, "missing.qcow2"))
+
+
+if __name__ == '__main__':
+    unittest.main()
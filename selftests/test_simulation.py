@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import unittest
+import unittest.mock as mock
+
+from virttest import utils_params
+
+import unittest_importer
+from avocado_i2n import simulation
+from avocado_i2n.history import DurationHistory
+
+
+def create_test_node(params, should_run=True):
+    """
+    Create a minimal test node with the given parameters.
+
+    :param params: parameters of the test node
+    :type params: {str, str}
+    :param bool should_run: whether the test node will be run
+    """
+    test_node = mock.Mock()
+    test_node.params = utils_params.Params(params)
+    test_node.should_run = should_run
+    test_node.is_shared_root.return_value = False
+    return test_node
+
+
+class StateSimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = simulation.StateSimulator(["vm1/install"], costs={"node": 100.0})
+
+    def test_operations(self):
+        self.simulator.run(create_test_node({"shortname": "customize", "vms": "vm1",
+                                             "get_state": "install", "set_state": "customize_vm"}))
+        self.simulator.run(create_test_node({"shortname": "leaf", "vms": "vm1 vm2",
+                                             "get_state_vm1": "customize_vm", "get_state_vm2": "0root"}))
+        self.simulator.run(create_test_node({"shortname": "cleanup", "vms": "vm1",
+                                             "unset_state": "customize_vm"}))
+        self.assertEqual(self.simulator.operations,
+                         [("get", "vm1/install", 10.0), ("node", "customize", 100.0),
+                          ("set", "vm1/customize_vm", 30.0),
+                          # root states are not retrieved
+                          ("get", "vm1/customize_vm", 10.0), ("node", "leaf", 100.0),
+                          ("unset", "vm1/customize_vm", 5.0), ("node", "cleanup", 100.0)])
+        self.assertEqual(self.simulator.states, {"vm1/install"})
+        self.assertEqual(self.simulator.missing_states, [])
+        self.assertEqual(self.simulator.estimated_time, 355.0)
+
+        self.simulator.run(create_test_node({"shortname": "leaf", "vms": "vm1",
+                                             "get_state": "customize_vm"}))
+        self.assertEqual(self.simulator.missing_states, ["vm1/customize_vm"])
+        report = self.simulator.report()
+        self.assertIn("# 3 get, 4 node, 1 set, 1 unset\n", report)
+        self.assertIn("# missing states: vm1/customize_vm\n", report)
+        self.assertTrue(report.endswith("# estimated duration: 465.00 s\n"))
+
+    def test_history_estimates(self):
+        durations = DurationHistory("")
+        durations._estimates = {"node": {"customize": 50.0}, "get": {"vm1/install": 2.0},
+                                "set": {}, "unset": {}}
+        self.simulator.durations = durations
+        self.simulator.run(create_test_node({"shortname": "customize", "vms": "vm1",
+                                             "get_state": "install", "set_state": "customize_vm"}))
+        self.assertEqual(self.simulator.operations,
+                         [("get", "vm1/install", 2.0), ("node", "customize", 50.0),
+                          ("set", "vm1/customize_vm", 30.0)])
+        # the known duration of a test node includes its state operations
+        self.assertEqual(self.simulator.estimated_time, 50.0)
+        self.simulator.run(create_test_node({"shortname": "leaf", "vms": "vm1",
+                                             "get_state": "customize_vm"}))
+        self.assertEqual(self.simulator.estimated_time, 160.0)
+
+    def test_seed(self):
+        graph = mock.Mock()
+        graph.nodes = [create_test_node({"shortname": "install", "vms": "vm1", "set_state": "install"}, False),
+                       create_test_node({"shortname": "customize", "vms": "vm1", "set_state": "customize_vm"}),
+                       create_test_node({"shortname": "leaf", "vms": "vm1 vm2", "set_state_vm2": "leaf"}, False)]
+        simulator = simulation.StateSimulator()
+        self.assertFalse(simulator.synthetic)
+        simulator.seed(graph)
+        self.assertEqual(simulator.states, {"vm1/install", "vm2/leaf"})
+
+
+if __name__ == '__main__':
+    unittest.main()
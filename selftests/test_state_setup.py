@@ -3,6 +3,9 @@
 import unittest
 import unittest.mock as mock
 import os
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from avocado.core import exceptions
 from avocado.utils import process
@@ -11,11 +14,14 @@ from virttest import utils_params
 
 import unittest_importer
 from avocado_i2n import state_setup
+from avocado_i2n.history import DurationHistory
+from test_qcow2 import create_qcow2_image
 
 
 @mock.patch('os.mkdir', mock.Mock(return_value=0))
 @mock.patch('os.rmdir', mock.Mock(return_value=0))
 @mock.patch('os.unlink', mock.Mock(return_value=0))
+@mock.patch('avocado_i2n.state_setup.history.duration_history', DurationHistory(""))
 class StateSetupTest(unittest.TestCase):
 
     @classmethod
@@ -36,6 +42,8 @@ class StateSetupTest(unittest.TestCase):
 
         self.exist_switch = True
 
+        state_setup.clear_lv_reports()
+
     def _get_mock_vm(self, vm_name):
         return self.mock_vms[vm_name]
 
@@ -45,6 +53,13 @@ class StateSetupTest(unittest.TestCase):
             self.mock_vms[vm_name].name = vm_name
             self.mock_vms[vm_name].params = self.run_params.object_params(vm_name)
 
+    def _lv_report_result(self, lv_names):
+        result = mock.MagicMock(name='result')
+        result.exit_status = 0
+        volumes = [{"lv_name": lv_name, "lv_attr": "Vwi-a-tz--"} for lv_name in lv_names]
+        result.stdout_text = json.dumps({"report": [{"lv": volumes}]})
+        return result
+
     def _file_exists(self, filepath):
         # ignore ramdisk states which are too prone to errors
         if filepath.endswith(".state"):
@@ -52,16 +67,18 @@ class StateSetupTest(unittest.TestCase):
         else:
             return self.exist_switch
 
-    @mock.patch('avocado_i2n.state_setup.lv_utils')
-    def test_show_states_offline(self, mock_lv_utils):
+    @mock.patch('avocado_i2n.state_setup.process')
+    def test_show_states_offline(self, mock_process):
         self.run_params["vms"] = "vm1"
         self.run_params["check_type_vm1"] = "offline"
         self.run_params["vg_name_vm1"] = "ramdisk_vm1"
         self._create_mock_vms()
 
-        mock_lv_utils.lv_list.return_value = ["launch1", "launch2"]
+        mock_process.run.return_value = self._lv_report_result(["launch1", "launch2"])
         states = state_setup.show_states(self.run_params, self.env)
-        mock_lv_utils.lv_list.assert_called_once_with("ramdisk_vm1")
+        mock_process.run.assert_called_once()
+        self.assertTrue(mock_process.run.call_args[0][0].startswith("lvs --reportformat json"))
+        self.assertTrue(mock_process.run.call_args[0][0].endswith(" ramdisk_vm1"))
 
         self.assertIn("launch1", states)
         self.assertIn("launch2", states)
@@ -115,6 +132,33 @@ class StateSetupTest(unittest.TestCase):
         mock_lv_utils.lv_check.assert_called_once_with("ramdisk_vm1", "launch")
         self.assertFalse(exists)
 
+    @mock.patch('avocado_i2n.state_setup.process')
+    def test_show_states_online_native(self, mock_process):
+        # directories cannot be created with the mocked os.mkdir
+        image_file = tempfile.NamedTemporaryFile(suffix=".qcow2")
+        self.addCleanup(image_file.close)
+        image_name = image_file.name[:-len(".qcow2")]
+        self.run_params["vms"] = "vm1"
+        self.run_params["check_type_vm1"] = "online"
+        self.run_params["qemu_img_binary"] = "qemu-img"
+        self.run_params["image_name_vm1"] = image_name
+        self._create_mock_vms()
+
+        create_qcow2_image(image_file.name,
+                           [("1", "launch", 354418688, 1400242425, 34079000000),
+                            ("2", "with.dot", 35970351104, 1400242425, 34079000000)])
+        native_states = state_setup.show_states(self.run_params, self.env)
+        mock_process.system_output.assert_not_called()
+
+        # the same states as listed by qemu-img for an equivalent image
+        self.run_params["image_name_vm1"] = image_name + "_missing"
+        self._create_mock_vms()
+        mock_process.system_output.return_value = (b"1         launch   338M 2014-05-16 12:13:45   00:00:34.079"
+                                                   b"2         with.dot   33.5G 2014-05-16 12:13:45   00:00:34.079")
+        listed_states = state_setup.show_states(self.run_params, self.env)
+        mock_process.system_output.assert_called_once_with("qemu-img snapshot -l %s_missing.qcow2 -U" % image_name)
+        self.assertEqual(native_states, listed_states)
+
     @mock.patch('avocado_i2n.state_setup.process')
     def test_check_online(self, mock_process):
         self.run_params["vms"] = "vm1"
@@ -181,6 +225,73 @@ class StateSetupTest(unittest.TestCase):
         mock_lv_utils.lv_check.assert_called_once_with("ramdisk_vm1", "launch")
         self.assertTrue(exists)
 
+    @mock.patch('avocado_i2n.state_setup.process')
+    @mock.patch('avocado_i2n.state_setup.lv_utils')
+    def test_check_inventory(self, mock_lv_utils, mock_process):
+        self.run_params["vms"] = "vm1"
+        self.run_params["qemu_img_binary"] = "qemu-img"
+        self.run_params["image_name_vm1"] = "/vm1/image"
+        self.run_params["vg_name_vm1"] = "ramdisk_vm1"
+        self._create_mock_vms()
+
+        mock_process.system_output.return_value = b"1         launch   338M 2014-05-16 12:13:45   00:00:34.079"
+        mock_process.run.return_value = self._lv_report_result(["launch1", "launch2"])
+        inventory = state_setup.StateInventory()
+        for state, check_type, present in [("launch", "online", True), ("launch1", "online", False),
+                                           ("launch1", "offline", True), ("launch2", "offline", True),
+                                           ("launch3", "offline", False), ("launch2", "any", True)]:
+            self.run_params["check_state_vm1"] = state
+            self.run_params["check_type_vm1"] = check_type
+            exists = state_setup.check_state(self.run_params, self.env, inventory=inventory)
+            self.assertEqual(exists, present)
+        # each image and volume group is listed only once
+        mock_process.system_output.assert_called_once_with("qemu-img snapshot -l /vm1/image.qcow2 -U")
+        mock_process.run.assert_called_once()
+        mock_lv_utils.lv_check.assert_not_called()
+
+    @mock.patch('avocado_i2n.state_setup.process')
+    @mock.patch('avocado_i2n.state_setup.lv_utils')
+    def test_lv_report(self, _mock_lv_utils, mock_process):
+        mock_process.run.return_value = self._lv_report_result(["current_state", "launch"])
+        report = state_setup.lv_report("ramdisk_vm1")
+        self.assertEqual(list(report.keys()), ["current_state", "launch"])
+        self.assertEqual(report["launch"]["lv_attr"], "Vwi-a-tz--")
+        state_setup.lv_report("ramdisk_vm1")
+        mock_process.run.assert_called_once()
+
+        # mutating operations refresh the report
+        self.run_params["vms"] = "vm1"
+        self.run_params["set_state_vm1"] = "launch2"
+        self.run_params["set_type_vm1"] = "offline"
+        self.run_params["set_mode_vm1"] = "ff"
+        self.run_params["vg_name_vm1"] = "ramdisk_vm1"
+        self.run_params["lv_pointer_name"] = "current_state"
+        self._create_mock_vms()
+        state_setup.set_state(self.run_params, self.env)
+        mock_process.run.return_value = self._lv_report_result(["current_state", "launch", "launch2"])
+        report = state_setup.lv_report("ramdisk_vm1")
+        self.assertIn("launch2", report)
+        self.assertEqual(mock_process.run.call_count, 2)
+
+        # missing volume groups have no logical volumes
+        mock_process.run.return_value.exit_status = 5
+        self.assertEqual(len(state_setup.lv_report("ramdisk_vm2")), 0)
+
+    @mock.patch('avocado_i2n.state_setup.process')
+    @mock.patch('avocado_i2n.state_setup.lv_utils')
+    def test_lv_report_external_change(self, _mock_lv_utils, mock_process):
+        self.run_params["vms"] = "vm1"
+        self.run_params["check_type_vm1"] = "offline"
+        self.run_params["vg_name_vm1"] = "ramdisk_vm1"
+        self._create_mock_vms()
+
+        mock_process.run.return_value = self._lv_report_result(["current_state", "launch"])
+        self.assertNotIn("launch2", state_setup.lv_report("ramdisk_vm1"))
+        # another process creates a state after this process reported the volumes
+        mock_process.run.return_value = self._lv_report_result(["current_state", "launch", "launch2"])
+        self.assertIn("launch2", state_setup.show_states(self.run_params, self.env))
+        self.assertEqual(mock_process.run.call_count, 2)
+
     @mock.patch('avocado_i2n.state_setup.process')
     @mock.patch('avocado_i2n.state_setup.lv_utils')
     def test_check_any_none(self, mock_lv_utils, mock_process):
@@ -224,6 +335,37 @@ class StateSetupTest(unittest.TestCase):
             state_setup.get_state(self.run_params, self.env)
         mock_lv_utils.lv_check.assert_called_once_with("ramdisk_vm1", "launch")
 
+    @mock.patch('avocado_i2n.state_setup.lvm_shell')
+    @mock.patch('avocado_i2n.state_setup.lv_utils')
+    def test_get_offline_lvm_shell(self, mock_lv_utils, mock_lvm_shell):
+        self.run_params["vms"] = "vm2"
+        self.run_params["get_state_vm2"] = "launch"
+        self.run_params["get_type_vm2"] = "offline"
+        self.run_params["get_mode_vm2"] = "rx"
+        self.run_params["lv_pointer_name"] = "current_state"
+        self.run_params["vg_name_vm2"] = "ramdisk_vm2"
+        self.run_params["lvm_shell"] = "yes"
+        self._create_mock_vms()
+
+        self.mock_vms["vm2"].is_alive.return_value = False
+        shell = mock_lvm_shell.get_shell.return_value
+        shell.lv_check.return_value = True
+        state_setup.get_state(self.run_params, self.env)
+        shell.lv_check.assert_called_once_with('ramdisk_vm2', 'launch')
+        shell.lv_remove.assert_called_once_with('ramdisk_vm2', 'current_state')
+        shell.lv_take_snapshot.assert_called_once_with('ramdisk_vm2', 'launch', 'current_state')
+        mock_lv_utils.lv_check.assert_not_called()
+        mock_lv_utils.lv_remove.assert_not_called()
+        # the shell is released but kept running for the rest of the job
+        mock_lvm_shell.release_shell.assert_called_once_with()
+        mock_lvm_shell.close_shell.assert_not_called()
+
+        mock_lvm_shell.reset_mock()
+        shell.lv_check.return_value = False
+        with self.assertRaises(exceptions.TestError):
+            state_setup.get_state(self.run_params, self.env)
+        mock_lvm_shell.release_shell.assert_called_once_with()
+
     @mock.patch('avocado_i2n.state_setup.lv_utils')
     def test_get_offline_rx(self, mock_lv_utils):
         self.run_params["vms"] = "vm2"
@@ -805,6 +947,95 @@ class StateSetupTest(unittest.TestCase):
         mock_process.system_output.assert_called_once_with("qemu-img snapshot -l /vm1/image.qcow2 -U")
         mock_lv_utils.lv_check.assert_called_once_with("ramdisk_vm1", "launch")
 
+    @mock.patch('os.rename')
+    @mock.patch('avocado_i2n.state_setup.process')
+    @mock.patch('avocado_i2n.state_setup.lv_utils')
+    def test_file_backend(self, mock_lv_utils, mock_process, mock_rename):
+        self.run_params["vms"] = "vm1"
+        self.run_params["offline_backend"] = "file"
+        self.run_params["image_name_vm1"] = "/vm1/image"
+        self.run_params["set_state_vm1"] = "launch"
+        self.run_params["set_type_vm1"] = "offline"
+        self.run_params["set_mode_vm1"] = "ff"
+        self.run_params["get_state_vm1"] = "launch"
+        self.run_params["get_type_vm1"] = "offline"
+        self.run_params["get_mode_vm1"] = "ra"
+        self.run_params["unset_state_vm1"] = "launch"
+        self.run_params["unset_type_vm1"] = "offline"
+        self.run_params["unset_mode_vm1"] = "fa"
+        self._create_mock_vms()
+
+        self.exist_switch = False
+        state_setup.set_state(self.run_params, self.env)
+        mock_process.run.assert_called_once_with("cp --reflink=auto --sparse=always "
+                                                 "/vm1/image.qcow2 /vm1/image.qcow2.states/launch.qcow2.part")
+        mock_rename.assert_called_once_with("/vm1/image.qcow2.states/launch.qcow2.part",
+                                            "/vm1/image.qcow2.states/launch.qcow2")
+
+        self.exist_switch = True
+        mock_process.reset_mock()
+        mock_rename.reset_mock()
+        self.mock_vms["vm1"].is_alive.return_value = False
+        state_setup.get_state(self.run_params, self.env)
+        mock_process.run.assert_called_once_with("cp --reflink=auto --sparse=always "
+                                                 "/vm1/image.qcow2.states/launch.qcow2 /vm1/image.qcow2.part")
+        mock_rename.assert_called_once_with("/vm1/image.qcow2.part", "/vm1/image.qcow2")
+
+        mock_process.reset_mock()
+        with mock.patch('avocado_i2n.state_setup.os.unlink') as mock_unlink:
+            state_setup.unset_state(self.run_params, self.env)
+            mock_unlink.assert_called_once_with("/vm1/image.qcow2.states/launch.qcow2")
+        mock_process.run.assert_not_called()
+
+        # no LVM is involved in any of the operations
+        self.assertEqual(mock_lv_utils.mock_calls, [])
+
+    @mock.patch('os.rename')
+    @mock.patch('avocado_i2n.state_setup.process')
+    def test_overlay_backend(self, mock_process, mock_rename):
+        self.run_params["vms"] = "vm1"
+        self.run_params["offline_backend"] = "overlay"
+        self.run_params["qemu_img_binary"] = "qemu-img"
+        self.run_params["image_name_vm1"] = "/vm1/image"
+        self.run_params["get_state_vm1"] = "launch"
+        self.run_params["get_type_vm1"] = "offline"
+        self.run_params["get_mode_vm1"] = "ra"
+        self.run_params["set_state_vm1"] = "launch2"
+        self.run_params["set_type_vm1"] = "offline"
+        self.run_params["set_mode_vm1"] = "ff"
+        self.run_params["unset_state_vm1"] = "launch"
+        self.run_params["unset_type_vm1"] = "offline"
+        self.run_params["unset_mode_vm1"] = "fa"
+        self._create_mock_vms()
+        self.mock_vms["vm1"].is_alive.return_value = False
+
+        # retrieving a state only creates a new overlay over it
+        state_setup.get_state(self.run_params, self.env)
+        mock_process.run.assert_called_once_with("qemu-img create -f qcow2 -F qcow2 -b "
+                                                 "/vm1/image.qcow2.states/launch.qcow2 /vm1/image.qcow2.part")
+        mock_rename.assert_called_once_with("/vm1/image.qcow2.part", "/vm1/image.qcow2")
+
+        # saving a state flattens the overlay
+        mock_process.reset_mock()
+        mock_rename.reset_mock()
+        self.exist_switch = False
+        state_setup.set_state(self.run_params, self.env)
+        mock_process.run.assert_called_once_with("qemu-img convert -O qcow2 /vm1/image.qcow2 "
+                                                 "/vm1/image.qcow2.states/launch2.qcow2.part")
+        mock_rename.assert_called_once_with("/vm1/image.qcow2.states/launch2.qcow2.part",
+                                            "/vm1/image.qcow2.states/launch2.qcow2")
+
+        # removing the state of the current overlay detaches the overlay
+        mock_process.reset_mock()
+        self.exist_switch = True
+        with mock.patch('avocado_i2n.state_setup.qcow2.read_backing_file') as mock_backing_file, \
+                mock.patch('avocado_i2n.state_setup.os.unlink') as mock_unlink:
+            mock_backing_file.return_value = "/vm1/image.qcow2.states/launch.qcow2"
+            state_setup.unset_state(self.run_params, self.env)
+            mock_backing_file.assert_called_once_with("/vm1/image.qcow2")
+            mock_unlink.assert_called_once_with("/vm1/image.qcow2.states/launch.qcow2")
+        mock_process.run.assert_called_once_with("qemu-img rebase -b '' /vm1/image.qcow2")
+
     @mock.patch('avocado_i2n.state_setup.lv_utils')
     def test_check_root(self, mock_lv_utils):
         self.run_params["vms"] = "vm1"
@@ -1112,6 +1343,91 @@ class StateSetupTest(unittest.TestCase):
         mock_lv_utils.lv_create.assert_called_once_with('ramdisk_vm3', 'LogVol', '30G', pool_name='thin_pool', pool_size='30G')
         mock_lv_utils.lv_take_snapshot.assert_called_once_with('ramdisk_vm3', 'LogVol', 'current_state')
 
+    @mock.patch('avocado_i2n.state_setup.process')
+    @mock.patch('avocado_i2n.state_setup.lv_utils')
+    def test_set_multivm_parallel(self, mock_lv_utils, _mock_process):
+        self.run_params["vms"] = "vm2 vm3 vm4"
+        self.run_params["parallel_states"] = "yes"
+        self.run_params["set_state_vm2"] = "launch2"
+        self.run_params["set_state_vm3"] = "launch3"
+        self.run_params["set_state_vm4"] = "launch4"
+        self.run_params["set_type"] = "offline"
+        self.run_params["set_mode_vm2"] = "af"
+        self.run_params["set_mode_vm3"] = "ff"
+        self.run_params["set_mode_vm4"] = "af"
+        self.run_params["lv_name"] = "LogVol"
+        self.run_params["lv_pointer_name"] = "current_state"
+        self.run_params["vg_name_vm2"] = "ramdisk_vm2"
+        self.run_params["vg_name_vm3"] = "ramdisk_vm3"
+        self.run_params["vg_name_vm4"] = "ramdisk_vm4"
+        self.run_params["skip_types"] = "online"
+        self._create_mock_vms()
+        self.exist_switch = False
+
+        # the states of vm2 and vm4 exist and are to be aborted on
+        def lv_check_side_effect(_vgname, lvname):
+            return True if lvname in ["launch2", "launch4"] else False
+        mock_lv_utils.lv_check.side_effect = lv_check_side_effect
+
+        with self.assertRaises(exceptions.TestAbortError) as context:
+            state_setup.set_state(self.run_params, self.env)
+        # the error of the first vm is raised independently of completion order
+        self.assertIn("vm2", str(context.exception))
+        self.assertIn(mock.call("ramdisk_vm2", "launch2"), mock_lv_utils.lv_check.call_args_list)
+
+        # operations of vms following the failed vm are not started
+        mock_lv_utils.reset_mock()
+        mock_lv_utils.lv_check.side_effect = lv_check_side_effect
+        with mock.patch('avocado_i2n.state_setup.ThreadPoolExecutor',
+                        lambda max_workers: ThreadPoolExecutor(max_workers=1)):
+            with self.assertRaises(exceptions.TestAbortError) as context:
+                state_setup.set_state(self.run_params, self.env)
+        self.assertIn("vm2", str(context.exception))
+        mock_lv_utils.lv_check.assert_called_once_with("ramdisk_vm2", "launch2")
+        mock_lv_utils.lv_take_snapshot.assert_not_called()
+
+    @mock.patch('avocado_i2n.state_setup.lvm_shell')
+    @mock.patch('avocado_i2n.state_setup.lv_utils')
+    def test_set_multivm_parallel_root(self, mock_lv_utils, mock_lvm_shell):
+        self.run_params["vms"] = "vm2 vm3"
+        self.run_params["parallel_states"] = "yes"
+        self.run_params["lvm_shell"] = "yes"
+        self.run_params["set_state"] = "root"
+        self.run_params["set_type"] = "offline"
+        self.run_params["set_mode"] = "ff"
+        self.run_params["lv_name"] = "LogVol"
+        self.run_params["lv_size"] = "30G"
+        self.run_params["pool_name"] = "thin_pool"
+        self.run_params["pool_size"] = "30G"
+        self.run_params["lv_pointer_name"] = "current_state"
+        self.run_params["use_tmpfs"] = "yes"
+        self.run_params["ramdisk_basedir"] = "/tmp"
+        self.run_params["ramdisk_vg_size"] = "40000"
+        for vm_name in ["vm2", "vm3"]:
+            self.run_params["vg_name_%s" % vm_name] = "ramdisk_%s" % vm_name
+            self.run_params["image_name_%s" % vm_name] = "/%s/image" % vm_name
+            self.run_params["ramdisk_sparse_filename_%s" % vm_name] = "virtual_hdd_%s" % vm_name
+        self._create_mock_vms()
+        self.exist_switch = False
+
+        shell = mock_lvm_shell.get_shell.return_value
+        shell.lv_check.return_value = False
+        shell.vg_check.return_value = False
+        with mock.patch('avocado_i2n.state_setup.clear_lv_reports',
+                        wraps=state_setup.clear_lv_reports) as mock_clear:
+            state_setup.set_state(self.run_params, self.env)
+        # the nested root operations keep the reports and shell of the other vm
+        self.assertEqual(mock_clear.call_args_list.count(mock.call()), 1)
+        mock_lvm_shell.release_shell.assert_called_once_with()
+        mock_lvm_shell.close_shell.assert_not_called()
+        shell.vg_check.assert_has_calls([mock.call("ramdisk_vm2"), mock.call("ramdisk_vm3")],
+                                        any_order=True)
+        shell.lv_take_snapshot.assert_has_calls([mock.call("ramdisk_vm2", "LogVol", "current_state"),
+                                                 mock.call("ramdisk_vm3", "LogVol", "current_state")],
+                                                any_order=True)
+        mock_lv_utils.vg_check.assert_not_called()
+        self.assertEqual(mock_lv_utils.vg_ramdisk.call_count, 2)
+
     @mock.patch('avocado_i2n.state_setup.process')
     @mock.patch('avocado_i2n.state_setup.lv_utils')
     def test_unset_multivm(self, mock_lv_utils, _mock_process):